@@ -6,6 +6,8 @@ from sqlalchemy import select, update
 from datetime import datetime, timezone
 from app.database import APIKey, get_db, hash_api_key
 from app.models import User, UserRole
+from app.scheduler import resolve_lane, set_lane
+from app.timing import timed
 import logging
 
 logger = logging.getLogger(__name__)
@@ -14,59 +16,66 @@ security = HTTPBearer()
 
 async def verify_api_key(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    x_priority: Optional[str] = Header(None, description="Run this request in a lower priority lane (bulk)")
 ) -> User:
     """
     Verify API key and return user information
+    Also selects the priority lane of the request's backend calls.
     """
-    api_key = credentials.credentials
-    
-    if not api_key:
-        raise HTTPException(
-            status_code=401,
-            detail="API key is required"
+    with timed("auth"):
+        api_key = credentials.credentials
+        
+        if not api_key:
+            raise HTTPException(
+                status_code=401,
+                detail="API key is required"
+            )
+        
+        # Hash the provided API key
+        api_key_hash = hash_api_key(api_key)
+        
+        # Query database for the API key
+        result = await db.execute(
+            select(APIKey).where(APIKey.api_key_hash == api_key_hash)
         )
-    
-    # Hash the provided API key
-    api_key_hash = hash_api_key(api_key)
-    
-    # Query database for the API key
-    result = await db.execute(
-        select(APIKey).where(APIKey.api_key_hash == api_key_hash)
-    )
-    key_record = result.scalar_one_or_none()
-    
-    if not key_record:
-        logger.warning(f"Invalid API key attempt")
-        raise HTTPException(
-            status_code=403,
-            detail="Invalid API key"
+        key_record = result.scalar_one_or_none()
+        
+        if not key_record:
+            logger.warning(f"Invalid API key attempt")
+            raise HTTPException(
+                status_code=403,
+                detail="Invalid API key"
+            )
+        
+        if not key_record.is_active:
+            logger.warning(f"Inactive API key used: {key_record.username}")
+            raise HTTPException(
+                status_code=403,
+                detail="API key is inactive"
+            )
+        
+        # Update last used timestamp
+        await db.execute(
+            update(APIKey)
+            .where(APIKey.api_key_hash == api_key_hash)
+            .values(last_used_at=datetime.now(timezone.utc))
         )
-    
-    if not key_record.is_active:
-        logger.warning(f"Inactive API key used: {key_record.username}")
-        raise HTTPException(
-            status_code=403,
-            detail="API key is inactive"
+        await db.commit()
+        
+        lane = resolve_lane(key_record.priority, key_record.role, x_priority)
+        set_lane(lane)
+        
+        # Return user information
+        return User(
+            username=key_record.username,
+            role=UserRole(key_record.role),
+            rate_limit=key_record.rate_limit,
+            priority=lane,
+            is_active=key_record.is_active,
+            created_at=key_record.created_at,
+            last_used_at=key_record.last_used_at
         )
-    
-    # Update last used timestamp
-    await db.execute(
-        update(APIKey)
-        .where(APIKey.api_key_hash == api_key_hash)
-        .values(last_used_at=datetime.now(timezone.utc))
-    )
-    await db.commit()
-    
-    # Return user information
-    return User(
-        username=key_record.username,
-        role=UserRole(key_record.role),
-        rate_limit=key_record.rate_limit,
-        is_active=key_record.is_active,
-        created_at=key_record.created_at,
-        last_used_at=key_record.last_used_at
-    )
 
 async def verify_admin(user: User = Depends(verify_api_key)) -> User:
     """
@@ -0,0 +1,562 @@
+"""
+Batch jobs for offline bulk inference
+
+A job is a JSONL file of /api/generate and /api/chat requests, one per line:
+
+    {"custom_id": "eval-1", "url": "/api/chat", "body": {"model": "...", "messages": [...]}}
+
+Uploads are stored on disk and run in the background by whichever worker
+claims them, with a bounded number of requests in flight. Batch requests
+run in the bulk priority lane; with lanes enabled (PRIORITY_SLOTS_PER_SERVER)
+they only use backend capacity that interactive traffic leaves spare, with
+lanes off they compete with it like any other request. Results are appended to an output JSONL file as they finish,
+and every request is recorded in usage_logs with the job's batch_id.
+
+Every request counts against the owner's rate limit like an interactive
+one. Once the limit is reached the job waits for the next window instead of
+failing its remaining requests.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Set, Tuple
+import asyncio
+import logging
+import os
+import secrets
+import shutil
+import time
+from fastapi import HTTPException
+from sqlalchemy import select, update, func, and_, or_
+from sqlalchemy.orm import aliased
+from app import jsonutil
+from app.config import settings
+from app.database import AsyncSessionLocal, APIKey, BatchJob, UsageLog
+from app.load_balancer import load_balancer, BackendStatusError
+from app.limiter import OverloadedError
+from app.models import User, UserRole
+from app.monitoring import observe_generation
+from app.passthrough import parse_generate, parse_chat
+from app.rate_limiter import rate_limiter
+from app.scheduler import QueueTimeoutError, set_lane
+
+logger = logging.getLogger(__name__)
+
+JOB_PREFIX = "batch_"
+BATCH_URLS = ("/api/generate", "/api/chat")
+
+PROGRESS_INTERVAL = 2.0  # Seconds between progress saves (also the heartbeat)
+RATE_LIMIT_POLL = 60  # Max seconds between rate limit checks of a job over its limit
+HEARTBEAT_TIMEOUT = 60  # A running job without a heartbeat this long is taken over
+
+class BatchValidationError(Exception):
+    """The uploaded file is not a valid batch"""
+
+class _JobCancelled(Exception):
+    """The job was cancelled before this request was sent"""
+
+def job_dir(job_id: str) -> str:
+    return os.path.join(settings.batch_dir, job_id)
+
+def input_path(job_id: str) -> str:
+    return os.path.join(job_dir(job_id), "input.jsonl")
+
+def output_path(job_id: str) -> str:
+    return os.path.join(job_dir(job_id), "output.jsonl")
+
+def new_job_id() -> str:
+    return JOB_PREFIX + secrets.token_urlsafe(12)
+
+def validate_batch_file(path: str) -> int:
+    """Check every line of an uploaded batch; returns the number of requests"""
+    seen: Set[str] = set()
+    count = 0
+    with open(path, "rb") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                item = jsonutil.loads(line)
+            except jsonutil.JSONDecodeError:
+                raise BatchValidationError(f"Line {line_number}: invalid JSON")
+            if not isinstance(item, dict):
+                raise BatchValidationError(f"Line {line_number}: expected a JSON object")
+            custom_id = item.get("custom_id")
+            if not isinstance(custom_id, str) or not custom_id:
+                raise BatchValidationError(f"Line {line_number}: 'custom_id' must be a non-empty string")
+            if custom_id in seen:
+                raise BatchValidationError(f"Line {line_number}: duplicate custom_id '{custom_id}'")
+            if item.get("url") not in BATCH_URLS:
+                raise BatchValidationError(f"Line {line_number}: 'url' must be one of {', '.join(BATCH_URLS)}")
+            body = item.get("body")
+            if not isinstance(body, dict) or not isinstance(body.get("model"), str):
+                raise BatchValidationError(f"Line {line_number}: 'body' must be an object with a 'model'")
+            if body.get("stream") is True:
+                raise BatchValidationError(f"Line {line_number}: streaming is not supported in batches")
+            seen.add(custom_id)
+            count += 1
+    if count == 0:
+        raise BatchValidationError("The file contains no requests")
+    if count > settings.batch_max_requests:
+        raise BatchValidationError(f"A batch may contain at most {settings.batch_max_requests} requests")
+    return count
+
+def _read_done(path: str) -> Tuple[Set[str], int, int]:
+    """custom_ids already in an output file and the succeeded/failed counts (for resuming a job)"""
+    done = set()
+    failed = 0
+    try:
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    result = jsonutil.loads(line)
+                    done.add(result["custom_id"])
+                except (ValueError, KeyError, TypeError):
+                    continue
+                if "error" in result:
+                    failed += 1
+    except FileNotFoundError:
+        pass
+    return done, len(done) - failed, failed
+
+def _read_lines(f, count: int) -> List[bytes]:
+    lines = []
+    while len(lines) < count:
+        line = f.readline()
+        if not line:
+            break
+        if line.strip():
+            lines.append(line)
+    return lines
+
+def _append(path: str, data: bytes):
+    with open(path, "ab") as f:
+        f.write(data)
+
+def _save_upload(source, path: str) -> int:
+    """Copy an uploaded file to disk, enforcing the size limit"""
+    size = 0
+    with open(path, "wb") as f:
+        while chunk := source.read(1024 * 1024):
+            size += len(chunk)
+            if size > settings.batch_max_file_bytes:
+                raise BatchValidationError(f"The file exceeds {settings.batch_max_file_bytes} bytes")
+            f.write(chunk)
+    return size
+
+async def create_job(username: str, filename: Optional[str], source) -> BatchJob:
+    """Store and validate an uploaded batch file and queue it"""
+    job_id = new_job_id()
+    os.makedirs(job_dir(job_id))
+    try:
+        await asyncio.to_thread(_save_upload, source, input_path(job_id))
+        total = await asyncio.to_thread(validate_batch_file, input_path(job_id))
+    except Exception:
+        delete_job_files(job_id)
+        raise
+    
+    async with AsyncSessionLocal() as db:
+        job = BatchJob(
+            id=job_id,
+            username=username,
+            status="queued",
+            filename=filename,
+            total_requests=total
+        )
+        db.add(job)
+        await db.commit()
+        await db.refresh(job)
+    logger.info(f"Batch job {job_id} queued by {username} ({total} requests)")
+    return job
+
+async def _owner(username: str) -> User:
+    """The job owner's account, whose rate limit the job's requests count against"""
+    async with AsyncSessionLocal() as db:
+        key_record = (await db.execute(
+            select(APIKey).where(APIKey.username == username, APIKey.is_active.is_(True))
+        )).scalars().first()
+    if key_record is None:
+        raise ValueError(f"User {username} has no active API key")
+    return User(
+        username=key_record.username,
+        role=UserRole(key_record.role),
+        rate_limit=key_record.rate_limit,
+        is_active=key_record.is_active,
+        created_at=key_record.created_at,
+        last_used_at=key_record.last_used_at
+    )
+
+async def get_job(job_id: str) -> Optional[BatchJob]:
+    async with AsyncSessionLocal() as db:
+        return await db.get(BatchJob, job_id)
+
+async def list_jobs(username: Optional[str] = None, limit: int = 100) -> List[BatchJob]:
+    """Most recent jobs, of one user or of everyone"""
+    async with AsyncSessionLocal() as db:
+        query = select(BatchJob).order_by(BatchJob.created_at.desc()).limit(limit)
+        if username:
+            query = query.where(BatchJob.username == username)
+        return list((await db.execute(query)).scalars().all())
+
+async def cancel_job(job_id: str) -> Optional[str]:
+    """
+    Cancel a job: queued jobs stop immediately, running ones finish the
+    requests in flight first. Returns the new status.
+    """
+    async with AsyncSessionLocal() as db:
+        job = await db.get(BatchJob, job_id)
+        if job is None:
+            return None
+        if job.status == "queued":
+            job.status = "cancelled"
+            job.completed_at = datetime.now(timezone.utc)
+        elif job.status == "running":
+            job.status = "cancelling"
+        await db.commit()
+        return job.status
+
+def job_info(job: BatchJob) -> dict:
+    return {
+        "id": job.id,
+        "username": job.username,
+        "status": job.status,
+        "filename": job.filename,
+        "total_requests": job.total_requests,
+        "completed_requests": job.completed_requests,
+        "failed_requests": job.failed_requests,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "completed_at": job.completed_at
+    }
+
+async def job_usage(job_id: str) -> dict:
+    """Token usage of a job, from usage_logs"""
+    async with AsyncSessionLocal() as db:
+        row = (await db.execute(
+            select(
+                func.count(UsageLog.id),
+                func.coalesce(func.sum(UsageLog.prompt_tokens), 0),
+                func.coalesce(func.sum(UsageLog.completion_tokens), 0),
+                func.coalesce(func.sum(UsageLog.total_tokens), 0)
+            ).where(UsageLog.batch_id == job_id)
+        )).one()
+    return {
+        "requests": row[0],
+        "prompt_tokens": row[1],
+        "completion_tokens": row[2],
+        "total_tokens": row[3]
+    }
+
+def delete_job_files(job_id: str):
+    shutil.rmtree(job_dir(job_id), ignore_errors=True)
+
+class _JobRun:
+    """State of the job this worker is processing"""
+    
+    def __init__(self, job: BatchJob):
+        self.job_id = job.id
+        self.username = job.username
+        self.owner: Optional[User] = None
+        self.completed = job.completed_requests
+        self.failed = job.failed_requests
+        self.cancel_requested = asyncio.Event()
+        self.not_sent = 0  # Requests dropped because the job was cancelled while they waited
+        self.in_flight = 0
+        self.write_lock = asyncio.Lock()
+        self.rate_limit_lock = asyncio.Lock()  # The limiter's first insert of a window races with itself
+    
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_requested.is_set()
+    
+    async def wait(self, seconds: float):
+        """Sleep before retrying a request; raises _JobCancelled as soon as the job is cancelled"""
+        try:
+            await asyncio.wait_for(self.cancel_requested.wait(), seconds)
+        except asyncio.TimeoutError:
+            return
+        raise _JobCancelled()
+
+class BatchRunner:
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self.current: Optional[_JobRun] = None
+    
+    async def start(self):
+        """Start claiming and processing queued jobs in the background"""
+        os.makedirs(settings.batch_dir, exist_ok=True)
+        self._task = asyncio.create_task(self._run_loop())
+    
+    async def stop(self):
+        """Stop processing; an unfinished job goes back to the queue"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+    
+    @property
+    def in_flight(self) -> int:
+        return self.current.in_flight if self.current else 0
+    
+    async def _run_loop(self):
+        while True:
+            try:
+                job = await self._claim()
+                if job is None:
+                    await asyncio.sleep(settings.batch_poll_interval)
+                    continue
+                await self._process(job)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Batch runner error: {e}")
+                await asyncio.sleep(settings.batch_poll_interval)
+    
+    async def _claim(self) -> Optional[BatchJob]:
+        """
+        Atomically take the oldest queued job (or one whose worker stopped
+        sending heartbeats), respecting the limit on concurrently running jobs
+        """
+        now = datetime.now(timezone.utc)
+        stale = now - timedelta(seconds=HEARTBEAT_TIMEOUT)
+        claimable = or_(
+            BatchJob.status == "queued",
+            and_(BatchJob.status.in_(("running", "cancelling")), BatchJob.heartbeat_at < stale)
+        )
+        other = aliased(BatchJob)
+        running = select(func.count()).select_from(other).where(
+            other.status.in_(("running", "cancelling")), other.heartbeat_at >= stale
+        ).scalar_subquery()
+        async with AsyncSessionLocal() as db:
+            job = (await db.execute(
+                select(BatchJob).where(claimable).order_by(BatchJob.created_at).limit(1)
+            )).scalar_one_or_none()
+            if job is None:
+                return None
+            
+            # Conditional update: only one worker wins the claim, and the
+            # running jobs are counted in the same statement so two workers
+            # cannot both start a job over the limit
+            result = await db.execute(
+                update(BatchJob)
+                .where(
+                    BatchJob.id == job.id, BatchJob.status == job.status, claimable,
+                    running < settings.batch_max_running_jobs
+                )
+                .values(
+                    status="running" if job.status == "queued" else job.status,
+                    owner_pid=os.getpid(),
+                    heartbeat_at=now,
+                    started_at=job.started_at or now
+                )
+            )
+            await db.commit()
+            if result.rowcount != 1:
+                return None
+            await db.refresh(job)
+            return job
+    
+    async def _set_status(self, run: _JobRun, status: Optional[str] = None, **values) -> Optional[str]:
+        """Save progress (and optionally a new status); returns the stored status"""
+        async with AsyncSessionLocal() as db:
+            job = await db.get(BatchJob, run.job_id)
+            if job is None:
+                return None
+            job.completed_requests = run.completed
+            job.failed_requests = run.failed
+            job.heartbeat_at = datetime.now(timezone.utc)
+            if status:
+                job.status = status
+            for key, value in values.items():
+                setattr(job, key, value)
+            await db.commit()
+            return job.status
+    
+    async def _process(self, job: BatchJob):
+        run = _JobRun(job)
+        self.current = run
+        set_lane("bulk")  # Inherited by the request tasks
+        logger.info(f"Processing batch job {job.id} ({job.total_requests} requests)")
+        out_path = output_path(job.id)
+        done, completed, failed = await asyncio.to_thread(_read_done, out_path)
+        if done:
+            # Resuming a job another worker left unfinished
+            run.completed, run.failed = completed, failed
+        semaphore = asyncio.Semaphore(settings.batch_concurrency)
+        tasks: Set[asyncio.Task] = set()
+        heartbeat = asyncio.create_task(self._heartbeat(run))
+        
+        try:
+            run.owner = await _owner(job.username)
+            with open(input_path(job.id), "rb") as f:
+                while not run.cancelled:
+                    lines = await asyncio.to_thread(_read_lines, f, 100)
+                    if not lines:
+                        break
+                    for line in lines:
+                        item = jsonutil.loads(line)
+                        if item["custom_id"] in done:
+                            continue
+                        
+                        await semaphore.acquire()
+                        if run.cancelled:
+                            semaphore.release()
+                            break
+                        
+                        task = asyncio.create_task(self._run_item(run, item, out_path, semaphore))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+            
+            if tasks:
+                await asyncio.gather(*tasks)
+            heartbeat.cancel()
+            final = "cancelled" if run.cancelled else "completed"
+            await self._set_status(run, final, completed_at=datetime.now(timezone.utc), owner_pid=None)
+            logger.info(
+                f"Batch job {job.id} {final}: {run.completed} succeeded, {run.failed} failed"
+                + (f", {run.not_sent} not sent" if run.not_sent else "")
+            )
+        except asyncio.CancelledError:
+            # Shutting down: the job goes back to the queue and resumes later
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self._set_status(run, "queued", owner_pid=None)
+            raise
+        except Exception as e:
+            logger.error(f"Batch job {job.id} failed: {e}")
+            await self._set_status(run, "failed", error=str(e), completed_at=datetime.now(timezone.utc), owner_pid=None)
+        finally:
+            heartbeat.cancel()
+            self.current = None
+    
+    async def _heartbeat(self, run: _JobRun):
+        """Save progress periodically and notice cancellation requests"""
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            try:
+                if await self._set_status(run) in ("cancelling", None):
+                    run.cancel_requested.set()
+            except Exception as e:
+                logger.error(f"Failed to save batch progress: {e}")
+    
+    async def _wait_for_rate_limit(self, run: _JobRun):
+        """Count a request against the owner's rate limit, waiting while it is exceeded"""
+        while True:
+            if run.cancelled:
+                raise _JobCancelled()
+            try:
+                async with run.rate_limit_lock, AsyncSessionLocal() as db:
+                    await rate_limiter.check_rate_limit(run.owner, db)
+                return
+            except HTTPException as e:
+                retry_after = int(e.headers.get("Retry-After", RATE_LIMIT_POLL)) if e.headers else RATE_LIMIT_POLL
+                await run.wait(max(1, min(retry_after, RATE_LIMIT_POLL)))
+    
+    async def _run_item(self, run: _JobRun, item: dict, out_path: str, semaphore: asyncio.Semaphore):
+        """Run one request of a job and append its result"""
+        run.in_flight += 1
+        custom_id = item["custom_id"]
+        url = item["url"]
+        start_time = time.time()
+        server_url = None
+        model = item["body"].get("model", "unknown")
+        prompt = ""
+        status_code = None
+        content = None
+        error = None
+        completion_tokens = None
+        
+        try:
+            body = jsonutil.dumps(item["body"])
+            request = parse_generate(body) if url == "/api/generate" else parse_chat(body)
+            if request.context_handle or request.session_id:
+                raise ValueError("context_handle and session_id are not supported in batches")
+            prompt = request.prompt
+            await self._wait_for_rate_limit(run)
+            while True:
+                try:
+                    response, server_url = await load_balancer.proxy_request(
+                        method="POST",
+                        path=url,
+                        content=request.body,
+                        model=model,
+                        prefix=request.prefix_text
+                    )
+                    break
+                except (OverloadedError, QueueTimeoutError) as e:
+                    # Shed by the concurrency limit or the lane queue: batch requests wait instead of failing
+                    await run.wait(e.retry_after)
+            status_code = response.status_code
+            content = response.content
+            result = jsonutil.loads(content)
+            observe_generation(model, result, run.username)
+            text = result.get("response") if url == "/api/generate" else (result.get("message") or {}).get("content")
+            completion_tokens = len((text or "").split())
+        except _JobCancelled:
+            # Never reached a backend: left out of the output like the requests not started
+            run.not_sent += 1
+            return
+        except BackendStatusError as e:
+            # Rejected by the backend (unknown model, bad options): keep its status
+            status_code = e.status_code
+            error = e.message
+        except Exception as e:
+            error = getattr(e, "detail", None) or str(e)
+        finally:
+            run.in_flight -= 1
+            semaphore.release()
+        
+        if error is None:
+            run.completed += 1
+            line = (
+                b'{"custom_id":' + jsonutil.dumps(custom_id)
+                + b',"status_code":' + str(status_code).encode()
+                + b',"response":' + content + b'}\n'
+            )
+        else:
+            run.failed += 1
+            line = jsonutil.dumps({"custom_id": custom_id, "status_code": status_code, "error": error}) + b"\n"
+        async with run.write_lock:
+            await asyncio.to_thread(_append, out_path, line)
+        
+        await self._log_usage(run, url, model, prompt, completion_tokens, start_time, error, server_url)
+    
+    async def _log_usage(self, run, url, model, prompt, completion_tokens, start_time, error, server_url):
+        try:
+            prompt_tokens = len(prompt.split())
+            async with AsyncSessionLocal() as db:
+                db.add(UsageLog(
+                    username=run.username,
+                    timestamp=datetime.now(timezone.utc),
+                    model=model,
+                    endpoint="batch/" + url.rsplit("/", 1)[-1],
+                    prompt=prompt[:5000] if prompt else prompt,
+                    prompt_tokens=prompt_tokens,
+                    completion_tokens=completion_tokens,
+                    total_tokens=prompt_tokens + (completion_tokens or 0),
+                    duration_ms=int((time.time() - start_time) * 1000),
+                    success=error is None,
+                    error=error,
+                    server_used=server_url,
+                    batch_id=run.job_id
+                ))
+                await db.commit()
+        except Exception as e:
+            logger.error(f"Failed to log batch usage: {e}")
+    
+    def get_status(self) -> dict:
+        """This worker's batch activity for /status"""
+        if not self.current:
+            return {"job_id": None}
+        return {
+            "job_id": self.current.job_id,
+            "completed": self.current.completed,
+            "failed": self.current.failed,
+            "in_flight": self.current.in_flight
+        }
+
+# Global batch runner instance
+batch_runner = BatchRunner()
@@ -0,0 +1,122 @@
+"""
+Backend capacity weighting
+
+Least-connections routing treats every backend as equal, so in a fleet of
+mixed GPU generations a fast node gets no more requests than a slow one.
+Each worker therefore keeps a moving average of the generation speed
+(eval_count / eval_duration of Ollama's final response) per backend and
+model, and the concurrency it was measured at. A backend's weight for a
+model is its speed relative to the median of the backends serving the
+model, and get_next_server picks the backend with the fewest requests per
+unit of weight.
+
+Per-request speed drops as a backend runs more requests at once, so a fast
+backend takes more requests until its speed settles, instead of taking all
+of them.
+
+Weights set by an admin (BACKEND_WEIGHTS, or the weight of a backend in
+the registry, see app.registry) replace the learned ones for every model.
+"""
+
+from typing import Dict, Optional, Tuple
+import re
+import statistics
+from app.config import settings
+
+ALPHA = 0.2  # EWMA weight of a speed sample
+MIN_SAMPLES = 3  # Samples a backend needs before its speed is compared
+MIN_WEIGHT = 0.1
+MAX_WEIGHT = 10.0
+
+_EVAL_COUNT = re.compile(rb'"eval_count"\s*:\s*(\d+)')
+_EVAL_DURATION = re.compile(rb'"eval_duration"\s*:\s*(\d+)')
+
+def generation_stats(tail: bytes) -> Optional[Tuple[int, int]]:
+    """(eval_count, eval_duration in ns) from the end of an Ollama response, if reported"""
+    count = _EVAL_COUNT.search(tail)
+    duration = _EVAL_DURATION.search(tail)
+    if not count or not duration:
+        return None
+    return int(count.group(1)), int(duration.group(1))
+
+class _Throughput:
+    def __init__(self):
+        self.tokens_per_second: Optional[float] = None  # EWMA of the per-request speed
+        self.concurrency: Optional[float] = None  # EWMA of the requests in flight at completion
+        self.samples = 0
+
+class CapacityEstimator:
+    def __init__(self):
+        self._models: Dict[str, Dict[str, _Throughput]] = {}  # model -> server URL -> stats
+        self._registry_weights: Dict[str, float] = {}  # From the backend registry
+    
+    @property
+    def enabled(self) -> bool:
+        return settings.capacity_weighting
+    
+    @property
+    def overrides(self) -> Dict[str, float]:
+        return {**settings.backend_weights, **self._registry_weights}
+    
+    def record(self, server_url: str, model: str, eval_count: int, eval_duration_ns: int, concurrency: int):
+        """Add a generation speed sample of a completed request"""
+        if not self.enabled or eval_count <= 0 or eval_duration_ns <= 0:
+            return
+        speed = eval_count / (eval_duration_ns / 1e9)
+        stats = self._models.setdefault(model, {}).setdefault(server_url, _Throughput())
+        if stats.tokens_per_second is None:
+            stats.tokens_per_second = speed
+            stats.concurrency = float(concurrency)
+        else:
+            stats.tokens_per_second += (speed - stats.tokens_per_second) * ALPHA
+            stats.concurrency += (concurrency - stats.concurrency) * ALPHA
+        stats.samples += 1
+    
+    def _learned(self, server_url: str, model: Optional[str]) -> float:
+        peers = self._models.get(model) if model else None
+        if not peers:
+            return 1.0
+        stats = peers.get(server_url)
+        if stats is None or stats.samples < MIN_SAMPLES:
+            return 1.0
+        speeds = [s.tokens_per_second for s in peers.values() if s.samples >= MIN_SAMPLES]
+        if len(speeds) < 2:
+            return 1.0
+        return min(MAX_WEIGHT, max(MIN_WEIGHT, stats.tokens_per_second / statistics.median(speeds)))
+    
+    def weight(self, server_url: str, model: Optional[str] = None) -> float:
+        """Relative capacity of a backend for `model` (1.0 = the median backend)"""
+        override = self._registry_weights.get(server_url, settings.backend_weights.get(server_url))
+        if override is not None:
+            return override
+        if not self.enabled:
+            return 1.0
+        return self._learned(server_url, model)
+    
+    def set_weights(self, weights: Dict[str, float]):
+        """Fixed weights of the backends in the registry"""
+        self._registry_weights = dict(weights)
+    
+    def forget(self, server_url: str):
+        """Drop the samples of a backend that was removed"""
+        for peers in self._models.values():
+            peers.pop(server_url, None)
+    
+    def get_status(self) -> dict:
+        """Learned speeds and weights of this worker for /status"""
+        return {
+            "enabled": self.enabled,
+            "overrides": self.overrides,
+            "models": {
+                model: {
+                    server_url: {
+                        "tokens_per_second": round(stats.tokens_per_second, 1),
+                        "concurrency": round(stats.concurrency, 2),
+                        "samples": stats.samples,
+                        "weight": round(self.weight(server_url, model), 2)
+                    }
+                    for server_url, stats in peers.items()
+                }
+                for model, peers in self._models.items()
+            }
+        }
@@ -0,0 +1,171 @@
+"""
+Server-side chat sessions
+
+The proxy keeps each conversation's message history in the database (shared
+by all workers), so clients send only the new messages of a turn. History is
+stored as encoded JSON messages joined by commas and spliced into the
+backend request as is, so a turn only encodes and parses its new messages.
+Each session remembers the backend that served its last turn; the next turn
+is routed there first to keep Ollama's prompt cache warm.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+import logging
+import secrets
+from sqlalchemy import select, delete
+from app import jsonutil
+from app.config import settings
+from app.database import AsyncSessionLocal, ChatSession
+
+logger = logging.getLogger(__name__)
+
+SESSION_PREFIX = "chat_"
+
+# Run expiry on every Nth session created per worker rather than on each one
+EXPIRE_EVERY = 50
+
+class AssistantTranscript:
+    """Collects the assistant message from a streamed /api/chat response"""
+    
+    def __init__(self):
+        self.partial = bytearray()
+        self.content: List[str] = []
+        self.tool_calls: List[dict] = []
+    
+    def feed(self, chunk: bytes):
+        self.partial += chunk
+        end = self.partial.rfind(b"\n")
+        if end == -1:
+            return
+        lines = bytes(self.partial[:end]).split(b"\n")
+        del self.partial[:end + 1]
+        for line in lines:
+            self._add_line(line)
+    
+    def _add_line(self, line: bytes):
+        if not line.strip():
+            return
+        try:
+            message = jsonutil.loads(line).get("message") or {}
+        except (ValueError, AttributeError):
+            return
+        if message.get("content"):
+            self.content.append(message["content"])
+        if message.get("tool_calls"):
+            self.tool_calls.extend(message["tool_calls"])
+    
+    def message(self) -> dict:
+        self._add_line(bytes(self.partial))
+        self.partial.clear()
+        message = {"role": "assistant", "content": "".join(self.content)}
+        if self.tool_calls:
+            message["tool_calls"] = self.tool_calls
+        return message
+
+def _join(history: bytes, messages: List[dict]) -> bytes:
+    new = jsonutil.dumps(messages)[1:-1]
+    return history + b"," + new if history and new else history or new
+
+def _trim(history: bytes, count: int):
+    """
+    Cap the history at the configured number of messages
+    Keeps leading system messages; trims to 3/4 of the cap so the full
+    history is only re-parsed every few turns.
+    """
+    limit = settings.chat_session_max_messages
+    if not limit or count <= limit:
+        return history, count
+    messages = jsonutil.loads(b"[" + history + b"]")
+    system = []
+    while messages and messages[0].get("role") == "system":
+        system.append(messages.pop(0))
+    keep = max(limit * 3 // 4 - len(system), 1)
+    messages = system + messages[-keep:]
+    return jsonutil.dumps(messages)[1:-1], len(messages)
+
+class ChatSessionStore:
+    def __init__(self):
+        self._created = 0
+    
+    async def create(self, username: str, model: Optional[str] = None, messages: Optional[List[dict]] = None) -> ChatSession:
+        """Start a session, optionally with initial messages (e.g. a system prompt)"""
+        messages = messages or []
+        session = ChatSession(
+            id=SESSION_PREFIX + secrets.token_urlsafe(18),
+            username=username,
+            model=model,
+            messages=_join(b"", messages),
+            message_count=len(messages)
+        )
+        async with AsyncSessionLocal() as db:
+            db.add(session)
+            if self._created % EXPIRE_EVERY == 0:
+                await self._expire(db)
+            await db.commit()
+        self._created += 1
+        return session
+    
+    async def get(self, session_id: str, username: str) -> Optional[ChatSession]:
+        """A live session owned by `username`, or None"""
+        async with AsyncSessionLocal() as db:
+            session = (await db.execute(
+                select(ChatSession).where(ChatSession.id == session_id, ChatSession.username == username)
+            )).scalar_one_or_none()
+        if session is None or _expired(session.updated_at):
+            return None
+        return session
+    
+    async def list_sessions(self, username: str) -> List[ChatSession]:
+        """Live sessions of a user, most recently used first"""
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.chat_session_ttl)
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(ChatSession)
+                .where(ChatSession.username == username, ChatSession.updated_at >= cutoff)
+                .order_by(ChatSession.updated_at.desc())
+            )
+            return list(result.scalars().all())
+    
+    async def append(self, session_id: str, messages: List[dict], model: str, server_url: Optional[str]):
+        """Record a completed turn: the new messages plus the assistant reply"""
+        async with AsyncSessionLocal() as db:
+            session = await db.get(ChatSession, session_id)
+            if session is None:
+                return
+            history, count = _trim(
+                _join(session.messages, messages),
+                session.message_count + len(messages)
+            )
+            session.messages = history
+            session.message_count = count
+            session.model = model
+            session.server_url = server_url
+            session.updated_at = datetime.now(timezone.utc)
+            await db.commit()
+    
+    async def delete(self, session_id: str, username: str) -> bool:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                delete(ChatSession).where(ChatSession.id == session_id, ChatSession.username == username)
+            )
+            await db.commit()
+        return result.rowcount > 0
+    
+    async def _expire(self, db):
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.chat_session_ttl)
+        result = await db.execute(delete(ChatSession).where(ChatSession.updated_at < cutoff))
+        if result.rowcount:
+            logger.info(f"Expired {result.rowcount} idle chat sessions")
+
+def _expired(updated_at: datetime) -> bool:
+    if updated_at.tzinfo is None:
+        updated_at = updated_at.replace(tzinfo=timezone.utc)
+    return updated_at < datetime.now(timezone.utc) - timedelta(seconds=settings.chat_session_ttl)
+
+def session_messages(session: ChatSession) -> List[dict]:
+    """Decoded history of a session"""
+    return jsonutil.loads(b"[" + session.messages + b"]")
+
+# Global chat session store instance
+chat_sessions = ChatSessionStore()
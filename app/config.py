@@ -1,6 +1,6 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import field_validator
-from typing import List, Union
+from typing import Any, Dict, List, Union
 import os
 
 class Settings(BaseSettings):
@@ -31,6 +31,10 @@ class Settings(BaseSettings):
             return [x.strip() for x in v.split(',') if x.strip()]
         return ["http://localhost:11434"]
     
+    # Backend registry (see app/registry.py): once this file exists it replaces OLLAMA_SERVERS
+    backends_file: str = "/var/lib/tokamak-ai-api/backends.json"
+    backends_watch_interval: float = 5  # Seconds between checks of the file for changes
+    
     # Database
     database_url: str = "sqlite+aiosqlite:///./tokamak_ai_api.db"
     
@@ -43,12 +47,108 @@ class Settings(BaseSettings):
     default_rate_limit: int = 1000
     rate_limit_window: int = 3600  # 1 hour in seconds
     
+    # Proxy
+    proxy_passthrough: bool = True  # Forward request bodies as received instead of re-encoding them
+    context_handle_ttl: int = 86400  # Seconds a stored /api/generate context stays valid
+    context_handle_max_entries: int = 10000  # Oldest stored contexts are evicted beyond this
+    context_handle_cache_size: int = 128  # Contexts cached in memory per worker
+    chat_session_ttl: int = 7 * 86400  # Seconds an idle chat session is kept
+    chat_session_max_messages: int = 200  # History is trimmed beyond this (0 = unlimited)
+    
+    # Prefix-affinity routing: requests sharing a prompt prefix go to the same backend
+    prefix_affinity: bool = False
+    prefix_affinity_chars: int = 2048  # Length of the prompt prefix that is hashed
+    prefix_affinity_load_factor: float = 1.25  # Max load per server as a multiple of the average
+    # Per-model overrides, e.g. {"llama3:8b": {"enabled": true, "prefix_chars": 4096}}
+    prefix_affinity_models: Dict[str, Dict[str, Any]] = {}
+    
+    # Embedding micro-batching: concurrent single-input /api/embed calls are merged
+    embed_batch_window_ms: float = 5  # How long a batch collects inputs
+    embed_batch_max_size: int = 64  # Inputs per batch (1 = no batching)
+    embed_cache_dir: str = ""  # Shared on-disk embedding cache (empty = off, needs numpy)
+    embed_cache_max_entries: int = 200000  # Vectors kept per model
+    
+    # Priority lanes (admin, interactive, bulk)
+    priority_slots_per_server: int = 0  # Concurrent requests per backend (OLLAMA_NUM_PARALLEL), shared by WORKERS workers; 0 = off
+    priority_reserved_fraction: float = 0.25  # Share of the slots bulk requests cannot use
+    priority_aging_seconds: float = 30  # Bulk requests waiting this long compete as interactive
+    priority_queue_timeout: float = 120  # Max seconds a request waits for a slot
+    
+    # Backend timeouts (seconds); see app/timeouts.py
+    backend_connect_timeout: float = 5.0
+    backend_first_byte_timeout: float = 300.0  # Until a stream's first chunk / a complete non-streamed response
+    backend_idle_timeout: float = 120.0  # Longest gap between two chunks of a stream
+    # Per-model overrides, e.g. {"llama3:70b": {"first_byte": 600}, "nomic-embed-text": {"first_byte": 30}}
+    backend_timeout_models: Dict[str, Dict[str, float]] = {}
+    max_request_timeout: float = 3600  # Upper bound for X-Request-Timeout
+    
+    # Failover retry budget (see app/retry_budget.py)
+    retry_budget_ratio: float = 0.2  # Retries allowed per request over the last 10s
+    retry_budget_min_per_second: float = 1.0  # Retries always allowed, so low traffic can fail over
+    
+    # Latency outlier ejection (see app/outliers.py)
+    outlier_ejection: bool = True
+    outlier_latency_factor: float = 3.0  # Eject at this multiple of the peers' median time to first token
+    outlier_ejection_seconds: float = 30  # First ejection; repeated ejections last longer
+    outlier_max_ejection_percent: float = 50  # Of a model's backends
+    
+    # Capacity weighting (see app/capacity.py)
+    capacity_weighting: bool = True  # Weight backends by the generation speed learned per model
+    backend_weights: Dict[str, float] = {}  # Fixed weights replacing the learned ones, e.g. {"http://dgx1:11434": 4}
+    
+    # Model residency and warm-up (see app/residency.py)
+    residency_tracking: bool = True  # Poll /api/ps and prefer backends with the model loaded
+    residency_poll_interval: float = 10
+    residency_spill_load: int = 4  # Extra requests a warm backend may have before a cold one is used
+    model_warming: bool = False  # Load popular models on idle backends ahead of demand (opt-in: it loads models unasked)
+    model_warm_window: int = 900  # Seconds of usage logs that count as recent demand
+    model_warm_min_requests: int = 5  # Requests in the window before a model is warmed
+    model_warm_keep_alive: str = "30m"  # keep_alive of warm-up requests
+    leader_lock_dir: str = "/tmp/tokamak-ai-api"  # Lock files electing the worker that runs warm-up
+    
+    # Model replica placement (see app/placement.py)
+    placement_window: int = 86400  # Seconds of usage logs that count as demand
+    placement_node_capacity_gb: float = 80  # Model size budget per backend (about its VRAM)
+    placement_node_capacities: Dict[str, float] = {}  # Per-backend overrides, e.g. {"http://dgx1:11434": 320}
+    placement_min_replicas: int = 1  # Replicas kept of models without demand
+    placement_model_min_replicas: Dict[str, int] = {}  # Per-model minimum, e.g. {"nomic-embed-text:latest": 3}
+    placement_max_actions: int = 4  # Pulls/deletes per applied run
+    placement_min_interval: int = 600  # Seconds between the starts of two applied runs
+    placement_auto_apply: bool = False  # Apply every PLACEMENT_INTERVAL seconds (else only via the admin API)
+    placement_interval: int = 3600
+    
+    # Adaptive concurrency: per-model limit (per worker) that follows backend latency; excess requests get 503
+    adaptive_concurrency: bool = True
+    adaptive_initial_limit: int = 20
+    adaptive_min_limit: int = 2
+    adaptive_max_limit: int = 200
+    adaptive_tolerance: float = 2.0  # Latency may reach this multiple of the baseline before the limit shrinks
+    
+    # Batch jobs (/batch)
+    batch_dir: str = "./data/batches"  # Uploaded inputs and results
+    batch_concurrency: int = 4  # Requests of a job in flight at once (per worker)
+    batch_max_running_jobs: int = 1  # Jobs processed at once across all workers
+    batch_poll_interval: float = 5.0  # Seconds between checks for queued jobs
+    batch_max_file_bytes: int = 100 * 1024 * 1024
+    batch_max_requests: int = 50000
+    
+    # Startup and probes
+    startup_health_timeout: float = 5.0  # Max seconds to wait for the first backend sweep
+    readiness_check_interval: int = 5  # Seconds between background database checks
+    
     # Logging
     log_level: str = "INFO"
-    log_file: str = "/var/log/tokamak-ai-api/server.log"
+    log_file: str = "/var/log/tokamak-ai-api/server.log"  # JSON lines, rotated by logrotate
+    slow_log_file: str = "/var/log/tokamak-ai-api/slow.log"
+    # Fraction of records below WARNING to keep per logger, e.g. {"access": 0.1}
+    log_sampling: Dict[str, float] = {}
+    slow_request_threshold_ms: int = 10000  # Requests slower than this go to the slow log (0 = off)
     
     # Monitoring
     enable_metrics: bool = True
     metrics_port: int = 9090
+    loop_monitor_interval: float = 0.5  # Seconds between event loop lag measurements
+    loop_lag_threshold_ms: int = 250  # Log the loop's stack when it is blocked this long
+    resource_sample_interval: int = 10  # Seconds between process resource samples
 
 settings = Settings()
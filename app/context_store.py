@@ -0,0 +1,115 @@
+"""
+Server-side store for /api/generate `context`
+
+The token context Ollama returns grows with every turn of a conversation.
+Instead of having clients send it back each time, the proxy keeps it in the
+database (shared by all workers) and hands out a short opaque handle. The
+context is kept as encoded JSON so it is spliced into the forwarded request
+without being parsed again. Entries expire after a TTL and the table is
+capped at a maximum number of entries, oldest evicted first; a small
+per-worker LRU cache serves hot handles without a database round trip.
+"""
+
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+import logging
+import secrets
+from sqlalchemy import select, delete
+from app import jsonutil
+from app.config import settings
+from app.database import AsyncSessionLocal, ContextHandle
+
+logger = logging.getLogger(__name__)
+
+HANDLE_PREFIX = "ctx_"
+
+# Run eviction on every Nth save per worker rather than on each one
+EVICT_EVERY = 50
+
+class StoredContext:
+    def __init__(self, username: str, model: str, server_url: Optional[str], context: bytes, created_at: datetime):
+        self.username = username
+        self.model = model
+        self.server_url = server_url
+        self.context = context  # JSON array, ready to splice into a request body
+        self.created_at = created_at
+    
+    @property
+    def expired(self) -> bool:
+        created_at = self.created_at
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        return created_at < datetime.now(timezone.utc) - timedelta(seconds=settings.context_handle_ttl)
+
+class ContextStore:
+    def __init__(self):
+        self._cache: "OrderedDict[str, StoredContext]" = OrderedDict()
+        self._saves = 0
+    
+    def _remember(self, handle: str, stored: StoredContext):
+        self._cache[handle] = stored
+        self._cache.move_to_end(handle)
+        while len(self._cache) > settings.context_handle_cache_size:
+            self._cache.popitem(last=False)
+    
+    async def save(self, username: str, model: str, server_url: Optional[str], context: List[int]) -> str:
+        """Store a context and return its new handle"""
+        handle = HANDLE_PREFIX + secrets.token_urlsafe(18)
+        stored = StoredContext(username, model, server_url, jsonutil.dumps(context), datetime.now(timezone.utc))
+        
+        async with AsyncSessionLocal() as db:
+            db.add(ContextHandle(
+                handle=handle,
+                username=username,
+                model=model,
+                server_url=server_url,
+                context=stored.context,
+                created_at=stored.created_at
+            ))
+            if self._saves % EVICT_EVERY == 0:
+                await self._evict(db)
+            await db.commit()
+        self._saves += 1
+        
+        self._remember(handle, stored)
+        return handle
+    
+    async def load(self, handle: str, username: str) -> Optional[StoredContext]:
+        """Look up a handle owned by `username`; None if unknown or expired"""
+        stored = self._cache.get(handle)
+        if stored is None:
+            async with AsyncSessionLocal() as db:
+                row = (await db.execute(
+                    select(ContextHandle).where(ContextHandle.handle == handle)
+                )).scalar_one_or_none()
+            if row is None:
+                return None
+            stored = StoredContext(row.username, row.model, row.server_url, row.context, row.created_at)
+            self._remember(handle, stored)
+        else:
+            self._cache.move_to_end(handle)
+        
+        # Handles of other users are treated as unknown
+        if stored.expired or stored.username != username:
+            return None
+        return stored
+    
+    async def _evict(self, db):
+        """Drop expired entries and everything beyond the newest max entries"""
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.context_handle_ttl)
+        await db.execute(delete(ContextHandle).where(ContextHandle.created_at < cutoff))
+        
+        oldest_kept = (await db.execute(
+            select(ContextHandle.created_at)
+            .order_by(ContextHandle.created_at.desc())
+            .offset(settings.context_handle_max_entries - 1)
+            .limit(1)
+        )).scalar_one_or_none()
+        if oldest_kept is not None:
+            result = await db.execute(delete(ContextHandle).where(ContextHandle.created_at < oldest_kept))
+            if result.rowcount:
+                logger.info(f"Evicted {result.rowcount} context handles over the limit")
+
+# Global context store instance
+context_store = ContextStore()
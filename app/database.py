@@ -1,7 +1,8 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
-from sqlalchemy import Column, String, Integer, Boolean, DateTime, Text, BigInteger, Index
+from sqlalchemy import Column, String, Integer, Boolean, DateTime, Text, BigInteger, LargeBinary, Index, text, bindparam, inspect
 from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
 from app.config import settings
 import secrets
 import hashlib
@@ -16,6 +17,7 @@ class APIKey(Base):
     username = Column(String(100), index=True, nullable=False)
     role = Column(String(20), nullable=False)
     rate_limit = Column(Integer, default=1000)
+    priority = Column(String(20), nullable=True)  # Priority lane; None = by role
     is_active = Column(Boolean, default=True)
     description = Column(Text, nullable=True)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
@@ -24,7 +26,8 @@ class APIKey(Base):
 class UsageLog(Base):
     __tablename__ = "usage_logs"
     
-    id = Column(BigInteger, primary_key=True, index=True, autoincrement=True)
+    # SQLite only auto-increments (and exposes as rowid) an INTEGER PRIMARY KEY
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, index=True, autoincrement=True)
     username = Column(String(100), index=True, nullable=False)
     timestamp = Column(DateTime, default=lambda: datetime.now(timezone.utc), index=True)
     model = Column(String(100), nullable=False)
@@ -37,6 +40,7 @@ class UsageLog(Base):
     success = Column(Boolean, default=True)
     error = Column(Text, nullable=True)
     server_used = Column(String(200), nullable=True)
+    batch_id = Column(String(64), nullable=True, index=True)  # Set for requests run by a batch job
 
 class RateLimit(Base):
     __tablename__ = "rate_limits"
@@ -51,6 +55,48 @@ class RateLimit(Base):
         Index('idx_username_window', 'username', 'window_start', unique=True),
     )
 
+class ContextHandle(Base):
+    """Generation context stored server-side, referenced by an opaque handle"""
+    __tablename__ = "context_handles"
+    
+    handle = Column(String(64), primary_key=True)
+    username = Column(String(100), nullable=False)
+    model = Column(String(100), nullable=False)
+    server_url = Column(String(200), nullable=True)  # Backend that produced the context
+    context = Column(LargeBinary, nullable=False)  # JSON-encoded token list
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+
+class ChatSession(Base):
+    """Chat history kept server-side so clients only send new messages"""
+    __tablename__ = "chat_sessions"
+    
+    id = Column(String(64), primary_key=True)
+    username = Column(String(100), index=True, nullable=False)
+    model = Column(String(100), nullable=True)  # Model of the last turn
+    server_url = Column(String(200), nullable=True)  # Backend that served the last turn
+    messages = Column(LargeBinary, nullable=False, default=b"")  # Encoded messages joined by commas
+    message_count = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+
+class BatchJob(Base):
+    """Offline bulk inference job; requests and results live in JSONL files"""
+    __tablename__ = "batch_jobs"
+    
+    id = Column(String(64), primary_key=True)
+    username = Column(String(100), index=True, nullable=False)
+    status = Column(String(20), index=True, nullable=False)  # queued, running, cancelling, completed, failed, cancelled
+    filename = Column(String(255), nullable=True)
+    total_requests = Column(Integer, default=0, nullable=False)
+    completed_requests = Column(Integer, default=0, nullable=False)
+    failed_requests = Column(Integer, default=0, nullable=False)
+    error = Column(Text, nullable=True)
+    owner_pid = Column(Integer, nullable=True)  # Worker processing the job
+    heartbeat_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+    started_at = Column(DateTime, nullable=True)
+    completed_at = Column(DateTime, nullable=True)
+
 # Database engine
 engine = create_async_engine(
     settings.database_url,
@@ -65,10 +111,149 @@ AsyncSessionLocal = async_sessionmaker(
     expire_on_commit=False
 )
 
+# Full-text index over usage_logs.prompt/error (SQLite FTS5, external content).
+# Triggers keep it in sync inside the same transaction as every usage log write.
+USAGE_SEARCH_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS usage_logs_fts USING fts5(
+        prompt, error,
+        content='usage_logs', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS usage_logs_fts_ai AFTER INSERT ON usage_logs BEGIN
+        INSERT INTO usage_logs_fts(rowid, prompt, error) VALUES (new.id, new.prompt, new.error);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS usage_logs_fts_ad AFTER DELETE ON usage_logs BEGIN
+        INSERT INTO usage_logs_fts(usage_logs_fts, rowid, prompt, error)
+        VALUES ('delete', old.id, old.prompt, old.error);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS usage_logs_fts_au AFTER UPDATE OF prompt, error ON usage_logs BEGIN
+        INSERT INTO usage_logs_fts(usage_logs_fts, rowid, prompt, error)
+        VALUES ('delete', old.id, old.prompt, old.error);
+        INSERT INTO usage_logs_fts(rowid, prompt, error) VALUES (new.id, new.prompt, new.error);
+    END
+    """,
+]
+
+def is_sqlite() -> bool:
+    """Whether the configured database is SQLite"""
+    return engine.dialect.name == "sqlite"
+
+def _fix_usage_logs_primary_key(conn):
+    """
+    Rebuild usage_logs if it was created with a BIGINT primary key.
+    SQLite does not auto-increment BIGINT keys, so inserts into such a table fail.
+    """
+    columns = conn.exec_driver_sql("PRAGMA table_info(usage_logs)").fetchall()
+    id_column = next((c for c in columns if c[1] == "id"), None)
+    if id_column is None or id_column[2].upper() == "INTEGER":
+        return
+    conn.exec_driver_sql("DROP TABLE IF EXISTS usage_logs_fts")
+    conn.exec_driver_sql("ALTER TABLE usage_logs RENAME TO usage_logs_old")
+    for index in UsageLog.__table__.indexes:
+        conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index.name}")
+    UsageLog.__table__.create(conn)
+    names = ", ".join(c.name for c in UsageLog.__table__.columns)
+    conn.exec_driver_sql(f"INSERT INTO usage_logs ({names}) SELECT {names} FROM usage_logs_old")
+    conn.exec_driver_sql("DROP TABLE usage_logs_old")
+
+def _init_usage_search(conn):
+    """Create the usage_logs full-text index, backfilling it on first creation"""
+    exists = conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'usage_logs_fts'"
+    ).first()
+    for statement in USAGE_SEARCH_DDL:
+        conn.exec_driver_sql(statement)
+    if not exists:
+        conn.exec_driver_sql("INSERT INTO usage_logs_fts(usage_logs_fts) VALUES ('rebuild')")
+
+def _add_missing_columns(conn):
+    """Add nullable columns introduced after a table was first created"""
+    for table in (APIKey.__table__, UsageLog.__table__):
+        existing = {c["name"] for c in inspect(conn).get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+            for index in table.indexes:
+                if column.name in index.columns:
+                    index.create(conn, checkfirst=True)
+
 async def init_db():
     """Initialize database tables"""
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+        if is_sqlite():
+            await conn.run_sync(_fix_usage_logs_primary_key)
+            await conn.run_sync(_init_usage_search)
+
+def _usage_search_filters(username, model, since, until) -> str:
+    """Build the extra WHERE clauses for a usage search"""
+    clauses = ""
+    if username:
+        clauses += " AND u.username = :username"
+    if model:
+        clauses += " AND u.model = :model"
+    if since:
+        clauses += " AND u.timestamp >= :since"
+    if until:
+        clauses += " AND u.timestamp <= :until"
+    return clauses
+
+async def search_usage_logs(
+    db: AsyncSession,
+    query: str,
+    username: Optional[str] = None,
+    model: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = 20,
+    offset: int = 0
+) -> Tuple[int, List[dict]]:
+    """
+    Full-text search over logged prompts and errors (SQLite FTS5 query syntax)
+    Returns: (total_matches, page_of_results) ranked by bm25, best first
+    """
+    filters = _usage_search_filters(username, model, since, until)
+    params = {
+        "query": query,
+        "username": username,
+        "model": model,
+        "since": since,
+        "until": until,
+        "limit": limit,
+        "offset": offset
+    }
+    typed = [bindparam(name, type_=DateTime) for name in ("since", "until") if params[name]]
+    
+    count_stmt = text(
+        "SELECT count(*) FROM usage_logs_fts JOIN usage_logs u ON u.id = usage_logs_fts.rowid "
+        "WHERE usage_logs_fts MATCH :query" + filters
+    ).bindparams(*typed)
+    total = (await db.execute(count_stmt, params)).scalar_one()
+    if total == 0:
+        return 0, []
+    
+    stmt = text(
+        "SELECT u.id, u.username, u.timestamp, u.model, u.endpoint, u.total_tokens, "
+        "u.duration_ms, u.success, u.server_used, "
+        "snippet(usage_logs_fts, 0, '[', ']', '...', 24) AS prompt_snippet, "
+        "snippet(usage_logs_fts, 1, '[', ']', '...', 24) AS error_snippet, "
+        "bm25(usage_logs_fts) AS rank "
+        "FROM usage_logs_fts JOIN usage_logs u ON u.id = usage_logs_fts.rowid "
+        "WHERE usage_logs_fts MATCH :query" + filters + " "
+        "ORDER BY rank LIMIT :limit OFFSET :offset"
+    ).bindparams(*typed).columns(timestamp=DateTime)
+    rows = (await db.execute(stmt, params)).mappings().all()
+    return total, [dict(row) for row in rows]
 
 async def get_db():
     """Dependency for getting database session"""
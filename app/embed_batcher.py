@@ -0,0 +1,111 @@
+"""
+Micro-batching for /api/embed
+
+Indexers send many concurrent single-input embedding requests. Requests for
+the same model (and the same options) arriving within a short window are
+sent to the backend as one /api/embed call with an `input` array, and the
+embeddings are handed back to the individual callers. Ollama's stats cover
+the whole batch and cannot be split per input, so each caller gets them as
+zero (like inputs served from the embedding cache).
+"""
+
+from typing import Dict, List, Optional, Set, Tuple
+import asyncio
+import contextvars
+import logging
+from app import jsonutil
+from app.config import settings
+from app.load_balancer import load_balancer
+from app.monitoring import embed_batch_size
+from app.scheduler import current_lane, set_lane
+from app.timing import timed
+
+logger = logging.getLogger(__name__)
+
+# Ollama's /api/embed stats, reported as zero where they cannot be attributed to a request
+ZERO_EMBED_STATS = {"total_duration": 0, "load_duration": 0, "prompt_eval_count": 0}
+
+class _Batch:
+    def __init__(self, model: str, fields: dict, lane: str):
+        self.model = model
+        self.fields = fields  # Request fields other than `input`
+        self.lane = lane  # Priority lane of the callers
+        self.inputs: List[str] = []
+        self.futures: List[asyncio.Future] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+class EmbeddingBatcher:
+    def __init__(self):
+        self._pending: Dict[str, _Batch] = {}
+        self._sending: Set[asyncio.Task] = set()  # The loop only keeps weak references to tasks
+    
+    @property
+    def enabled(self) -> bool:
+        return settings.embed_batch_max_size > 1
+    
+    async def embed(self, model: str, fields: dict, text: str) -> Tuple[dict, str]:
+        """
+        Embed a single input as part of a batch
+        Returns: (response for this input, server_url_used)
+        """
+        fields = {k: v for k, v in fields.items() if k != "input"}
+        lane = current_lane()
+        key = lane + ":" + jsonutil.dumps(fields).decode()  # Same model, options and lane batch together
+        loop = asyncio.get_running_loop()
+        
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = _Batch(model, fields, lane)
+            self._pending[key] = batch
+            batch.timer = loop.call_later(settings.embed_batch_window_ms / 1000, self._flush, key, batch)
+        
+        future = loop.create_future()
+        batch.inputs.append(text)
+        batch.futures.append(future)
+        if len(batch.inputs) >= settings.embed_batch_max_size:
+            self._flush(key, batch)
+        
+        with timed("embed_batch"):
+            return await future
+    
+    def _flush(self, key: str, batch: _Batch):
+        if self._pending.get(key) is not batch:
+            return
+        del self._pending[key]
+        if batch.timer:
+            batch.timer.cancel()
+        # Fresh context: the backend call belongs to no single caller's request timing
+        context = contextvars.Context()
+        context.run(set_lane, batch.lane)
+        task = asyncio.create_task(self._send(batch), context=context)
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+    
+    async def _send(self, batch: _Batch):
+        embed_batch_size.labels(model=batch.model).observe(len(batch.inputs))
+        try:
+            response, server_url = await load_balancer.proxy_request(
+                method="POST",
+                path="/api/embed",
+                content=jsonutil.dumps({**batch.fields, "input": batch.inputs}),
+                model=batch.model
+            )
+            result = jsonutil.loads(response.content)
+            embeddings = result.get("embeddings") or []
+            if len(embeddings) != len(batch.inputs):
+                raise Exception(f"Backend returned {len(embeddings)} embeddings for {len(batch.inputs)} inputs")
+        except Exception as e:
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for future, embedding in zip(batch.futures, embeddings):
+            if not future.done():  # Caller may have gone away
+                future.set_result((
+                    {"model": result.get("model", batch.model), "embeddings": [embedding], **ZERO_EMBED_STATS},
+                    server_url
+                ))
+
+# Global embedding batcher instance
+embed_batcher = EmbeddingBatcher()
@@ -0,0 +1,267 @@
+"""
+Persistent embedding cache
+
+Maps a content hash (model, request options and input text) to its vector.
+Each model gets a directory under EMBED_CACHE_DIR holding memory-mapped NumPy
+arrays, so every uvicorn worker shares the same pages instead of keeping its
+own copy:
+
+- `index.bin`: one record per slot (16-byte key hash, version counter)
+- `vectors.f32`: float32 vectors, row i belongs to slot i
+- `ref.bin`: one "recently used" byte per slot for clock eviction
+
+The index is set-associative: a key can only live in the WAYS slots of the
+set its hash selects, so lookups check a handful of slots and need no
+rebuilds. Inserts take an exclusive file lock, so there is a single writer
+at a time across all workers, and only that writer maps the files writable;
+readers map them read-only and never lock. A writer makes a slot's version
+odd while it rewrites it and readers discard a slot whose version was odd or
+changed while they copied the vector (seqlock). Cache hits are remembered
+per worker and marked in `ref.bin` the next time that worker inserts.
+
+NumPy is optional; without it the cache stays disabled.
+"""
+
+from typing import Dict, List, Optional
+import asyncio
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from app import jsonutil
+from app.config import settings
+from app.monitoring import embed_cache_lookups
+
+try:
+    import numpy as np
+except ImportError:  # Optional dependency
+    np = None
+
+logger = logging.getLogger(__name__)
+
+WAYS = 8  # Slots per set
+OPEN_RETRY_INTERVAL = 5.0  # Seconds before looking again for files another worker may have created
+MAX_PENDING_HITS = 4096  # Hits remembered between two inserts of a worker
+
+INDEX_DTYPE = [("key", "<u8", (2,)), ("version", "<u4"), ("_pad", "<u4")]
+
+class _ModelCache:
+    """Memory-mapped cache files of one model"""
+    
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.index = None  # Read-only maps
+        self.vectors = None
+        self.dim: Optional[int] = None
+        self.sets = 0
+        self.retry_open_at = 0.0  # While the files do not exist, when to look again
+        self._writable = None  # (index, vectors, refs) maps of the writer
+        self._hands = None  # Clock hand per set (per process)
+        self._hits: Dict[int, tuple] = {}  # Slot -> key hit since this worker last wrote
+        self._lock_fd: Optional[int] = None
+        self._thread_lock = threading.Lock()
+    
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+    
+    def open(self) -> bool:
+        """Map the files read-only if another worker (or this one) created them"""
+        if self.index is not None:
+            return True
+        try:
+            with open(self._path("meta.json")) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return False
+        capacity, self.dim = meta["capacity"], meta["dim"]
+        self.vectors = np.memmap(self._path("vectors.f32"), dtype="<f4", mode="r", shape=(capacity, self.dim))
+        self.sets = capacity // WAYS
+        # Set last: a mapped index means the cache is ready to read
+        self.index = np.memmap(self._path("index.bin"), dtype=INDEX_DTYPE, mode="r", shape=(capacity,))
+        return True
+    
+    def _open_writable(self):
+        """Writable maps (called with the writer lock held)"""
+        if self._writable is None:
+            capacity = len(self.index)
+            self._writable = (
+                np.memmap(self._path("index.bin"), dtype=INDEX_DTYPE, mode="r+", shape=(capacity,)),
+                np.memmap(self._path("vectors.f32"), dtype="<f4", mode="r+", shape=(capacity, self.dim)),
+                np.memmap(self._path("ref.bin"), dtype="u1", mode="r+", shape=(capacity,))
+            )
+            self._hands = np.zeros(self.sets, dtype="u1")
+        return self._writable
+    
+    def _create(self, dim: int):
+        """Create the files (called with the writer lock held)"""
+        capacity = max(settings.embed_cache_max_entries // WAYS, 1) * WAYS
+        np.memmap(self._path("index.bin"), dtype=INDEX_DTYPE, mode="w+", shape=(capacity,)).flush()
+        np.memmap(self._path("vectors.f32"), dtype="<f4", mode="w+", shape=(capacity, dim)).flush()
+        np.memmap(self._path("ref.bin"), dtype="u1", mode="w+", shape=(capacity,)).flush()
+        # meta.json appears last, so readers never map half-created files
+        tmp = self._path("meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"capacity": capacity, "dim": dim, "ways": WAYS}, f)
+        os.replace(tmp, self._path("meta.json"))
+        logger.info(f"Created embedding cache in {self.directory} ({capacity} entries x {dim} dims)")
+    
+    def _find(self, key) -> int:
+        base = (key[1] % self.sets) * WAYS
+        keys = self.index["key"][base:base + WAYS]
+        matches = np.flatnonzero((keys[:, 0] == np.uint64(key[0])) & (keys[:, 1] == np.uint64(key[1])))
+        return base + int(matches[0]) if len(matches) else -1
+    
+    def get(self, key):
+        """Copy of the cached vector, or None"""
+        slot = self._find(key)
+        if slot < 0:
+            return None
+        version = self.index["version"][slot]
+        if version & 1:
+            return None
+        vector = np.array(self.vectors[slot])
+        if self.index["version"][slot] != version or self._find(key) != slot:
+            return None
+        if len(self._hits) < MAX_PENDING_HITS:
+            self._hits[slot] = key
+        return vector
+    
+    def _victim(self, base: int, refs) -> int:
+        """Empty slot of the set, else the clock's pick"""
+        keys = self.index["key"][base:base + WAYS]
+        empty = np.flatnonzero(keys[:, 1] == 0)
+        if len(empty):
+            return base + int(empty[0])
+        set_number = base // WAYS
+        hand = int(self._hands[set_number])
+        for step in range(2 * WAYS):
+            way = (hand + step) % WAYS
+            if refs[base + way]:
+                refs[base + way] = 0
+            else:
+                break
+        self._hands[set_number] = (way + 1) % WAYS
+        return base + way
+    
+    def put_many(self, items: list):
+        """Insert (key, vector) pairs as the single writer"""
+        with self._thread_lock:
+            if self._lock_fd is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._lock_fd = os.open(self._path("lock"), os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            try:
+                if not self.open():
+                    self._create(len(items[0][1]))
+                    self.open()
+                index, vectors, refs = self._open_writable()
+                hits, self._hits = self._hits, {}
+                for slot, key in hits.items():
+                    if tuple(int(half) for half in self.index["key"][slot]) == key:
+                        refs[slot] = 1
+                for key, vector in items:
+                    if len(vector) != self.dim or self._find(key) >= 0:
+                        continue
+                    slot = self._victim((key[1] % self.sets) * WAYS, refs)
+                    index["version"][slot] += 1  # Odd: being rewritten
+                    index["key"][slot] = key
+                    vectors[slot] = vector
+                    index["version"][slot] += 1
+                    refs[slot] = 1
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+    
+    def entries(self) -> int:
+        return int(np.count_nonzero(self.index["key"][:, 1])) if self.index is not None else 0
+
+class EmbeddingCache:
+    def __init__(self):
+        self._models: Dict[str, _ModelCache] = {}
+        self._warned = False
+    
+    @property
+    def enabled(self) -> bool:
+        if not settings.embed_cache_dir:
+            return False
+        if np is None:
+            if not self._warned:
+                logger.warning("EMBED_CACHE_DIR is set but numpy is not installed; embedding cache disabled")
+                self._warned = True
+            return False
+        return True
+    
+    def _model(self, model: str) -> _ModelCache:
+        cache = self._models.get(model)
+        if cache is None:
+            safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", model)
+            suffix = hashlib.blake2b(model.encode(), digest_size=4).hexdigest()
+            cache = _ModelCache(os.path.join(settings.embed_cache_dir, f"{safe_name}-{suffix}"))
+            self._models[model] = cache
+        return cache
+    
+    @staticmethod
+    def _keys(fields: dict, texts: List[str]) -> list:
+        # Options that change the vectors (model, truncate, options) are part of the key
+        scope = jsonutil.dumps({k: v for k, v in fields.items() if k not in ("input", "keep_alive")})
+        keys = []
+        for text in texts:
+            digest = hashlib.blake2b(scope + b"\0" + text.encode("utf-8"), digest_size=16).digest()
+            hi, lo = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little")
+            keys.append((hi, lo or 1))  # A zero low half marks an empty slot
+        return keys
+    
+    async def _ready(self, cache: _ModelCache) -> bool:
+        """Whether the model's files are mapped, looking for them (off the loop) now and then"""
+        if cache.index is not None:
+            return True
+        now = time.monotonic()
+        if now < cache.retry_open_at:
+            return False
+        cache.retry_open_at = now + OPEN_RETRY_INTERVAL
+        return await asyncio.to_thread(cache.open)
+    
+    async def lookup(self, model: str, fields: dict, texts: List[str]) -> List[Optional[list]]:
+        """Cached vector per text (None for misses)"""
+        cache = self._model(model)
+        if not await self._ready(cache):
+            embed_cache_lookups.labels(model=model, result="miss").inc(len(texts))
+            return [None] * len(texts)
+        
+        vectors = []
+        for key in self._keys(fields, texts):
+            vector = cache.get(key)
+            vectors.append(vector.tolist() if vector is not None else None)
+        hits = sum(v is not None for v in vectors)
+        embed_cache_lookups.labels(model=model, result="hit").inc(hits)
+        embed_cache_lookups.labels(model=model, result="miss").inc(len(texts) - hits)
+        return vectors
+    
+    def store(self, model: str, fields: dict, texts: List[str], vectors: List[list]):
+        """Add vectors to the cache (blocking; run it in a thread)"""
+        if not texts:
+            return
+        items = [
+            (key, np.asarray(vector, dtype="<f4"))
+            for key, vector in zip(self._keys(fields, texts), vectors)
+        ]
+        try:
+            self._model(model).put_many(items)
+        except OSError as e:
+            logger.error(f"Embedding cache write failed for {model}: {e}")
+    
+    def get_status(self) -> dict:
+        """Cache size per model opened by this worker"""
+        if not self.enabled:
+            return {"enabled": False}
+        return {
+            "enabled": True,
+            "directory": settings.embed_cache_dir,
+            "models": {model: cache.entries() for model, cache in self._models.items()}
+        }
+
+# Global embedding cache instance
+embedding_cache = EmbeddingCache()
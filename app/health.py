@@ -0,0 +1,61 @@
+from datetime import datetime, timezone
+from typing import Optional
+from sqlalchemy import text
+import asyncio
+import logging
+from app.config import settings
+from app.database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+class ReadinessMonitor:
+    """
+    Keeps database connectivity state fresh in the background so that
+    health and readiness probes never have to do I/O themselves
+    """
+    
+    def __init__(self):
+        self.database_connected = False
+        self.last_check: Optional[datetime] = None
+        self._task = None
+    
+    async def start(self):
+        """Run a first check immediately, then keep checking periodically"""
+        await self._check_database()
+        self._task = asyncio.create_task(self._check_loop())
+    
+    async def stop(self):
+        """Stop background checks"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+    
+    async def _check_loop(self):
+        while True:
+            try:
+                await asyncio.sleep(settings.readiness_check_interval)
+                await self._check_database()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Readiness check error: {e}")
+    
+    async def _check_database(self):
+        """Check that the database answers a trivial query"""
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(text("SELECT 1"))
+            if not self.database_connected:
+                logger.info("Database connection is ready")
+            self.database_connected = True
+        except Exception as e:
+            if self.database_connected or self.last_check is None:
+                logger.error(f"Database health check failed: {e}")
+            self.database_connected = False
+        self.last_check = datetime.now(timezone.utc)
+
+# Global readiness monitor instance
+readiness = ReadinessMonitor()
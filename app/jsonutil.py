@@ -0,0 +1,31 @@
+"""
+JSON encoding/decoding
+
+Uses orjson when it is installed (several times faster on large payloads
+such as long prompts and base64 images) and falls back to the standard
+library otherwise.
+"""
+
+from typing import Any
+import json
+
+try:
+    import orjson
+except ImportError:  # Optional dependency
+    orjson = None
+
+HAS_ORJSON = orjson is not None
+
+JSONDecodeError = (json.JSONDecodeError, orjson.JSONDecodeError) if orjson else json.JSONDecodeError
+
+def loads(data) -> Any:
+    """Parse JSON from bytes or str"""
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def dumps(obj: Any) -> bytes:
+    """Serialise to compact UTF-8 JSON bytes"""
+    if orjson:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
@@ -0,0 +1,46 @@
+"""
+Leader election between the workers of a host
+
+Background jobs that must run in one worker only (model warm-up, replica
+placement) take a non-blocking flock on a file in LEADER_LOCK_DIR. The lock
+goes away with the worker that holds it, and another worker takes over the
+next time it tries.
+"""
+
+from typing import Optional
+import fcntl
+import logging
+import os
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+class LeaderLock:
+    def __init__(self, name: str):
+        self.name = name
+        self._fd: Optional[int] = None
+    
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+    
+    def acquire(self) -> bool:
+        """Become the leader if no other worker is; True while this worker is"""
+        if self._fd is not None:
+            return True
+        os.makedirs(settings.leader_lock_dir, exist_ok=True)
+        fd = os.open(os.path.join(settings.leader_lock_dir, f"{self.name}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        logger.info(f"Worker {os.getpid()} is the {self.name} leader")
+        return True
+    
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,128 @@
+"""
+Adaptive concurrency limits per model
+
+Each worker keeps a concurrency limit per model that follows the backends'
+latency, in the style of Netflix's gradient limiter: a slow moving average
+of the time to first token is the no-load baseline, a fast one tracks the
+current latency. While the current latency stays within ADAPTIVE_TOLERANCE
+times the baseline the limit grows (by about its square root); when requests
+queue up in the backends the latency rises and the limit shrinks in
+proportion. Failed requests also shrink it.
+
+Requests above the limit are rejected at once with 503 and Retry-After
+instead of piling up until they time out. Requests waiting for a priority
+lane slot count against the limit; admin requests are never shed and bulk
+requests are shed first (they only get the unreserved share of the limit).
+"""
+
+from typing import Dict, Optional
+import math
+from app.config import settings
+from app.monitoring import concurrency_limit, requests_shed
+
+SMOOTHING = 0.2  # How far the limit moves towards a new estimate per sample
+SHORT_ALPHA = 0.2  # EWMA weight of a sample in the current latency
+LONG_WINDOW = 100  # Samples averaged into the baseline latency
+DROP_BACKOFF = 0.9  # Limit multiplier when a request fails
+
+class OverloadedError(Exception):
+    """The model's concurrency limit is reached; the request was shed"""
+    
+    def __init__(self, model: str, retry_after: int):
+        super().__init__(f"Too many requests in flight for model {model}, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+class _ModelLimit:
+    def __init__(self):
+        self.limit = float(settings.adaptive_initial_limit)
+        self.in_flight = 0
+        self.short_rtt: Optional[float] = None  # Recent time to first token (seconds)
+        self.long_rtt: Optional[float] = None  # Baseline
+        self.samples = 0
+        self.shed = 0
+    
+    def update(self, rtt: float, in_flight: int):
+        """Gradient step for one latency sample"""
+        self.samples += 1
+        if self.long_rtt is None:
+            self.short_rtt = self.long_rtt = rtt
+            return
+        self.short_rtt += (rtt - self.short_rtt) * SHORT_ALPHA
+        self.long_rtt += (rtt - self.long_rtt) / min(self.samples, LONG_WINDOW)
+        # After a sustained overload the baseline has drifted up; let it recover quickly
+        if self.long_rtt > 2 * self.short_rtt:
+            self.long_rtt *= 0.95
+        
+        # Only grow a limit that is actually being used
+        if in_flight < self.limit / 2:
+            return
+        gradient = max(0.5, min(1.0, settings.adaptive_tolerance * self.long_rtt / self.short_rtt))
+        estimate = self.limit * gradient + math.sqrt(self.limit)
+        self._set(self.limit * (1 - SMOOTHING) + estimate * SMOOTHING)
+    
+    def drop(self):
+        self._set(self.limit * DROP_BACKOFF)
+    
+    def _set(self, limit: float):
+        self.limit = max(float(settings.adaptive_min_limit), min(float(settings.adaptive_max_limit), limit))
+
+class AdaptiveLimiter:
+    def __init__(self):
+        self._models: Dict[str, _ModelLimit] = {}
+    
+    @property
+    def enabled(self) -> bool:
+        return settings.adaptive_concurrency
+    
+    def _model(self, model: str) -> _ModelLimit:
+        state = self._models.get(model)
+        if state is None:
+            state = self._models[model] = _ModelLimit()
+            concurrency_limit.labels(model=model).set(state.limit)
+        return state
+    
+    def acquire(self, model: str, lane: str):
+        """Count a request against the model's limit; raises OverloadedError to shed it"""
+        state = self._model(model)
+        if self.enabled and lane != "admin":
+            limit = state.limit
+            if lane == "bulk":
+                limit = max(limit * (1 - settings.priority_reserved_fraction), 1)
+            if state.in_flight >= int(limit):
+                state.shed += 1
+                requests_shed.labels(model=model, lane=lane).inc()
+                retry_after = max(1, math.ceil(state.short_rtt or 1))
+                raise OverloadedError(model, retry_after)
+        state.in_flight += 1
+    
+    def release(self, model: str, rtt: Optional[float] = None, failed: bool = False):
+        """
+        Finish a request counted by acquire(), with its time to first token
+        (None if unknown) or failed=True if the backends could not serve it
+        """
+        state = self._model(model)
+        in_flight = state.in_flight
+        state.in_flight -= 1
+        if not self.enabled:
+            return
+        if failed:
+            state.drop()
+        elif rtt is not None:
+            state.update(rtt, in_flight)
+        concurrency_limit.labels(model=model).set(state.limit)
+    
+    def get_status(self) -> dict:
+        """Current limits of this worker for /status"""
+        return {
+            "enabled": self.enabled,
+            "models": {
+                model: {
+                    "limit": round(state.limit, 1),
+                    "in_flight": state.in_flight,
+                    "baseline_ms": round(state.long_rtt * 1000, 1) if state.long_rtt is not None else None,
+                    "recent_ms": round(state.short_rtt * 1000, 1) if state.short_rtt is not None else None,
+                    "shed": state.shed
+                }
+                for model, state in self._models.items()
+            }
+        }
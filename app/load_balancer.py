@@ -1,21 +1,62 @@
 import httpx
-from typing import List, Optional, Tuple
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
 from datetime import datetime, timedelta, timezone
 import asyncio
+import hashlib
+import json
 import logging
+import re
+import time
+from app import jsonutil
 from app.config import settings
+from app.timing import record_phase
+from app.routing import HashRing, affinity_config, prefix_key, load_capacity
+from app.scheduler import PriorityScheduler, current_lane
+from app.limiter import AdaptiveLimiter
+from app.retry_budget import RetryBudget
+from app.outliers import OutlierDetector
+from app.capacity import CapacityEstimator, generation_stats
+from app.timeouts import DeadlineExceeded, backend_timeouts, bounded, current_deadline, remaining
+from app.monitoring import (
+    backend_requests, backend_response_time, backend_in_flight,
+    time_to_first_token, queue_wait, model_latency, routing_decisions
+)
 
 logger = logging.getLogger(__name__)
 
+MAX_RINGS = 64  # Cached affinity rings (candidate sets) before the cache is reset
+
+def model_tag(model: str) -> str:
+    """Name Ollama lists a model under (an untagged name means :latest)"""
+    return model if ":" in model else f"{model}:latest"
+
 class ServerStatus:
-    def __init__(self, url: str):
+    def __init__(self, url: str, healthy: bool = True):
         self.url = url
-        self.is_healthy = True
+        self.is_healthy = healthy  # False until the first health check for servers added at runtime
         self.last_check = datetime.now(timezone.utc)
         self.fail_count = 0
         self.success_count = 0
         self.response_time_ms = 0
         self.current_load = 0  # Number of active requests
+        self.draining = False  # No new requests; those in flight finish (see app.registry)
+        self.removing = False  # Removed from the registry, dropped once idle
+        self.models: Optional[List[dict]] = None  # Last /api/tags listing, None until fetched
+        self.resident: Optional[Set[str]] = None  # Models loaded in VRAM (/api/ps), None until polled
+    
+    @property
+    def available(self) -> bool:
+        """Whether the server takes new requests"""
+        return self.is_healthy and not self.draining
+    
+    def has_model(self, model: str) -> bool:
+        """Whether the model is in the server's last /api/tags listing"""
+        tag = model_tag(model)
+        return bool(self.models) and any(model_tag(m.get("name") or m.get("model") or "") == tag for m in self.models)
+    
+    def has_resident(self, model: str) -> bool:
+        """Whether the model was loaded when the server was last polled (or served since)"""
+        return self.resident is not None and model_tag(model) in self.resident
     
     def mark_success(self, response_time_ms: int):
         """Mark a successful request"""
@@ -35,30 +76,191 @@ class ServerStatus:
             self.is_healthy = False
             logger.warning(f"Server {self.url} marked as unhealthy after {self.fail_count} failures")
 
+# Ollama reports failures after the headers (e.g. a model that fails to load) as an error line
+_STREAM_ERROR = re.compile(rb'\s*\{\s*"error"\s*:')
+
+class BackendStatusError(Exception):
+    """
+    A backend rejected the request itself (4xx: unknown model, bad options)
+    Another server would answer the same, so it is not retried; the
+    backend's status and body are passed on to the client.
+    """
+    
+    def __init__(self, status_code: int, body: bytes, content_type: Optional[str]):
+        self.status_code = status_code
+        self.body = body
+        self.content_type = content_type or "application/json"
+        try:
+            self.message = str(jsonutil.loads(body).get("error") or body.decode(errors="replace"))
+        except Exception:
+            self.message = body.decode(errors="replace")
+        super().__init__(f"HTTP {status_code}: {self.message[:200]}")
+
+async def _first_chunk(response: httpx.Response) -> bytes:
+    """
+    Read the first chunk of a streamed response, failing if the backend
+    ends or reports an error before sending anything else
+    """
+    chunks = response.aiter_raw()
+    try:
+        chunk = await chunks.__anext__()
+    except StopAsyncIteration:
+        raise Exception("Backend closed the stream without sending anything")
+    if _STREAM_ERROR.match(chunk):
+        raise Exception(f"Backend stream failed: {chunk[:200].decode(errors='replace').strip()}")
+    response.extensions["chunks"] = chunks
+    return chunk
+
+def _retryable_status(status_code: int) -> bool:
+    """Server errors, timeouts and backend overload are worth trying elsewhere"""
+    return status_code >= 500 or status_code in (408, 429)
+
+class _LastLine:
+    """Keeps the last complete line of an NDJSON stream without buffering the rest"""
+    
+    def __init__(self):
+        self.partial = bytearray()
+        self.last = b""
+    
+    def feed(self, chunk: bytes):
+        self.partial += chunk
+        end = self.partial.rfind(b"\n")
+        if end == -1:
+            return
+        start = self.partial.rfind(b"\n", 0, end) + 1
+        if end > start:
+            self.last = bytes(self.partial[start:end])
+        del self.partial[:end + 1]
+    
+    def result(self) -> bytes:
+        return bytes(self.partial) if self.partial.strip() else self.last
+
+class _FinalLineHold:
+    """
+    Relays an NDJSON stream line by line, holding back the final
+    (`"done": true`) line so it can be rewritten before it is sent
+    """
+    
+    DONE = re.compile(rb'"done":\s*true')
+    
+    def __init__(self):
+        self.partial = bytearray()
+        self.held: Optional[bytearray] = None
+    
+    def feed(self, chunk: bytes) -> bytes:
+        """Return the part of the stream that can be relayed now"""
+        if self.held is not None:
+            self.held += chunk
+            return b""
+        newline = chunk.rfind(b"\n")
+        if newline == -1:
+            self.partial += chunk
+            return b""
+        complete = bytes(self.partial) + chunk[:newline + 1]
+        self.partial = bytearray(chunk[newline + 1:])
+        match = self.DONE.search(complete)
+        if not match:
+            return complete
+        line_start = complete.rfind(b"\n", 0, match.start()) + 1
+        self.held = bytearray(complete[line_start:]) + self.partial
+        self.partial = bytearray()
+        return complete[:line_start]
+    
+    def final(self) -> Tuple[bytes, bytes]:
+        """(final line, anything after it) once the stream has ended"""
+        rest = bytes(self.held) if self.held is not None else bytes(self.partial)
+        line, newline, tail = rest.partition(b"\n")
+        return line, newline + tail
+
+_EVAL_DURATION = re.compile(rb'"eval_duration"\s*:\s*(\d+)')
+
+def _time_to_first_token(response: httpx.Response) -> float:
+    """
+    Latency of a non-streamed response without its generation time, which
+    depends on the output length (the whole duration for embeddings)
+    """
+    elapsed = time.perf_counter() - response.extensions["dispatched_at"]
+    match = _EVAL_DURATION.search(response.content[-512:])  # Stats come last
+    if match:
+        elapsed -= int(match.group(1)) / 1e9
+    return max(elapsed, 0.0)
+
 class LoadBalancer:
     def __init__(self):
         self.servers: List[ServerStatus] = []
         self.current_index = 0
         self.health_check_task = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self.initial_check_done = asyncio.Event()
+        
+        # Merged /api/tags catalogue, rebuilt whenever a sweep fetches fresh listings
+        self.model_catalog: List[dict] = []
+        self.model_catalog_body: bytes = b""
+        self.model_catalog_etag: Optional[str] = None
+        self._refresh_lock = asyncio.Lock()
         
-        # Initialize servers from config
-        self._update_servers_from_config()
+        # Prefix-affinity routing; one ring per candidate set (the servers that have a model)
+        self._rings: Dict[Tuple[str, ...], HashRing] = {}
+        self.affinity_hits = 0  # Requests placed on their prefix's own server
+        self.affinity_spills = 0  # Requests moved on because that server was saturated
+        
+        # Priority lanes share this worker's backend slots
+        self.scheduler = PriorityScheduler(lambda: sum(1 for s in self.servers if s.available))
+        self.limiter = AdaptiveLimiter()
+        self.retry_budget = RetryBudget()
+        self.outliers = OutlierDetector()
+        self.capacity = CapacityEstimator()
+        
+        # Initialize servers from config; the backend registry takes over at startup
+        self.sync_servers({url: {} for url in settings.ollama_servers})
         
         logger.info(f"Load balancer initialized with {len(self.servers)} servers")
     
-    def _update_servers_from_config(self):
-        """Update server list from config, adding new servers if needed"""
-        config_servers = set(settings.ollama_servers)
-        existing_servers = {s.url for s in self.servers}
+    def sync_servers(self, entries: Dict[str, dict], checked: bool = False) -> List[str]:
+        """
+        Bring the server list in line with the backend registry (see app.registry)
+        
+        Adds new servers and updates drain flags and weights. With checked=True
+        new servers take no requests until a health check reaches them; the
+        servers known at startup are covered by the initial sweep instead.
+        Removed servers take no new requests and are dropped once their
+        requests in flight finish. Returns the URLs of the added servers.
+        """
+        added = []
+        for url, entry in entries.items():
+            server = self.get_server(url)
+            if server is None:
+                server = ServerStatus(url, healthy=not checked)
+                self.servers.append(server)
+                added.append(url)
+                logger.info(f"Added new server to load balancer: {url}")
+            elif server.removing:
+                server.removing = False
+                logger.info(f"Server {url} is back in the registry")
+            draining = bool(entry.get("drain"))
+            if draining != server.draining:
+                server.draining = draining
+                logger.info(f"Server {url} {'is draining' if draining else 'takes requests again'}")
         
-        # Add new servers
-        for server_url in config_servers:
-            if server_url not in existing_servers:
-                self.servers.append(ServerStatus(server_url))
-                logger.info(f"Added new server to load balancer: {server_url}")
+        for server in list(self.servers):
+            if server.url not in entries and not server.removing:
+                server.removing = True
+                server.draining = True
+                logger.info(f"Removing server {server.url} ({server.current_load} requests in flight)")
+                self._retire(server)
         
-        # Remove servers that are no longer in config (optional - keep for now)
-        # This allows graceful removal of servers
+        self.capacity.set_weights({
+            url: entry["weight"] for url, entry in entries.items() if entry.get("weight") is not None
+        })
+        return added
+    
+    def _retire(self, server: ServerStatus):
+        """Drop a removed server once it has no requests in flight"""
+        if server.removing and server.current_load == 0 and server in self.servers:
+            self.servers.remove(server)
+            self.capacity.forget(server.url)
+            self.outliers.forget(server.url)
+            logger.info(f"Removed server from load balancer: {server.url}")
     
     async def start_health_checks(self):
         """Start periodic health checks"""
@@ -73,10 +275,58 @@ class LoadBalancer:
             except asyncio.CancelledError:
                 pass
     
+    async def close(self):
+        """Close pooled backend connections"""
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        """Shared client so backend connections are pooled and kept alive"""
+        if self._client is None:
+            # Per-request timeouts are set by _send_with_failover (see app.timeouts)
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(settings.backend_first_byte_timeout, connect=settings.backend_connect_timeout),
+                limits=httpx.Limits(max_connections=None, max_keepalive_connections=64)
+            )
+        return self._client
+    
+    def get_server(self, url: str) -> Optional[ServerStatus]:
+        """Look up a server by URL"""
+        return next((s for s in self.servers if s.url == url), None)
+    
+    def _acquire(self, server: ServerStatus):
+        """Count a request against a server"""
+        server.current_load += 1
+        backend_in_flight.labels(server=server.url).inc()
+    
+    def _release(self, server: ServerStatus):
+        """Release a request counted by _acquire"""
+        server.current_load -= 1
+        backend_in_flight.labels(server=server.url).dec()
+        if server.removing:
+            self._retire(server)
+    
+    async def wait_for_initial_check(self, timeout: float) -> bool:
+        """
+        Wait for the first health sweep to finish
+        Returns False if it did not complete within timeout seconds
+        """
+        try:
+            await asyncio.wait_for(self.initial_check_done.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+    
     async def _health_check_loop(self):
         """Periodic health check for all servers"""
         # Do an immediate check on startup
-        await self._check_all_servers()
+        try:
+            await self._check_all_servers()
+        except Exception as e:
+            logger.error(f"Initial health check error: {e}")
+        finally:
+            self.initial_check_done.set()
         
         while True:
             try:
@@ -88,46 +338,146 @@ class LoadBalancer:
                 logger.error(f"Health check error: {e}")
     
     async def _check_all_servers(self):
-        """Check health of all servers"""
-        # Update server list from config in case it changed
-        self._update_servers_from_config()
-        
+        """Check health of all servers and refresh the model catalogue"""
         async with httpx.AsyncClient(timeout=10.0) as client:
-            for server in self.servers:
+            await asyncio.gather(*(self._check_server(client, server) for server in self.servers))
+        
+        self._rebuild_model_catalog()
+    
+    async def _check_server(self, client: httpx.AsyncClient, server: ServerStatus):
+        """Check health of a single server, keeping its model listing"""
+        try:
+            start_time = datetime.now(timezone.utc)
+            response = await client.get(f"{server.url}/api/tags")
+            
+            if response.status_code == 200:
+                response_time = (datetime.now(timezone.utc) - start_time).total_seconds() * 1000
+                was_healthy = server.is_healthy
+                server.mark_success(int(response_time))
+                
+                if not was_healthy:
+                    logger.info(f"Server {server.url} is back online")
+                
                 try:
-                    start_time = datetime.now(timezone.utc)
-                    response = await client.get(f"{server.url}/api/tags")
-                    
-                    if response.status_code == 200:
-                        response_time = (datetime.now(timezone.utc) - start_time).total_seconds() * 1000
-                        server.mark_success(int(response_time))
-                        
-                        if not server.is_healthy:
-                            logger.info(f"Server {server.url} is back online")
-                        
-                        # Log model count for debugging
-                        try:
-                            data = response.json()
-                            model_count = len(data.get("models", []))
-                            logger.debug(f"Server {server.url} has {model_count} models")
-                        except:
-                            pass
-                    else:
-                        server.mark_failure()
-                        logger.warning(f"Health check failed for {server.url}: HTTP {response.status_code}")
-                        
-                except Exception as e:
-                    server.mark_failure()
-                    logger.warning(f"Health check failed for {server.url}: {e}")
-                    # Log more details for debugging
-                    logger.debug(f"Health check error details for {server.url}: {type(e).__name__}: {str(e)}")
+                    server.models = response.json().get("models", [])
+                    logger.debug(f"Server {server.url} has {len(server.models)} models")
+                except ValueError:
+                    logger.warning(f"Server {server.url} returned an invalid model listing")
+            else:
+                server.mark_failure()
+                logger.warning(f"Health check failed for {server.url}: HTTP {response.status_code}")
+        
+        except Exception as e:
+            server.mark_failure()
+            logger.warning(f"Health check failed for {server.url}: {e}")
+            # Log more details for debugging
+            logger.debug(f"Health check error details for {server.url}: {type(e).__name__}: {str(e)}")
+    
+    def _rebuild_model_catalog(self):
+        """Merge per-server model listings into the catalogue served by /api/tags"""
+        servers = [s for s in self.servers if s.available and s.models is not None]
+        if not servers:
+            # If no healthy servers, serve whatever we last saw
+            servers = [s for s in self.servers if s.models is not None]
+        
+        all_models = []
+        model_map = {}  # Track unique models by name to avoid duplicates
+        for server in servers:
+            for model in server.models:
+                model_name = model.get("name", "")
+                if not model_name:
+                    continue
+                if model_name not in model_map:
+                    # First time seeing this model
+                    model_with_server = model.copy()
+                    model_with_server["server"] = server.url
+                    model_map[model_name] = model_with_server
+                    all_models.append(model_with_server)
+                else:
+                    # Model already exists, add server to available servers list
+                    existing = model_map[model_name]
+                    if "servers" not in existing:
+                        existing["servers"] = [existing.get("server", "")]
+                    if server.url not in existing["servers"]:
+                        existing["servers"].append(server.url)
+        
+        body = json.dumps({"models": all_models}).encode()
+        if body != self.model_catalog_body:
+            self.model_catalog = all_models
+            self.model_catalog_body = body
+            self.model_catalog_etag = f'"{hashlib.sha1(body).hexdigest()}"'
+            logger.info(f"Model catalogue updated: {len(all_models)} models from {len(servers)} servers")
+    
+    async def fetch_resident_models(self, server: ServerStatus):
+        """Update the server's loaded models from its /api/ps"""
+        response = await self._get_client().get(f"{server.url}/api/ps", timeout=10.0)
+        response.raise_for_status()
+        server.resident = {
+            model_tag(m.get("name") or m.get("model") or "") for m in response.json().get("models", [])
+        }
+    
+    async def load_model(self, server: ServerStatus, model: str, keep_alive: str):
+        """Load a model on a server without generating anything (an empty /api/generate)"""
+        self._acquire(server)
+        try:
+            response = await self._get_client().post(
+                f"{server.url}/api/generate",
+                json={"model": model, "keep_alive": keep_alive},
+                timeout=httpx.Timeout(settings.backend_first_byte_timeout, connect=settings.backend_connect_timeout)
+            )
+            if response.status_code >= 400:
+                raise BackendStatusError(response.status_code, response.content, response.headers.get("content-type"))
+            if server.resident is not None:
+                server.resident.add(model_tag(model))
+        finally:
+            self._release(server)
     
-    def get_next_server(self, exclude_servers: Optional[List[str]] = None) -> Optional[ServerStatus]:
+    async def pull_model(self, server: ServerStatus, model: str):
+        """Install a model on a server (/api/pull; waits until it is downloaded)"""
+        response = await self._get_client().post(
+            f"{server.url}/api/pull",
+            json={"model": model, "stream": False},
+            timeout=httpx.Timeout(None, connect=settings.backend_connect_timeout)
+        )
+        if response.status_code >= 400:
+            raise BackendStatusError(response.status_code, response.content, response.headers.get("content-type"))
+        status = response.json().get("status")
+        if status != "success":
+            raise Exception(f"Pull ended with status {status!r}")
+    
+    async def delete_model(self, server: ServerStatus, model: str):
+        """Remove a model from a server (/api/delete)"""
+        response = await self._get_client().request(
+            "DELETE", f"{server.url}/api/delete", json={"model": model}, timeout=30.0
+        )
+        if response.status_code >= 400:
+            raise BackendStatusError(response.status_code, response.content, response.headers.get("content-type"))
+        if server.resident is not None:
+            server.resident.discard(model_tag(model))
+    
+    async def refresh_model_catalog(self):
+        """Run a health sweep now to refresh the model catalogue"""
+        async with self._refresh_lock:
+            await self._check_all_servers()
+    
+    def get_next_server(
+        self,
+        exclude_servers: Optional[List[str]] = None,
+        model: Optional[str] = None
+    ) -> Optional[ServerStatus]:
         """
         Get next available server using least connections algorithm with round-robin tie-breaking
+        
+        Load is counted per unit of the server's capacity weight for the
+        model (see app.capacity), so faster servers take more requests.
+        
+        With a model, only servers that list it in /api/tags are considered
+        (if any do), and of those the ones that have it loaded are preferred
+        unless their load exceeds that of the others by more than
+        RESIDENCY_SPILL_LOAD.
         """
-        # Filter healthy servers
-        healthy_servers = [s for s in self.servers if s.is_healthy]
+        # Filter healthy servers that are not draining
+        healthy_servers = [s for s in self.servers if s.available]
         
         if not healthy_servers:
             logger.error("No healthy servers available!")
@@ -139,11 +489,21 @@ class LoadBalancer:
             if not healthy_servers:
                 return None
         
-        # Find minimum load
-        min_load = min(s.current_load for s in healthy_servers)
+        if model:
+            # Models need not be installed everywhere (see app.placement)
+            installed = [s for s in healthy_servers if s.has_model(model)]
+            if installed:
+                healthy_servers = installed
+            if settings.residency_tracking:
+                healthy_servers = self._prefer_resident(healthy_servers, model)
+        
+        # Find minimum load per unit of capacity; the request itself counts, so idle
+        # servers are ordered by weight too
+        loads = {s.url: round((s.current_load + 1) / self.capacity.weight(s.url, model), 6) for s in healthy_servers}
+        min_load = min(loads.values())
         
         # Get all servers with minimum load
-        min_load_servers = [s for s in healthy_servers if s.current_load == min_load]
+        min_load_servers = [s for s in healthy_servers if loads[s.url] == min_load]
         
         # If multiple servers have same load, use round-robin for tie-breaking
         if len(min_load_servers) > 1:
@@ -154,11 +514,94 @@ class LoadBalancer:
         
         return selected_server
     
+    def get_affinity_server(
+        self,
+        key: int,
+        load_factor: float,
+        exclude_servers: Optional[List[str]] = None,
+        model: Optional[str] = None
+    ) -> Optional[ServerStatus]:
+        """
+        Get the server owning `key` on the consistent-hash ring of healthy servers,
+        skipping servers whose load is above the bounded-load capacity
+        
+        The candidates are chosen as in get_next_server: with a model, the
+        servers that list it, narrowed to those that have it loaded. Each
+        server's bounded-load capacity is scaled by its capacity weight.
+        """
+        healthy_servers = [s for s in self.servers if s.available]
+        if not healthy_servers:
+            return None
+        
+        if model:
+            installed = [s for s in healthy_servers if s.has_model(model)]
+            if installed:
+                healthy_servers = installed
+            if settings.residency_tracking:
+                healthy_servers = self._prefer_resident(healthy_servers, model)
+        
+        urls = tuple(sorted(s.url for s in healthy_servers))
+        ring = self._rings.get(urls)
+        if ring is None:
+            if len(self._rings) >= MAX_RINGS:
+                self._rings.clear()
+            ring = self._rings[urls] = HashRing(list(urls))
+        
+        by_url = {s.url: s for s in healthy_servers}
+        weights = {s.url: self.capacity.weight(s.url, model) for s in healthy_servers}
+        total_load = sum(s.current_load for s in healthy_servers)
+        total_weight = sum(weights.values())
+        for position, url in enumerate(ring.walk(key)):
+            if exclude_servers and url in exclude_servers:
+                continue
+            server = by_url[url]
+            if server.current_load < load_capacity(total_load, total_weight, load_factor, weights[url]):
+                if position == 0:
+                    self.affinity_hits += 1
+                    routing_decisions.labels(strategy="prefix_affinity", outcome="hit").inc()
+                else:
+                    self.affinity_spills += 1
+                    routing_decisions.labels(strategy="prefix_affinity", outcome="spill").inc()
+                return server
+        return None
+    
+    def _prefer_resident(self, servers: List[ServerStatus], model: str) -> List[ServerStatus]:
+        """Narrow candidates to those with the model loaded, unless they are too busy"""
+        warm = [s for s in servers if s.has_resident(model)]
+        if not warm:
+            routing_decisions.labels(strategy="residency", outcome="cold").inc()
+            return servers
+        if len(warm) == len(servers):
+            routing_decisions.labels(strategy="residency", outcome="warm").inc()
+            return servers
+        # A cold load costs far more than queueing behind a few requests
+        min_cold_load = min(s.current_load for s in servers if not s.has_resident(model))
+        if min(s.current_load for s in warm) > min_cold_load + settings.residency_spill_load:
+            routing_decisions.labels(strategy="residency", outcome="spill").inc()
+            return servers
+        routing_decisions.labels(strategy="residency", outcome="warm").inc()
+        return warm
+    
+    def _record_generation(self, server: ServerStatus, model: str, tail: bytes):
+        """Feed the generation speed of a completed request to the capacity weights"""
+        stats = generation_stats(tail)
+        if stats:
+            self.capacity.record(server.url, model, *stats, concurrency=server.current_load)
+    
+    def _model_elsewhere(self, model: Optional[str], exclude_servers: List[str]) -> bool:
+        """Whether another healthy server lists `model` in its /api/tags"""
+        if not model:
+            return False
+        return any(
+            s.available and s.url not in exclude_servers and s.has_model(model)
+            for s in self.servers
+        )
+    
     def get_server_by_round_robin(self) -> Optional[ServerStatus]:
         """
         Get next server using round-robin algorithm
         """
-        healthy_servers = [s for s in self.servers if s.is_healthy]
+        healthy_servers = [s for s in self.servers if s.available]
         
         if not healthy_servers:
             return None
@@ -174,29 +617,123 @@ class LoadBalancer:
         method: str,
         path: str,
         json_data: dict = None,
-        stream: bool = False
+        stream: bool = False,
+        model: Optional[str] = None,
+        content: Optional[bytes] = None,
+        preferred_server: Optional[str] = None,
+        prefix: Optional[str] = None
     ) -> Tuple[httpx.Response, str]:
         """
         Proxy request to backend server with automatic failover
         Returns: (response, server_url_used)
-        """
-        # Update server list from config before making request
-        self._update_servers_from_config()
         
+        `content` sends an already encoded JSON body instead of `json_data`.
+        `preferred_server` is tried first if it is healthy (affinity), with the
+        usual failover to the other servers.
+        
+        With stream=True only the first chunk of the body has been read: the
+        caller must consume it through relay_stream(), which also releases the
+        server, and close_stream() it if the body may never be iterated. Until that first chunk arrives (within the model's first-byte
+        timeout) a stream can still fail over; after it, it is committed to
+        its server.
+        
+        Connection failures, timeouts and 5xx responses fail over to the next
+        server, within the retry budget (see app.retry_budget). A 4xx response
+        raises BackendStatusError at once, unless it is a 404 and another
+        server has the model.
+        
+        Servers ejected as latency outliers for the model (see app.outliers)
+        are skipped while others are available.
+        
+        The request is shed with OverloadedError if the model is at its
+        adaptive concurrency limit (see app.limiter), then waits for a slot in
+        its priority lane (see app.scheduler). A stream keeps both until
+        relay_stream finishes.
+        """
+        queued_at = time.perf_counter()
+        model_label = model or "unknown"
+        lane = current_lane()
+        self.limiter.acquire(model_label, lane)
+        try:
+            await self.scheduler.acquire(lane)
+        except BaseException:
+            self.limiter.release(model_label)
+            raise
+        try:
+            response, server_url = await self._send_with_failover(
+                method, path, json_data, stream, model, content, preferred_server, prefix, queued_at
+            )
+        except BaseException as e:
+            self.scheduler.release(lane)
+            # Only backend failures count against the limit, not client errors or expired deadlines
+            failed = isinstance(e, Exception) and not isinstance(e, (DeadlineExceeded, BackendStatusError))
+            self.limiter.release(model_label, failed=failed)
+            raise
+        if stream:
+            response.extensions["lane"] = lane
+            response.extensions["limiter_model"] = model_label
+            response.extensions["deadline"] = current_deadline()
+        else:
+            self.scheduler.release(lane)
+            rtt = _time_to_first_token(response)
+            self.limiter.release(model_label, rtt=rtt)
+            self.outliers.record(server_url, model_label, rtt)
+        return (response, server_url)
+    
+    async def _send_with_failover(
+        self,
+        method: str,
+        path: str,
+        json_data: Optional[dict],
+        stream: bool,
+        model: Optional[str],
+        content: Optional[bytes],
+        preferred_server: Optional[str],
+        prefix: Optional[str],
+        queued_at: float
+    ) -> Tuple[httpx.Response, str]:
+        """Send a request to the best server, failing over to the others"""
+        model_label = model or "unknown"
+        affinity = affinity_config(model) if prefix is not None else None
+        key = prefix_key(model_label, prefix, affinity.prefix_chars) if affinity else None
+        timeouts = backend_timeouts(model)
+        deadline = current_deadline()
+        ejected = self.outliers.ejected(model_label)
         max_retries = len(self.servers)
         last_exception = None
         tried_servers = []  # Track servers we've already tried
+        self.retry_budget.record_request()
         
         for attempt in range(max_retries):
-            server = self.get_next_server(exclude_servers=tried_servers)
+            if attempt > 0 and not self.retry_budget.try_retry():
+                logger.warning(f"Retry budget spent, not retrying {path} after: {last_exception}")
+                raise Exception(f"Backend request failed and the retry budget is spent. Last error: {last_exception}")
+            # Connect bounds only the connection; first byte and idle gaps are enforced below
+            timeout = httpx.Timeout(None, connect=bounded(timeouts.connect, deadline))
+            server = None
+            if attempt == 0 and preferred_server:
+                server = self.get_server(preferred_server)
+                if server and (not server.available or server.url in ejected):
+                    server = None
+            if server is None and affinity:
+                server = self.get_affinity_server(
+                    key, affinity.load_factor, exclude_servers=tried_servers + ejected, model=model
+                )
+            if server is None:
+                server = self.get_next_server(exclude_servers=tried_servers + ejected, model=model)
+            if server is None and ejected:
+                # Only ejected servers are left: a slow answer beats none
+                server = self.get_next_server(exclude_servers=tried_servers, model=model)
             
             if not server:
                 # If no healthy servers, try all servers once
                 if attempt == 0:
                     logger.warning("No healthy servers, trying all servers anyway")
-                    all_servers = [s for s in self.servers if s.url not in tried_servers]
+                    all_servers = [s for s in self.servers if s.url not in tried_servers and not s.draining]
                     if all_servers:
                         server = all_servers[attempt % len(all_servers)]
+                    elif self.servers:
+                        raise Exception("No servers available: all are draining")
                     else:
                         raise Exception("No servers configured")
                 else:
@@ -206,48 +743,96 @@ class LoadBalancer:
             tried_servers.append(server.url)
             
             # Increment load counter
-            server.current_load += 1
+            self._acquire(server)
             server_url_used = server.url  # Store the server URL used
             
             try:
                 url = f"{server.url}{path}"
+                client = self._get_client()
+                start_time = time.perf_counter()
+                if attempt == 0:
+                    queue_wait.labels(model=model_label).observe(start_time - queued_at)
+                    record_phase("queue_wait", start_time - queued_at)
                 
-                async with httpx.AsyncClient(timeout=300.0) as client:
-                    start_time = datetime.now(timezone.utc)
+                if content is not None:
+                    request = client.build_request(
+                        method=method, url=url, content=content, timeout=timeout,
+                        headers={"Content-Type": "application/json"}
+                    )
+                else:
+                    request = client.build_request(method=method, url=url, json=json_data, timeout=timeout)
+                first_byte_timeout = bounded(timeouts.first_byte, deadline)
+                try:
+                    response = await asyncio.wait_for(client.send(request, stream=True), first_byte_timeout)
+                    headers_at = time.perf_counter()
+                    record_phase("backend_connect", headers_at - start_time)
                     
-                    if stream:
-                        # For streaming requests
-                        response = await client.request(
-                            method=method,
-                            url=url,
-                            json=json_data
-                        )
+                    if not stream or response.status_code >= 400:
+                        try:
+                            await asyncio.wait_for(response.aread(), first_byte_timeout - (headers_at - start_time))
+                        finally:
+                            await response.aclose()
+                        if not stream:
+                            record_phase("backend_read", time.perf_counter() - headers_at)
                     else:
-                        response = await client.request(
-                            method=method,
-                            url=url,
-                            json=json_data
-                        )
-                    
-                    # Check response status
-                    if response.status_code >= 400:
-                        raise Exception(f"HTTP {response.status_code}: {response.text[:200]}")
-                    
-                    # Calculate response time
-                    response_time = (datetime.now(timezone.utc) - start_time).total_seconds() * 1000
-                    
-                    # Mark success
-                    server.mark_success(int(response_time))
-                    
-                    # Decrement load counter
-                    server.current_load -= 1
-                    
-                    return (response, server_url_used)
-                    
+                        # Streams wait for their first chunk only: a backend that hangs (e.g. while
+                        # loading the model) or fails before sending anything can still be failed
+                        # over, while the rest is relayed as it arrives
+                        try:
+                            response.extensions["first_chunk"] = await asyncio.wait_for(
+                                _first_chunk(response), first_byte_timeout - (headers_at - start_time)
+                            )
+                        except BaseException:
+                            await response.aclose()
+                            raise
+                        response.extensions["first_chunk_at"] = time.perf_counter()
+                except asyncio.TimeoutError:
+                    remaining(deadline)  # Raises DeadlineExceeded if it was the deadline that ran out
+                    raise Exception(f"No response within {timeouts.first_byte}s")
+                
+                backend_requests.labels(server=server.url, status=str(response.status_code)).inc()
+                
+                # Check response status
+                if response.status_code >= 400 and not _retryable_status(response.status_code):
+                    error = BackendStatusError(response.status_code, response.content, response.headers.get("content-type"))
+                    # Not every server has every model: a 404 may succeed on one that lists it
+                    if response.status_code == 404 and self._model_elsewhere(model, tried_servers):
+                        logger.info(f"{server.url} does not have {model_label}, trying another server")
+                        self._release(server)
+                        last_exception = error
+                        continue
+                    raise error
+                if response.status_code >= 400:
+                    raise Exception(f"HTTP {response.status_code}: {response.text[:200]}")
+                
+                # Calculate response time
+                response_time = time.perf_counter() - start_time
+                backend_response_time.labels(server=server.url).observe(response_time)
+                
+                # Mark success
+                server.mark_success(int(response_time * 1000))
+                if model and server.resident is not None:
+                    # Ollama loaded the model to serve this; the next poll confirms it
+                    server.resident.add(model_tag(model))
+                
+                response.extensions["dispatched_at"] = start_time
+                if stream:
+                    # Load counter, lane slot and concurrency limit are released by relay_stream
+                    response.extensions["headers_at"] = headers_at
+                else:
+                    model_latency.labels(model=model_label, endpoint=path).observe(response_time)
+                    self._record_generation(server, model_label, response.content[-512:])
+                    self._release(server)
+                
+                return (response, server_url_used)
+            
+            except (DeadlineExceeded, BackendStatusError):
+                self._release(server)
+                raise
             except Exception as e:
                 logger.warning(f"Request to {server.url}{path} failed: {e}")
                 server.mark_failure()
-                server.current_load -= 1
+                self._release(server)
                 last_exception = e
                 
                 # Try next server (already added to tried_servers)
@@ -256,19 +841,174 @@ class LoadBalancer:
         # All servers failed
         raise Exception(f"All backend servers failed. Last error: {last_exception}")
     
+    async def relay_stream(
+        self,
+        response: httpx.Response,
+        server_url: str,
+        model: Optional[str] = None,
+        on_complete: Optional[Callable[[dict], None]] = None,
+        rewrite_final: Optional[Callable[[dict], Awaitable[dict]]] = None,
+        on_chunk: Optional[Callable[[bytes], None]] = None
+    ) -> AsyncIterator[bytes]:
+        """
+        Relay a streaming response from proxy_request(stream=True) chunk by chunk
+        
+        Records time to first token and full stream latency, always closes the
+        backend response and releases the server. If on_complete is given it is
+        called with the final NDJSON object (Ollama's stats) once the stream ends.
+        If rewrite_final is given, the final object is replaced by what it
+        returns; the stream is then relayed in whole lines. on_chunk sees every
+        raw chunk as received.
+        
+        If the backend goes quiet for longer than the model's idle timeout, or
+        the request's deadline passes, the backend response is closed and the
+        stream ends with an Ollama-style `{"error": ...}` line.
+        """
+        model_label = model or "unknown"
+        dispatched_at = response.extensions.get("dispatched_at", time.perf_counter())
+        headers_at = response.extensions.get("headers_at", dispatched_at)
+        idle_timeout = backend_timeouts(model).idle
+        deadline = response.extensions.get("deadline")
+        last_line = _LastLine() if on_complete else None
+        hold = _FinalLineHold() if rewrite_final else None
+        first_chunk = True
+        at_line_start = True
+        tail = b""  # End of the stream, where Ollama puts its stats
+        # proxy_request already read the first chunk (see _first_chunk)
+        pending_chunk = response.extensions.pop("first_chunk", None)
+        chunks = response.extensions.pop("chunks", None) or response.aiter_raw()
+        
+        try:
+            while True:
+                try:
+                    if pending_chunk is not None:
+                        chunk, pending_chunk = pending_chunk, None
+                    else:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), bounded(idle_timeout, deadline))
+                except StopAsyncIteration:
+                    break
+                except (asyncio.TimeoutError, DeadlineExceeded):
+                    # Bytes were already sent, so the stream cannot fail over; end it cleanly
+                    if deadline is not None and deadline <= time.monotonic():
+                        reason = "Request deadline exceeded"
+                    else:
+                        reason = f"Backend sent nothing for {idle_timeout}s"
+                        server = self.get_server(server_url)
+                        if server:
+                            server.mark_failure()
+                    logger.warning(f"Stream from {server_url} aborted: {reason}")
+                    pending = b"".join(hold.final()) if hold else b""
+                    if pending:
+                        at_line_start = pending.endswith(b"\n")
+                    yield pending + (b"" if at_line_start else b"\n") + jsonutil.dumps({"error": reason}) + b"\n"
+                    return
+                
+                if first_chunk:
+                    first_chunk_at = response.extensions.get("first_chunk_at", time.perf_counter())
+                    ttft = first_chunk_at - dispatched_at
+                    time_to_first_token.labels(model=model_label).observe(ttft)
+                    record_phase("ttft", ttft)
+                    first_chunk = False
+                if last_line:
+                    last_line.feed(chunk)
+                if on_chunk:
+                    on_chunk(chunk)
+                tail = tail[-512:] + chunk if len(chunk) < 512 else chunk
+                if hold:
+                    chunk = hold.feed(chunk)
+                    if not chunk:
+                        continue
+                at_line_start = chunk.endswith(b"\n")
+                yield chunk
+            
+            if hold:
+                line, rest = hold.final()
+                if line.strip():
+                    try:
+                        line = jsonutil.dumps(await rewrite_final(jsonutil.loads(line)))
+                    except Exception as e:
+                        logger.error(f"Rewriting final stream line failed: {e}")
+                yield line + rest
+        finally:
+            await response.aclose()
+            finished_at = time.perf_counter()
+            record_phase("stream", finished_at - headers_at)
+            model_latency.labels(model=model_label, endpoint=response.request.url.path).observe(
+                finished_at - dispatched_at
+            )
+            server = self.get_server(server_url)
+            if server:
+                self._record_generation(server, model_label, tail[-512:])
+            self._release_stream(response, server_url, rtt=None if first_chunk else first_chunk_at - dispatched_at)
+            if not first_chunk:
+                self.outliers.record(server_url, model_label, first_chunk_at - dispatched_at)
+        
+        if last_line:
+            try:
+                final = json.loads(last_line.result())
+            except ValueError:
+                return
+            if isinstance(final, dict):
+                try:
+                    on_complete(final)
+                except Exception as e:
+                    logger.error(f"Stream completion handler failed: {e}")
+    
+    def _release_stream(self, response: httpx.Response, server_url: str, rtt: Optional[float] = None):
+        """Release the server, lane and limiter slots held by a stream (once)"""
+        if response.extensions.get("released"):
+            return
+        response.extensions["released"] = True
+        server = self.get_server(server_url)
+        if server:
+            self._release(server)
+        if "lane" in response.extensions:
+            self.scheduler.release(response.extensions["lane"])
+        if "limiter_model" in response.extensions:
+            self.limiter.release(response.extensions["limiter_model"], rtt=rtt)
+    
+    async def close_stream(self, response: httpx.Response, server_url: str):
+        """
+        Close a backend stream and release its slots if relay_stream did not
+        
+        relay_stream releases them in its finally, which only runs once the
+        body is iterated; call this after the response was sent, or instead of
+        sending it, so a client that disconnects early leaks nothing.
+        """
+        self._release_stream(response, server_url)
+        await response.aclose()
+    
     def get_status(self) -> dict:
         """Get status of all servers"""
         return {
             "total_servers": len(self.servers),
             "healthy_servers": sum(1 for s in self.servers if s.is_healthy),
+            "draining_servers": sum(1 for s in self.servers if s.draining),
+            "catalog_models": len(self.model_catalog),
+            "catalog_etag": self.model_catalog_etag,
+            "priority_lanes": self.scheduler.get_status(),
+            "concurrency_limits": self.limiter.get_status(),
+            "retry_budget": self.retry_budget.get_status(),
+            "outlier_ejection": self.outliers.get_status(),
+            "capacity_weights": self.capacity.get_status(),
+            "prefix_affinity": {
+                "enabled": settings.prefix_affinity,
+                "models": settings.prefix_affinity_models,
+                "hits": self.affinity_hits,
+                "spills": self.affinity_spills
+            },
             "servers": [
                 {
                     "url": s.url,
                     "healthy": s.is_healthy,
+                    "draining": s.draining,
+                    "removing": s.removing,
                     "current_load": s.current_load,
+                    "weight": round(self.capacity.weight(s.url), 2),
                     "success_count": s.success_count,
                     "fail_count": s.fail_count,
                     "response_time_ms": s.response_time_ms,
+                    "resident_models": sorted(s.resident) if s.resident is not None else None,
                     "last_check": s.last_check.isoformat()
                 }
                 for s in self.servers
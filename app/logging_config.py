@@ -0,0 +1,144 @@
+"""
+Logging setup
+
+Log calls only put the record on an in-memory queue; a background listener
+thread formats it and does the actual I/O (console plus JSON files), so
+logging never blocks the event loop.
+
+All workers append to the same log files, so none of them rotates them: a
+worker renaming the file under the others would lose or split records.
+Rotate with logrotate (see config/logrotate.conf); each worker reopens a file
+once it was moved away.
+"""
+
+from logging.handlers import QueueHandler, QueueListener, WatchedFileHandler
+from datetime import datetime, timezone
+from typing import Optional
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from app.config import settings
+
+CONSOLE_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; anything else was passed via `extra=`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+_listener: Optional[QueueListener] = None
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, including any `extra` fields"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "pid": record.process
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of a logger's records below WARNING"""
+    
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+    
+    def keep(self, levelno: int) -> bool:
+        """Draw the sampling decision for a record at this level"""
+        return levelno >= logging.WARNING or random.random() < self.rate
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        # Records logged after a `sampled()` check were already drawn
+        return getattr(record, "_sampled", False) or self.keep(record.levelno)
+
+def sampled(logger: logging.Logger, level: int) -> bool:
+    """
+    Whether a record at `level` on this logger would be kept
+    Lets callers skip building a record's fields when it would be dropped;
+    log it with `extra={"_sampled": True}` so it is not sampled a second time.
+    """
+    if not logger.isEnabledFor(level):
+        return False
+    return all(f.keep(level) for f in logger.filters if isinstance(f, SamplingFilter))
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    Enqueue records without formatting them
+    The listener runs in this process, so the record does not have to be
+    pickled: merging %-style arguments into the message and rendering
+    tracebacks are both left to its thread. Arguments are therefore formatted
+    after the call returns, so only pass values that no longer change (the
+    code logs f-strings, apart from the access line).
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+def _file_handler(path: str, formatter: logging.Formatter) -> Optional[logging.Handler]:
+    """Append-only file handler, or None if the file cannot be opened"""
+    if not path:
+        return None
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        handler = WatchedFileHandler(path, encoding="utf-8")
+    except OSError as e:
+        print(f"Logging to {path} disabled: {e}", file=sys.stderr)
+        return None
+    handler.setFormatter(formatter)
+    return handler
+
+def setup_logging():
+    """Route all logging through a queue drained by a background thread"""
+    global _listener
+    if _listener is not None:
+        return
+    
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+    handlers = [console]
+    
+    json_formatter = JSONFormatter()
+    server_log = _file_handler(settings.log_file, json_formatter)
+    if server_log:
+        handlers.append(server_log)
+    
+    # Slow requests also get their own file
+    slow_log = _file_handler(settings.slow_log_file, json_formatter)
+    if slow_log:
+        slow_log.addFilter(logging.Filter("slow_requests"))
+        handlers.append(slow_log)
+    
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_DeferredQueueHandler(log_queue))
+    root.setLevel(getattr(logging, settings.log_level))
+    
+    # httpx logs every backend request at INFO
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    
+    for logger_name, rate in settings.log_sampling.items():
+        if rate < 1.0:
+            logging.getLogger(logger_name).addFilter(SamplingFilter(rate))
+    
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
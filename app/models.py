@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any, Literal
+from typing import Optional, List, Dict, Any, Literal, Union
 from datetime import datetime
 from enum import Enum
 
@@ -8,24 +8,52 @@ class UserRole(str, Enum):
     USER = "user"
     READONLY = "readonly"
 
+class Priority(str, Enum):
+    """Priority lane of a key's backend requests (highest first)"""
+    ADMIN = "admin"
+    INTERACTIVE = "interactive"
+    BULK = "bulk"
+
 class APIKeyCreate(BaseModel):
     username: str
     role: UserRole = UserRole.USER
     rate_limit: int = 1000
+    # Lane for this key's requests; None = by role (admin keys: admin, others: interactive)
+    priority: Optional[Priority] = None
     description: Optional[str] = None
 
+class APIKeyPriorityUpdate(BaseModel):
+    priority: Optional[Priority] = None
+
+class ServerCreate(BaseModel):
+    url: str
+    weight: Optional[float] = Field(None, gt=0, le=100)  # None = learned (see ServerWeightUpdate)
+    drain: bool = False
+
+class ServerWeightUpdate(BaseModel):
+    url: str
+    # Fixed capacity weight (1.0 = a median backend); None returns to the learned weight
+    weight: Optional[float] = Field(None, gt=0, le=100)
+
+class ServerDrainUpdate(BaseModel):
+    url: str
+    # True: no new requests, those in flight finish; False: back in rotation
+    drain: bool = True
+
 class APIKeyResponse(BaseModel):
     api_key: str
     username: str
     role: str
     rate_limit: int
     created_at: datetime
+    priority: Optional[str] = None
     description: Optional[str] = None
 
 class User(BaseModel):
     username: str
     role: UserRole
     rate_limit: int
+    priority: Priority = Priority.INTERACTIVE  # Lane of the current request
     is_active: bool = True
     created_at: datetime
     last_used_at: Optional[datetime] = None
@@ -38,6 +66,8 @@ class OllamaGenerateRequest(BaseModel):
     system: Optional[str] = None
     template: Optional[str] = None
     context: Optional[List[int]] = None
+    # Server-side context: a handle from a previous response, or true to receive one
+    context_handle: Optional[Union[str, bool]] = None
     raw: bool = False
     # Optional response format (e.g., json)
     format: Optional[Literal["json"]] = None
@@ -50,11 +80,32 @@ class OllamaChatMessage(BaseModel):
 class OllamaChatRequest(BaseModel):
     model: str
     messages: List[OllamaChatMessage]
+    # Server-side session: `messages` then only holds the new messages
+    session_id: Optional[str] = None
     stream: bool = False
     options: Optional[Dict[str, Any]] = None
     # Optional response format (e.g., json)
     format: Optional[Literal["json"]] = None
 
+class OllamaEmbedRequest(BaseModel):
+    model: str
+    input: Union[str, List[str]]
+    truncate: Optional[bool] = None
+    options: Optional[Dict[str, Any]] = None
+    keep_alive: Optional[Union[str, int]] = None
+
+class OllamaEmbeddingsRequest(BaseModel):
+    """Legacy /api/embeddings request (single prompt)"""
+    model: str
+    prompt: str
+    options: Optional[Dict[str, Any]] = None
+    keep_alive: Optional[Union[str, int]] = None
+
+class ChatSessionCreate(BaseModel):
+    model: Optional[str] = None
+    # Initial history, e.g. a system prompt
+    messages: List[Dict[str, Any]] = []
+
 class UsageRecord(BaseModel):
     username: str
     timestamp: datetime
@@ -1,11 +1,26 @@
 """
 Prometheus metrics for monitoring
+
+When PROMETHEUS_MULTIPROC_DIR is set (required when running several uvicorn
+workers), every worker writes its samples there and scrapes aggregate them.
 """
 
-from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import (
+    Counter, Histogram, Gauge, CollectorRegistry, REGISTRY,
+    generate_latest, start_http_server, CONTENT_TYPE_LATEST
+)
+from prometheus_client import multiprocess
 from fastapi import Response
+from typing import Optional
+import logging
+import os
 import time
 
+logger = logging.getLogger(__name__)
+
+# Buckets for LLM calls, which take from well under a second to minutes
+LLM_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+
 # Request metrics
 request_count = Counter(
     'ollama_api_requests_total',
@@ -39,10 +54,120 @@ backend_response_time = Histogram(
     ['server']
 )
 
+backend_in_flight = Gauge(
+    'ollama_backend_in_flight_requests',
+    'Requests currently being served by each backend',
+    ['server'],
+    multiprocess_mode='livesum'
+)
+
+routing_decisions = Counter(
+    'ollama_routing_decisions_total',
+    'Backend selections by routing strategy and outcome',
+    ['strategy', 'outcome']
+)
+
+# Priority lane metrics
+lane_requests = Counter(
+    'ollama_lane_requests_total',
+    'Requests admitted to (or timed out waiting for) a backend slot, per priority lane',
+    ['lane', 'outcome']
+)
+
+lane_in_flight = Gauge(
+    'ollama_lane_in_flight_requests',
+    'Backend requests in flight per priority lane',
+    ['lane'],
+    multiprocess_mode='livesum'
+)
+
+lane_queue_wait = Histogram(
+    'ollama_lane_queue_wait_seconds',
+    'Time a request waits for a backend slot in its priority lane',
+    ['lane'],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 120)
+)
+
+# Adaptive concurrency metrics
+concurrency_limit = Gauge(
+    'ollama_concurrency_limit',
+    'Adaptive concurrency limit per model (summed over workers)',
+    ['model'],
+    multiprocess_mode='livesum'
+)
+
+requests_shed = Counter(
+    'ollama_requests_shed_total',
+    'Requests rejected with 503 because the model was at its concurrency limit',
+    ['model', 'lane']
+)
+
+# Failover metrics
+backend_retries = Counter(
+    'ollama_backend_retries_total',
+    'Failover retries on another server (denied: retry budget spent)',
+    ['outcome']
+)
+
+backend_ejections = Counter(
+    'ollama_backend_ejections_total',
+    'Backends taken out of rotation for a model because their latency was an outlier',
+    ['server', 'model']
+)
+
+model_warm_ups = Counter(
+    'ollama_model_warm_ups_total',
+    'Models loaded ahead of demand on a backend (outcome: loaded/failed)',
+    ['server', 'model', 'outcome']
+)
+
+# LLM metrics
+time_to_first_token = Histogram(
+    'ollama_time_to_first_token_seconds',
+    'Time from dispatch to the first streamed chunk from the backend',
+    ['model'],
+    buckets=LLM_LATENCY_BUCKETS
+)
+
+generation_tokens_per_second = Histogram(
+    'ollama_generation_tokens_per_second',
+    'Generation speed reported by the backend (eval_count / eval_duration)',
+    ['model'],
+    buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500)
+)
+
+queue_wait = Histogram(
+    'ollama_queue_wait_seconds',
+    'Time a request waits in the proxy before it is dispatched to a backend',
+    ['model'],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+)
+
+model_latency = Histogram(
+    'ollama_model_request_duration_seconds',
+    'Backend request duration per model, including the full stream',
+    ['model', 'endpoint'],
+    buckets=LLM_LATENCY_BUCKETS
+)
+
+embed_batch_size = Histogram(
+    'ollama_embed_batch_size',
+    'Inputs per batched /api/embed backend call',
+    ['model'],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+
+embed_cache_lookups = Counter(
+    'ollama_embed_cache_lookups_total',
+    'Embedding cache lookups per input',
+    ['model', 'result']
+)
+
 # Active connections
 active_requests = Gauge(
     'ollama_api_active_requests',
-    'Number of active requests'
+    'Number of active requests',
+    multiprocess_mode='livesum'
 )
 
 # Rate limit metrics
@@ -52,17 +177,104 @@ rate_limit_hits = Counter(
     ['username']
 )
 
+# Worker health metrics (reported per worker process)
+event_loop_lag = Histogram(
+    'ollama_api_event_loop_lag_seconds',
+    'How late the event loop wakes up from a scheduled sleep',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+
+gc_pause = Histogram(
+    'ollama_api_gc_pause_seconds',
+    'Garbage collector pause duration',
+    ['generation'],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5)
+)
+
+worker_rss_bytes = Gauge(
+    'ollama_api_worker_rss_bytes',
+    'Resident memory of the worker process',
+    multiprocess_mode='liveall'
+)
+
+worker_open_fds = Gauge(
+    'ollama_api_worker_open_fds',
+    'Open file descriptors of the worker process',
+    multiprocess_mode='liveall'
+)
+
+worker_sockets = Gauge(
+    'ollama_api_worker_sockets',
+    'Open inet sockets of the worker process',
+    multiprocess_mode='liveall'
+)
+
+worker_cpu_percent = Gauge(
+    'ollama_api_worker_cpu_percent',
+    'CPU usage of the worker process since the previous sample',
+    multiprocess_mode='liveall'
+)
+
+def is_multiprocess() -> bool:
+    """Whether metrics are shared between worker processes"""
+    return bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+def _collector_registry():
+    """Registry to expose: aggregated over all workers in multiprocess mode"""
+    if is_multiprocess():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
 def metrics_endpoint():
     """Return Prometheus metrics"""
-    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(_collector_registry()), media_type=CONTENT_TYPE_LATEST)
+
+def start_metrics_server(port: int) -> bool:
+    """
+    Serve metrics on a dedicated port
+    With several workers only the first one binds the port; since it exposes
+    the multiprocess registry it still reports every worker.
+    """
+    try:
+        start_http_server(port, registry=_collector_registry())
+        logger.info(f"Metrics server listening on port {port}")
+        return True
+    except OSError as e:
+        logger.debug(f"Metrics port {port} not bound by worker {os.getpid()}: {e}")
+        return False
+
+def mark_worker_exit():
+    """Drop this worker's live gauges from the multiprocess aggregate"""
+    if is_multiprocess():
+        multiprocess.mark_process_dead(os.getpid())
+
+def observe_generation(model: str, result: dict, username: Optional[str] = None):
+    """Record the token counts and speed Ollama reports in a final response"""
+    eval_count = result.get("eval_count") or 0
+    eval_duration = result.get("eval_duration") or 0  # nanoseconds
+    if eval_count and eval_duration:
+        generation_tokens_per_second.labels(model=model).observe(eval_count / (eval_duration / 1e9))
+    if username:
+        total = eval_count + (result.get("prompt_eval_count") or 0)
+        if total:
+            tokens_processed.labels(username=username, model=model).inc(total)
 
 class RequestMetrics:
-    """Context manager for request metrics"""
+    """
+    Context manager for request metrics
+    A request that returns a response is only done once its body was sent:
+    call finish() then. If the block raises, the request is recorded as an
+    error on exit.
+    """
     
     def __init__(self, endpoint: str, method: str):
         self.endpoint = endpoint
         self.method = method
+        self.status = None  # Set to the HTTP status code once known
         self.start_time = None
+        self.finished = False
     
     def __enter__(self):
         self.start_time = time.time()
@@ -70,17 +282,25 @@ class RequestMetrics:
         return self
     
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type:
+            self.status = 'error'
+            self.finish()
+    
+    def finish(self):
+        """Record the request (once)"""
+        if self.finished:
+            return
+        self.finished = True
         duration = time.time() - self.start_time
         request_duration.labels(
             endpoint=self.endpoint,
             method=self.method
         ).observe(duration)
         
-        status = 'error' if exc_type else 'success'
         request_count.labels(
             endpoint=self.endpoint,
             method=self.method,
-            status=status
+            status=str(self.status or 'success')
         ).inc()
         
         active_requests.dec()
@@ -0,0 +1,154 @@
+"""
+Latency outlier ejection
+
+Health checks only take a backend out of rotation once it stops answering.
+A backend that still answers, but much more slowly than its peers (thermal
+throttling, a model that no longer fits in VRAM), keeps its share of the
+traffic. Each worker therefore keeps a moving average of the time to first
+token per backend and model. When a backend's average exceeds
+OUTLIER_LATENCY_FACTOR times the median of the other backends serving the
+model, it gets no requests for that model for OUTLIER_EJECTION_SECONDS
+(longer each time it is ejected again). At most OUTLIER_MAX_EJECTION_PERCENT
+of the backends of a model are ejected at once, so the pool is never drained.
+"""
+
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, Dict, List, Optional
+import logging
+import math
+import statistics
+import time
+from app.config import settings
+from app.monitoring import backend_ejections
+
+logger = logging.getLogger(__name__)
+
+ALPHA = 0.2  # EWMA weight of a latency sample
+MIN_SAMPLES = 5  # Samples a backend needs before it is compared with its peers
+MIN_GAP = 0.1  # Seconds; a backend is never an outlier by less than this
+MAX_BACKOFF = 10  # Longest ejection, in multiples of OUTLIER_EJECTION_SECONDS
+EVENT_HISTORY = 50  # Ejection events kept for /status
+
+class _Stats:
+    def __init__(self):
+        self.latency: Optional[float] = None  # EWMA of the time to first token (seconds)
+        self.samples = 0
+        self.ejected_until = 0.0  # time.monotonic(); 0 when not ejected
+        self.ejections = 0  # Consecutive ejections, for the back-off
+        self.last_ejected = 0.0
+    
+    def reset(self):
+        self.latency = None
+        self.samples = 0
+
+class OutlierDetector:
+    def __init__(self):
+        self._models: Dict[str, Dict[str, _Stats]] = {}  # model -> server URL -> stats
+        self.events: Deque[dict] = deque(maxlen=EVENT_HISTORY)
+    
+    @property
+    def enabled(self) -> bool:
+        return settings.outlier_ejection
+    
+    def record(self, server_url: str, model: str, latency: float):
+        """Add a time-to-first-token sample and eject the backend if it is an outlier"""
+        if not self.enabled:
+            return
+        stats = self._models.setdefault(model, {}).setdefault(server_url, _Stats())
+        if stats.ejected_until:
+            return
+        stats.samples += 1
+        stats.latency = latency if stats.latency is None else stats.latency + (latency - stats.latency) * ALPHA
+        self._evaluate(model, server_url, stats)
+    
+    def ejected(self, model: str) -> List[str]:
+        """Servers currently ejected for `model`; lets those whose cool-down ended back in"""
+        peers = self._models.get(model)
+        if not peers:
+            return []
+        now = time.monotonic()
+        ejected = []
+        for server_url, stats in peers.items():
+            if not stats.ejected_until:
+                continue
+            if stats.ejected_until > now:
+                ejected.append(server_url)
+                continue
+            # Cool-down over: start again from fresh samples
+            stats.ejected_until = 0.0
+            stats.reset()
+            self._event("returned", server_url, model)
+            logger.info(f"Server {server_url} back in rotation for {model} after latency ejection")
+        return ejected
+    
+    def forget(self, server_url: str):
+        """Drop the samples of a backend that was removed"""
+        for peers in self._models.values():
+            peers.pop(server_url, None)
+    
+    def _evaluate(self, model: str, server_url: str, stats: _Stats):
+        if stats.samples < MIN_SAMPLES:
+            return
+        peers = self._models[model]
+        others = [
+            s.latency for url, s in peers.items()
+            if url != server_url and not s.ejected_until and s.samples >= MIN_SAMPLES
+        ]
+        if not others:
+            return
+        median = statistics.median(others)
+        if stats.latency < median * settings.outlier_latency_factor or stats.latency - median < MIN_GAP:
+            return
+        
+        ejected = sum(1 for s in peers.values() if s.ejected_until)
+        if ejected + 1 > math.floor(len(peers) * settings.outlier_max_ejection_percent / 100):
+            return
+        
+        now = time.monotonic()
+        base = settings.outlier_ejection_seconds
+        if now - stats.last_ejected > base * MAX_BACKOFF * 2:
+            stats.ejections = 0  # Behaved long enough; forget earlier ejections
+        stats.ejections += 1
+        stats.last_ejected = now
+        duration = base * min(stats.ejections, MAX_BACKOFF)
+        stats.ejected_until = now + duration
+        backend_ejections.labels(server=server_url, model=model).inc()
+        self._event(
+            "ejected", server_url, model,
+            latency_ms=round(stats.latency * 1000, 1),
+            peer_median_ms=round(median * 1000, 1),
+            duration_s=duration
+        )
+        logger.warning(
+            f"Server {server_url} ejected for {model} for {duration:.0f}s: "
+            f"time to first token {stats.latency * 1000:.0f}ms vs peer median {median * 1000:.0f}ms"
+        )
+    
+    def _event(self, event: str, server_url: str, model: str, **details):
+        self.events.append({
+            "time": datetime.now(timezone.utc).isoformat(),
+            "event": event,
+            "server": server_url,
+            "model": model,
+            **details
+        })
+    
+    def get_status(self) -> dict:
+        """Latency per backend and model, ejections and recent events of this worker for /status"""
+        now = time.monotonic()
+        return {
+            "enabled": self.enabled,
+            "models": {
+                model: {
+                    server_url: {
+                        "latency_ms": round(stats.latency * 1000, 1) if stats.latency is not None else None,
+                        "samples": stats.samples,
+                        "ejected_for_s": round(stats.ejected_until - now, 1) if stats.ejected_until > now else None
+                    }
+                    for server_url, stats in peers.items()
+                }
+                for model, peers in self._models.items()
+            },
+            "events": list(self.events)
+        }
@@ -0,0 +1,206 @@
+"""
+Raw-body passthrough for proxied requests
+
+Instead of validating the request into a Pydantic model and re-encoding it,
+the body is parsed once to pick out the few fields the proxy itself needs
+(model, stream, the prompt for usage logging) and the original bytes are
+forwarded to the backend untouched.
+"""
+
+from typing import List, Optional, Union
+from fastapi import HTTPException
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from app import jsonutil
+from app.config import settings
+from app.models import (
+    OllamaGenerateRequest, OllamaChatRequest, OllamaEmbedRequest, OllamaEmbeddingsRequest
+)
+
+# Fields the proxy handles itself; they are not forwarded to the backend
+PROXY_FIELDS = ("context_handle", "session_id")
+
+class ProxyPayload:
+    """Request body to forward plus the fields the proxy uses"""
+    
+    def __init__(
+        self,
+        body: bytes,
+        model: str,
+        stream: bool,
+        prompt: str,
+        messages: Optional[List[dict]] = None,
+        context_handle: Union[str, bool, None] = None,
+        session_id: Optional[str] = None,
+        inputs: Optional[List[str]] = None,
+        fields: Optional[dict] = None
+    ):
+        self.body = body
+        self.model = model
+        self.stream = stream
+        self.prompt = prompt  # Prompt text for usage logging
+        self.messages = messages or []
+        self.context_handle = context_handle  # Handle to expand, or True to get one back
+        self.session_id = session_id  # Chat session whose history precedes `messages`
+        self.inputs = inputs or []  # Texts to embed
+        self.fields = fields or {}  # Parsed body
+    
+    @property
+    def prefix_text(self) -> str:
+        """
+        Prompt prefix for prefix-affinity routing: what stays the same across
+        related requests. For chat that is the opening of the conversation
+        (system messages and the first other message), which every later turn
+        repeats; for generate the system prompt, else the prompt itself.
+        """
+        if "messages" in self.fields:
+            opening = []
+            for msg in self.messages:
+                opening.append(msg)
+                if msg.get("role") != "system":
+                    break
+            return chat_prompt_text(opening)
+        system = self.fields.get("system")
+        return system if isinstance(system, str) and system else self.prompt
+    
+    def insert_field(self, name: str, raw_value: bytes):
+        """Set a field to an already encoded JSON value, replacing the request's own value"""
+        if name in self.fields:
+            # Even `"context": null` must go, or the backend gets the key twice
+            rest = {k: v for k, v in self.fields.items() if k != name and k not in PROXY_FIELDS}
+            rest["stream"] = self.stream
+            self.body = jsonutil.dumps(rest)
+        self.body = insert_field(self.body, name, raw_value)
+    
+    def prepend_history(self, history: bytes):
+        """
+        Rebuild the body with stored chat history (encoded messages joined by
+        commas) in front of the new messages; only the new part is encoded
+        """
+        rest = {k: v for k, v in self.fields.items() if k != "messages" and k not in PROXY_FIELDS}
+        rest["stream"] = self.stream
+        new = jsonutil.dumps(self.messages)[1:-1]
+        joined = history + b"," + new if history and new else history or new
+        self.body = insert_field(jsonutil.dumps(rest), "messages", b"[" + joined + b"]")
+
+def insert_field(body: bytes, name: str, raw_value: bytes) -> bytes:
+    """Splice a field in front of the others instead of re-encoding the whole body"""
+    start = body.index(b"{") + 1
+    return body[:start] + jsonutil.dumps(name) + b":" + raw_value + b"," + body[start:]
+
+def _invalid(detail: str) -> HTTPException:
+    return HTTPException(status_code=422, detail=detail)
+
+def _parse_object(body: bytes) -> dict:
+    try:
+        data = jsonutil.loads(body)
+    except jsonutil.JSONDecodeError as e:
+        raise _invalid(f"Invalid JSON body: {e}")
+    if not isinstance(data, dict):
+        raise _invalid("Request body must be a JSON object")
+    return data
+
+def _common_fields(data: dict):
+    """Validate and return (model, stream)"""
+    model = data.get("model")
+    if not isinstance(model, str) or not model:
+        raise _invalid("Field 'model' is required and must be a string")
+    stream = data.get("stream", False)
+    if not isinstance(stream, bool):
+        raise _invalid("Field 'stream' must be a boolean")
+    return model, stream
+
+def _forwarded(data: dict) -> dict:
+    return {k: v for k, v in data.items() if k not in PROXY_FIELDS}
+
+def _without_proxy_fields(body: bytes, data: dict) -> bytes:
+    """The body without the proxy's own fields; re-encoded only if it has any"""
+    if not any(name in data for name in PROXY_FIELDS):
+        return body
+    return jsonutil.dumps(_forwarded(data))
+
+def _with_stream_default(body: bytes, data: dict) -> bytes:
+    """
+    Make the body explicit about streaming
+    Ollama streams when `stream` is missing, this API does not; splice the
+    field in front of the others instead of re-encoding the whole body.
+    """
+    if "stream" in data:
+        return body
+    return insert_field(body, "stream", b"false")
+
+def chat_prompt_text(messages: List[dict]) -> str:
+    """Messages formatted as a prompt string for usage logging"""
+    return "\n".join(f"{msg.get('role')}: {msg.get('content') or ''}" for msg in messages)
+
+def parse_generate(body: bytes) -> ProxyPayload:
+    """Parse an /api/generate body"""
+    if not settings.proxy_passthrough:
+        request = _validate(OllamaGenerateRequest, body)
+        data = request.model_dump(exclude_none=True)
+        payload = ProxyPayload(jsonutil.dumps(_forwarded(data)), request.model, request.stream, request.prompt,
+                               context_handle=request.context_handle, fields=data)
+    else:
+        data = _parse_object(body)
+        model, stream = _common_fields(data)
+        prompt = data.get("prompt", "")
+        if not isinstance(prompt, str):
+            raise _invalid("Field 'prompt' must be a string")
+        context_handle = data.get("context_handle")
+        if context_handle is not None and not isinstance(context_handle, (str, bool)):
+            raise _invalid("Field 'context_handle' must be a string or a boolean")
+        payload = ProxyPayload(_with_stream_default(_without_proxy_fields(body, data), data), model, stream, prompt,
+                               context_handle=context_handle, fields=data)
+    
+    if isinstance(payload.context_handle, str) and data.get("context") is not None:
+        raise _invalid("Send either 'context' or 'context_handle', not both")
+    return payload
+
+def parse_chat(body: bytes) -> ProxyPayload:
+    """Parse an /api/chat body"""
+    if not settings.proxy_passthrough:
+        request = _validate(OllamaChatRequest, body)
+        data = request.model_dump(exclude_none=True)
+        return ProxyPayload(
+            jsonutil.dumps(_forwarded(data)), request.model, request.stream,
+            chat_prompt_text(data["messages"]), data["messages"],
+            session_id=request.session_id, fields=data
+        )
+    
+    data = _parse_object(body)
+    model, stream = _common_fields(data)
+    messages = data.get("messages", [])
+    if not isinstance(messages, list) or not all(isinstance(msg, dict) for msg in messages):
+        raise _invalid("Field 'messages' must be a list of message objects")
+    session_id = data.get("session_id")
+    if session_id is not None and not isinstance(session_id, str):
+        raise _invalid("Field 'session_id' must be a string")
+    return ProxyPayload(
+        _with_stream_default(_without_proxy_fields(body, data), data), model, stream,
+        chat_prompt_text(messages), messages, session_id=session_id, fields=data
+    )
+
+def parse_embed(body: bytes, legacy: bool = False) -> ProxyPayload:
+    """Parse an /api/embed body, or a legacy /api/embeddings one (`prompt` instead of `input`)"""
+    if not settings.proxy_passthrough:
+        request = _validate(OllamaEmbeddingsRequest if legacy else OllamaEmbedRequest, body)
+        data = request.model_dump(exclude_none=True)
+        body = jsonutil.dumps(data)
+    else:
+        data = _parse_object(body)
+        _common_fields(data)
+    
+    field = "prompt" if legacy else "input"
+    inputs = data.get(field)
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    elif legacy or not isinstance(inputs, list) or not all(isinstance(text, str) for text in inputs):
+        raise _invalid(f"Field '{field}' must be a string" + ("" if legacy else " or a list of strings"))
+    return ProxyPayload(body, data["model"], False, "\n".join(inputs), inputs=inputs, fields=data)
+
+def _validate(model_class, body: bytes):
+    """Full Pydantic validation (passthrough disabled), reported like FastAPI's own"""
+    try:
+        return model_class.model_validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors(include_url=False, include_input=False))
@@ -0,0 +1,288 @@
+"""
+Demand-driven model placement
+
+Without this, which models are installed on which backend is whatever an
+operator pulled by hand. The placement controller gives each model a number
+of replicas in proportion to its recent demand: the backend time
+(duration_ms) of its requests over the last PLACEMENT_WINDOW seconds,
+except embeddings served from the cache, which used no backend. It
+then places the replicas within each backend's capacity
+(PLACEMENT_NODE_CAPACITY_GB, roughly its VRAM):
+
+- a model with demand gets ceil(backends x its share of the demand) replicas
+- a model without demand is consolidated to PLACEMENT_MIN_REPLICAS (or its
+  entry in PLACEMENT_MODEL_MIN_REPLICAS, a floor for any demand; embedding
+  requests are short, so embedding models usually need one)
+- missing replicas go to the backends with the most free capacity
+- surplus replicas are removed from the fullest backends, never from one
+  that has the model loaded
+
+Plans start from the current placement, so only the difference is pulled or
+deleted. Plans can be inspected (dry run) and applied through the admin API,
+or applied every PLACEMENT_INTERVAL seconds with PLACEMENT_AUTO_APPLY. An
+applied run makes at most PLACEMENT_MAX_ACTIONS pulls/deletes, one at a
+time, and runs start at least PLACEMENT_MIN_INTERVAL seconds apart. The last
+run is saved in LEADER_LOCK_DIR, so every worker reports the same state.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from sqlalchemy import select, func
+from app.config import settings
+from app.database import AsyncSessionLocal, UsageLog
+from app.leader import LeaderLock
+from app.load_balancer import load_balancer, model_tag, ServerStatus
+
+logger = logging.getLogger(__name__)
+
+GB = 1_000_000_000
+STATE_FILE = "placement.json"
+
+class PlacementBusyError(Exception):
+    """A placement run is already in progress"""
+
+class PlacementRateLimitedError(Exception):
+    """The previous run started less than PLACEMENT_MIN_INTERVAL seconds ago"""
+    
+    def __init__(self, retry_after: int):
+        super().__init__(f"Placement was applied recently, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+def _capacity(server_url: str) -> int:
+    return int(settings.placement_node_capacities.get(server_url, settings.placement_node_capacity_gb) * GB)
+
+def _action(action: str, server_url: str, model: str, size: int, reason: str) -> dict:
+    return {"action": action, "server": server_url, "model": model, "size_gb": round(size / GB, 1), "reason": reason}
+
+def plan_placement(servers: List[ServerStatus], demand: Dict[str, dict]) -> dict:
+    """
+    Placement plan for the models installed on `servers`, given the demand
+    per model ({"requests": n, "busy_ms": ms})
+    """
+    sizes: Dict[str, int] = {}
+    placement: Dict[str, set] = {}
+    for server in servers:
+        placement[server.url] = set()
+        for entry in server.models or []:
+            name = model_tag(entry.get("name") or entry.get("model") or "")
+            placement[server.url].add(name)
+            sizes[name] = max(sizes.get(name, 0), int(entry.get("size") or 0))
+    used = {url: sum(sizes[m] for m in models) for url, models in placement.items()}
+    by_url = {s.url: s for s in servers}
+    
+    busy: Dict[str, float] = {}
+    requests: Dict[str, int] = {}
+    for model, stats in demand.items():
+        name = model_tag(model)
+        if name in sizes:
+            busy[name] = busy.get(name, 0) + stats["busy_ms"]
+            requests[name] = requests.get(name, 0) + stats["requests"]
+    total = sum(busy.values())
+    
+    targets: Dict[str, int] = {}
+    current: Dict[str, int] = {}
+    for model in sizes:
+        share = busy.get(model, 0) / total if total else 0
+        wanted = math.ceil(len(servers) * share) if share else 0
+        minimum = settings.placement_model_min_replicas.get(model, settings.placement_min_replicas)
+        targets[model] = min(len(servers), max(minimum, wanted))
+        current[model] = sum(1 for models in placement.values() if model in models)
+    
+    # Remove surplus replicas first so their space counts for new ones, coldest models first
+    deletes = []
+    for model in sorted(sizes, key=lambda m: busy.get(m, 0)):
+        holders = [url for url, models in placement.items() if model in models]
+        surplus = len(holders) - targets[model]
+        for url in sorted(holders, key=lambda u: _capacity(u) - used[u]):
+            if surplus <= 0:
+                break
+            if by_url[url].has_resident(model):
+                continue
+            placement[url].discard(model)
+            used[url] -= sizes[model]
+            surplus -= 1
+            deletes.append(_action("delete", url, model, sizes[model], f"{current[model]} -> {targets[model]} replicas"))
+    
+    # Add missing replicas, hottest models first, where there is the most room
+    pulls = []
+    for model in sorted(sizes, key=lambda m: -busy.get(m, 0)):
+        missing = targets[model] - sum(1 for models in placement.values() if model in models)
+        for url in sorted(placement, key=lambda u: used[u] - _capacity(u)):
+            if missing <= 0:
+                break
+            if model in placement[url] or used[url] + sizes[model] > _capacity(url):
+                continue
+            placement[url].add(model)
+            used[url] += sizes[model]
+            missing -= 1
+            pulls.append(_action("pull", url, model, sizes[model], f"{current[model]} -> {targets[model]} replicas"))
+    
+    return {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "window_seconds": settings.placement_window,
+        "models": {
+            model: {
+                "requests": requests.get(model, 0),
+                "busy_seconds": round(busy.get(model, 0) / 1000, 1),
+                "share": round(busy.get(model, 0) / total, 3) if total else 0.0,
+                "size_gb": round(sizes[model] / GB, 1),
+                "replicas": current[model],
+                "target_replicas": targets[model]
+            }
+            for model in sorted(sizes, key=lambda m: -busy.get(m, 0))
+        },
+        "servers": {
+            url: {
+                "capacity_gb": round(_capacity(url) / GB, 1),
+                "planned_gb": round(used[url] / GB, 1),
+                "planned_models": sorted(models)
+            }
+            for url, models in placement.items()
+        },
+        # Pulls first: hot models gain replicas before cold ones are consolidated
+        "actions": pulls + deletes
+    }
+
+async def recent_demand() -> Dict[str, dict]:
+    """Requests and backend time per model over the placement window (cache hits excluded)"""
+    since = datetime.now(timezone.utc) - timedelta(seconds=settings.placement_window)
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(
+            select(UsageLog.model, func.count(), func.sum(func.coalesce(UsageLog.duration_ms, 0)))
+            .where(UsageLog.timestamp >= since, UsageLog.server_used.is_distinct_from("cache"))
+            .group_by(UsageLog.model)
+        )).all()
+    return {model: {"requests": count, "busy_ms": float(busy_ms or 0)} for model, count, busy_ms in rows}
+
+def _state_path() -> str:
+    return os.path.join(settings.leader_lock_dir, STATE_FILE)
+
+def _read_state() -> Optional[dict]:
+    try:
+        with open(_state_path()) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def _write_state(run: dict):
+    os.makedirs(settings.leader_lock_dir, exist_ok=True)
+    path = _state_path()
+    with open(path + ".tmp", "w") as f:
+        json.dump(run, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+class PlacementController:
+    def __init__(self):
+        self._lock = LeaderLock("placement")
+        self._task: Optional[asyncio.Task] = None
+        self._run: Optional[asyncio.Task] = None
+    
+    async def start(self):
+        """Apply placement periodically if PLACEMENT_AUTO_APPLY is set"""
+        if settings.placement_auto_apply:
+            self._task = asyncio.create_task(self._run_loop())
+    
+    async def stop(self):
+        for task in (self._task, self._run):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._lock.release()
+    
+    async def _run_loop(self):
+        while True:
+            try:
+                await asyncio.sleep(settings.placement_interval)
+                await self.apply()
+            except asyncio.CancelledError:
+                break
+            except (PlacementBusyError, PlacementRateLimitedError) as e:
+                logger.debug(f"Automatic placement skipped: {e}")
+            except Exception as e:
+                logger.error(f"Automatic placement failed: {e}")
+    
+    def _servers(self) -> List[ServerStatus]:
+        return [s for s in load_balancer.servers if s.available and s.models is not None]
+    
+    async def recommend(self) -> dict:
+        """Placement plan for the current demand, without applying it"""
+        return plan_placement(self._servers(), await recent_demand())
+    
+    def last_run(self) -> Optional[dict]:
+        """The last applied run (from any worker)"""
+        return _read_state()
+    
+    async def apply(self) -> dict:
+        """
+        Start applying a fresh plan in the background (at most
+        PLACEMENT_MAX_ACTIONS of its actions) and return the run
+        """
+        if self._run and not self._run.done():
+            raise PlacementBusyError("A placement run is in progress")
+        last = _read_state()
+        if last:
+            wait = last["started_at"] + settings.placement_min_interval - time.time()
+            if wait > 0:
+                raise PlacementRateLimitedError(math.ceil(wait))
+        if not self._lock.acquire():
+            raise PlacementBusyError("A placement run is in progress in another worker")
+        
+        try:
+            plan = await self.recommend()
+            run = {
+                "status": "running",
+                "started_at": time.time(),
+                "finished_at": None,
+                "plan": {key: value for key, value in plan.items() if key != "actions"},
+                "actions": [{**action, "status": "pending"} for action in plan["actions"][:settings.placement_max_actions]],
+                "deferred_actions": len(plan["actions"][settings.placement_max_actions:])
+            }
+            _write_state(run)
+        except BaseException:
+            self._lock.release()
+            raise
+        logger.info(f"Applying model placement: {len(run['actions'])} actions, {run['deferred_actions']} deferred")
+        self._run = asyncio.create_task(self._execute(run))
+        return run
+    
+    async def _execute(self, run: dict):
+        try:
+            for action in run["actions"]:
+                server = load_balancer.get_server(action["server"])
+                try:
+                    if server is None:
+                        raise Exception("Server is no longer configured")
+                    if action["action"] == "pull":
+                        await load_balancer.pull_model(server, action["model"])
+                    elif server.has_resident(action["model"]):
+                        # Loaded since the plan was made: it is in use, keep it
+                        action["status"] = "skipped"
+                        continue
+                    else:
+                        await load_balancer.delete_model(server, action["model"])
+                    action["status"] = "done"
+                    logger.info(f"Placement: {action['action']} {action['model']} on {action['server']} done")
+                except Exception as e:
+                    action["status"] = "failed"
+                    action["error"] = str(e)
+                    logger.warning(f"Placement: {action['action']} {action['model']} on {action['server']} failed: {e}")
+                finally:
+                    _write_state(run)
+            await load_balancer.refresh_model_catalog()
+        finally:
+            run["status"] = "finished"
+            run["finished_at"] = time.time()
+            _write_state(run)
+            self._lock.release()
+
+# Global placement controller instance
+placement_controller = PlacementController()
@@ -0,0 +1,126 @@
+"""
+On-demand sampling profiler
+
+Samples the Python stacks of every thread in this worker (including the
+event loop thread) from a background thread at a fixed interval, without
+instrumenting any code. Results are aggregated per distinct stack and can be
+exported as collapsed stacks (flamegraph.pl, speedscope, ...) or as a
+speedscope JSON profile.
+"""
+
+from collections import Counter
+from typing import Dict, Tuple
+import asyncio
+import os
+import sys
+import threading
+import time
+
+Stack = Tuple[str, ...]
+
+class ProfilerBusyError(Exception):
+    """A profile is already being recorded in this worker"""
+
+class ProfileResult:
+    def __init__(self, stacks: Dict[Tuple[str, Stack], int], samples: int, duration: float, interval: float):
+        self.stacks = stacks  # (thread name, frames root->leaf) -> sample count
+        self.samples = samples
+        self.duration = duration
+        self.interval = interval
+    
+    def collapsed(self) -> str:
+        """Brendan Gregg's collapsed format: `thread;frame;frame count` per line"""
+        lines = [
+            ";".join((thread,) + frames) + f" {count}"
+            for (thread, frames), count in sorted(self.stacks.items(), key=lambda item: -item[1])
+        ]
+        return "\n".join(lines) + "\n"
+    
+    def speedscope(self) -> dict:
+        """speedscope file format, one sampled profile per thread"""
+        frame_index: Dict[str, int] = {}
+        frames = []
+        profiles: Dict[str, dict] = {}
+        
+        for (thread, stack), count in self.stacks.items():
+            indices = []
+            for name in stack:
+                if name not in frame_index:
+                    frame_index[name] = len(frames)
+                    frames.append({"name": name})
+                indices.append(frame_index[name])
+            profile = profiles.setdefault(thread, {
+                "type": "sampled",
+                "name": thread,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": self.duration,
+                "samples": [],
+                "weights": []
+            })
+            profile["samples"].append(indices)
+            profile["weights"].append(count * self.interval)
+        
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"tokamak-ai-api worker {os.getpid()}",
+            "exporter": "tokamak-ai-api",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": list(profiles.values())
+        }
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class SamplingProfiler:
+    def __init__(self):
+        self._running = threading.Lock()
+    
+    async def profile(self, seconds: float, interval_ms: int) -> ProfileResult:
+        """Sample all threads for `seconds`; raises ProfilerBusyError if already running"""
+        if not self._running.acquire(blocking=False):
+            raise ProfilerBusyError("A profile is already running in this worker")
+        # Sample from a separate thread so the event loop keeps running (and
+        # gets sampled). Shielded, so a cancelled request does not cancel the
+        # thread before it starts; the thread releases the lock when it is done.
+        sampling = asyncio.ensure_future(asyncio.to_thread(self._sample_and_release, seconds, interval_ms / 1000))
+        return await asyncio.shield(sampling)
+    
+    def _sample_and_release(self, seconds: float, interval: float) -> ProfileResult:
+        try:
+            return self._sample(seconds, interval)
+        finally:
+            self._running.release()
+    
+    def _sample(self, seconds: float, interval: float) -> ProfileResult:
+        own_thread = threading.get_ident()
+        stacks: Counter = Counter()
+        samples = 0
+        start = time.perf_counter()
+        deadline = start + seconds
+        next_tick = start
+        
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.reverse()
+                stacks[(names.get(thread_id, f"thread-{thread_id}"), tuple(stack))] += 1
+            samples += 1
+            next_tick += interval
+            time.sleep(max(0.0, next_tick - time.perf_counter()))
+        
+        return ProfileResult(dict(stacks), samples, time.perf_counter() - start, interval)
+
+# Global profiler instance
+profiler = SamplingProfiler()
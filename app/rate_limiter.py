@@ -5,6 +5,8 @@ from sqlalchemy import select, delete, and_
 from app.config import settings
 from app.models import User
 from app.database import RateLimit
+from app.monitoring import rate_limit_hits
+from app.timing import timed
 import logging
 
 logger = logging.getLogger(__name__)
@@ -41,6 +43,10 @@ class RateLimiter:
         Check if user has exceeded rate limit
         Returns True if within limit, raises HTTPException if exceeded
         """
+        with timed("rate_limit"):
+            return await self._check_rate_limit(user, db)
+    
+    async def _check_rate_limit(self, user: User, db: AsyncSession) -> bool:
         now = datetime.utcnow()
         # Round down to the start of the current window (hour)
         window_start = now.replace(minute=0, second=0, microsecond=0)
@@ -77,6 +83,7 @@ class RateLimiter:
             
             # Check if limit exceeded
             if rate_limit.count > user.rate_limit:
+                rate_limit_hits.labels(username=user.username).inc()
                 remaining_seconds = int((expires_at - now).total_seconds())
                 raise HTTPException(
                     status_code=429,
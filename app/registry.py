@@ -0,0 +1,214 @@
+"""
+Runtime backend registry
+
+The backends used to come from OLLAMA_SERVERS only, so taking a node out
+for maintenance meant restarting the proxy. The registry is a JSON file
+(BACKENDS_FILE) with the backends and their settings:
+
+    {
+      "http://dgx1:11434": {"weight": 4},
+      "http://dgx2:11434": {"drain": true},
+      "http://dgx3:11434": {}
+    }
+
+- weight: fixed capacity weight (see app.capacity); without it the weight
+  is learned
+- drain: the backend gets no new requests; those in flight finish
+
+Once the file exists it replaces OLLAMA_SERVERS. The admin API
+(/admin/servers) writes it and operators may edit it by hand; every worker
+checks it every BACKENDS_WATCH_INTERVAL seconds and applies the changes to
+its load balancer. A backend removed from the file takes no new requests
+and is dropped once the requests in flight finish.
+"""
+
+from typing import Callable, Dict, Optional
+from urllib.parse import urlsplit
+import asyncio
+import fcntl
+import json
+import logging
+import os
+from app.config import settings
+from app.load_balancer import load_balancer
+
+logger = logging.getLogger(__name__)
+
+class UnknownServerError(Exception):
+    """The server is not in the registry"""
+
+class ServerExistsError(Exception):
+    """The server is already in the registry"""
+
+def normalize_url(url: str) -> str:
+    """Backend URL without a trailing slash; ValueError if it is not an http(s) URL"""
+    url = url.strip().rstrip("/")
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.netloc:
+        raise ValueError(f"Invalid backend URL: {url!r}")
+    return url
+
+def _parse(data) -> Dict[str, dict]:
+    if not isinstance(data, dict):
+        raise ValueError("expected an object of backend URL -> settings")
+    entries = {}
+    for url, entry in data.items():
+        url = normalize_url(url)
+        entry = entry or {}
+        if not isinstance(entry, dict):
+            raise ValueError(f"settings of {url} must be an object")
+        weight = entry.get("weight")
+        if weight is not None and (isinstance(weight, bool) or not isinstance(weight, (int, float)) or weight <= 0):
+            raise ValueError(f"weight of {url} must be a positive number")
+        drain = entry.get("drain", False)
+        if not isinstance(drain, bool):
+            raise ValueError(f"drain of {url} must be true or false")
+        entries[url] = {"weight": float(weight) if weight is not None else None, "drain": drain}
+    return entries
+
+class BackendRegistry:
+    def __init__(self):
+        self.entries: Dict[str, dict] = {}
+        self._seen = False  # Signature of the file last applied (None: no file)
+        self._task: Optional[asyncio.Task] = None
+    
+    @property
+    def path(self) -> str:
+        return settings.backends_file
+    
+    async def start(self):
+        """Apply the registry file (if any) and watch it for changes"""
+        await self.reload(check_new=False)
+        self._task = asyncio.create_task(self._watch_loop())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+    
+    async def _watch_loop(self):
+        while True:
+            try:
+                await asyncio.sleep(settings.backends_watch_interval)
+                await self.reload()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Backend registry check failed: {e}")
+    
+    def _signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    
+    def _read(self) -> Dict[str, dict]:
+        if not os.path.exists(self.path):
+            return {url: {"weight": None, "drain": False} for url in settings.ollama_servers}
+        with open(self.path) as f:
+            return _parse(json.load(f))
+    
+    async def reload(self, check_new: bool = True):
+        """Apply the registry file if it changed since it was last read"""
+        signature = self._signature()
+        if signature == self._seen:
+            return
+        self._seen = signature
+        try:
+            entries = self._read()
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring invalid backend registry {self.path}: {e}")
+            return
+        if signature is not None:
+            logger.info(f"Backend registry {self.path} loaded: {len(entries)} servers")
+        await self._apply(entries, check_new)
+    
+    async def _apply(self, entries: Dict[str, dict], check_new: bool = True):
+        self.entries = entries
+        added = load_balancer.sync_servers(entries, checked=check_new)
+        if added and check_new:
+            # New servers take requests once this check reaches them
+            await load_balancer.refresh_model_catalog()
+    
+    def _write_locked(self, modify: Callable[[Dict[str, dict]], None]) -> Dict[str, dict]:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = self._read()
+            modify(entries)
+            data = {
+                url: {key: value for key, value in entry.items() if value is not None and value is not False}
+                for url, entry in entries.items()
+            }
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(data, f, indent=2)
+            os.replace(self.path + ".tmp", self.path)
+            self._seen = self._signature()
+        return entries
+    
+    async def _modify(self, modify: Callable[[Dict[str, dict]], None]):
+        """Change the registry file under a lock shared by the workers, and apply it here"""
+        # The lock may be held by another worker; wait for it off the event loop
+        entries = await asyncio.to_thread(self._write_locked, modify)
+        await self._apply(entries)
+    
+    async def add(self, url: str, weight: Optional[float] = None, drain: bool = False) -> str:
+        """Add a server; returns its normalized URL"""
+        url = normalize_url(url)
+        
+        def modify(entries: Dict[str, dict]):
+            if url in entries:
+                raise ServerExistsError(f"Server {url} is already registered")
+            entries[url] = {"weight": weight, "drain": drain}
+        
+        await self._modify(modify)
+        return url
+    
+    async def update(self, url: str, **changes) -> str:
+        """Set the weight and/or drain flag of a server; returns its normalized URL"""
+        url = normalize_url(url)
+        
+        def modify(entries: Dict[str, dict]):
+            if url not in entries:
+                raise UnknownServerError(f"Server {url} is not registered")
+            entries[url].update(changes)
+        
+        await self._modify(modify)
+        return url
+    
+    async def remove(self, url: str) -> str:
+        """Remove a server, returning its normalized URL; requests in flight on it finish"""
+        url = normalize_url(url)
+        
+        def modify(entries: Dict[str, dict]):
+            if url not in entries:
+                raise UnknownServerError(f"Server {url} is not registered")
+            del entries[url]
+        
+        await self._modify(modify)
+        return url
+    
+    def get_status(self) -> dict:
+        """Registered servers and their state in this worker"""
+        return {
+            "source": "file" if self._seen else "OLLAMA_SERVERS",
+            "file": self.path,
+            "servers": [
+                {
+                    "url": s.url,
+                    "weight": self.entries.get(s.url, {}).get("weight"),
+                    "drain": s.draining,
+                    "removing": s.removing,
+                    "healthy": s.is_healthy,
+                    "in_flight": s.current_load
+                }
+                for s in load_balancer.servers
+            ]
+        }
+
+# Global backend registry instance
+backend_registry = BackendRegistry()
@@ -0,0 +1,139 @@
+"""
+Model residency tracking and warm-up
+
+Ollama keeps recently used models loaded and loads others on demand, and a
+cold load of a large model takes tens of seconds. Every
+RESIDENCY_POLL_INTERVAL seconds each worker reads the loaded models of the
+backends from /api/ps, so that requests go to a backend that has their
+model loaded (see LoadBalancer.get_next_server).
+
+One worker (the leader, see app.leader) also loads popular models ahead of
+demand. Each model with at least MODEL_WARM_MIN_REQUESTS requests in the
+usage log of the last MODEL_WARM_WINDOW seconds should be loaded on a share
+of the backends matching its share of the demand. When it is loaded on fewer,
+it is loaded on an idle backend that has it, one backend per model and round.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Set, Tuple
+import asyncio
+import logging
+from sqlalchemy import select, func
+from app.config import settings
+from app.database import AsyncSessionLocal, UsageLog
+from app.leader import LeaderLock
+from app.load_balancer import load_balancer, model_tag, ServerStatus
+from app.monitoring import model_warm_ups
+
+logger = logging.getLogger(__name__)
+
+class ModelResidency:
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._leader = LeaderLock("model_warmer")
+        self._warming: Set[Tuple[str, str]] = set()  # (server URL, model) loads in progress
+        self._warm_tasks: Set[asyncio.Task] = set()
+        self.demand: Dict[str, int] = {}  # Requests per model in the window (leader only)
+        self.warm_ups = 0
+        self.last_poll: Optional[datetime] = None
+    
+    async def start(self):
+        """Start polling /api/ps (and warming models) in the background"""
+        if settings.residency_tracking:
+            self._task = asyncio.create_task(self._run_loop())
+    
+    async def stop(self):
+        for task in [self._task, *self._warm_tasks]:
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._leader.release()
+    
+    async def _run_loop(self):
+        while True:
+            try:
+                await self.poll()
+                if settings.model_warming and self._leader.acquire():
+                    await self._warm()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Model residency check failed: {e}")
+            await asyncio.sleep(settings.residency_poll_interval)
+    
+    async def poll(self):
+        """Refresh the loaded models of all healthy backends"""
+        servers = [s for s in load_balancer.servers if s.is_healthy]
+        results = await asyncio.gather(
+            *(load_balancer.fetch_resident_models(s) for s in servers), return_exceptions=True
+        )
+        for server, result in zip(servers, results):
+            if isinstance(result, Exception):
+                logger.debug(f"Polling /api/ps of {server.url} failed: {result}")
+        self.last_poll = datetime.now(timezone.utc)
+    
+    async def _recent_demand(self) -> Dict[str, int]:
+        since = datetime.now(timezone.utc) - timedelta(seconds=settings.model_warm_window)
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(UsageLog.model, func.count()).where(UsageLog.timestamp >= since).group_by(UsageLog.model)
+            )).all()
+        return {model: count for model, count in rows}
+    
+    async def _warm(self):
+        self.demand = await self._recent_demand()
+        popular = {m: n for m, n in self.demand.items() if n >= settings.model_warm_min_requests}
+        servers = [s for s in load_balancer.servers if s.available and s.resident is not None]
+        if not popular or not servers:
+            return
+        
+        total = sum(popular.values())
+        picked: Set[str] = set()  # Servers given a model this round
+        for model, count in sorted(popular.items(), key=lambda item: -item[1]):
+            tag = model_tag(model)
+            candidates = [s for s in servers if s.has_model(model)]
+            target = min(max(1, round(len(servers) * count / total)), len(candidates))
+            warm = [s for s in candidates if s.has_resident(model) or (s.url, tag) in self._warming]
+            if len(warm) >= target:
+                continue
+            idle = [s for s in candidates if s.current_load == 0 and s not in warm and s.url not in picked]
+            if not idle:
+                continue
+            # Fewest loaded models first: least likely to push out something in use
+            server = min(idle, key=lambda s: len(s.resident))
+            picked.add(server.url)
+            task = asyncio.create_task(self._load(server, model))
+            self._warm_tasks.add(task)
+            task.add_done_callback(self._warm_tasks.discard)
+    
+    async def _load(self, server: ServerStatus, model: str):
+        key = (server.url, model_tag(model))
+        self._warming.add(key)
+        try:
+            logger.info(f"Warming {model} on {server.url} ({self.demand.get(model, 0)} recent requests)")
+            await load_balancer.load_model(server, model, settings.model_warm_keep_alive)
+            self.warm_ups += 1
+            model_warm_ups.labels(server=server.url, model=model, outcome="loaded").inc()
+        except Exception as e:
+            model_warm_ups.labels(server=server.url, model=model, outcome="failed").inc()
+            logger.warning(f"Warming {model} on {server.url} failed: {e}")
+        finally:
+            self._warming.discard(key)
+    
+    def get_status(self) -> dict:
+        """Residency polling and warm-up state of this worker for /status"""
+        return {
+            "enabled": settings.residency_tracking,
+            "last_poll": self.last_poll.isoformat() if self.last_poll else None,
+            "warming": settings.model_warming,
+            "leader": self._leader.held,
+            "recent_demand": self.demand,
+            "warm_ups": self.warm_ups,
+            "loading": [{"server": url, "model": model} for url, model in sorted(self._warming)]
+        }
+
+# Global model residency instance
+model_residency = ModelResidency()
@@ -0,0 +1,185 @@
+"""
+Per-worker event loop and process resource monitor
+
+An asyncio task measures how late the loop wakes up from a short sleep
+(scheduling lag) and samples process resources with psutil. A watchdog
+thread notices when that task stops checking in, meaning something is
+blocking the loop, and logs the loop thread's stack while it is blocked.
+"""
+
+from datetime import datetime, timezone
+from typing import Optional
+import asyncio
+import gc
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import psutil
+from app.config import settings
+from app.monitoring import (
+    event_loop_lag, gc_pause, worker_rss_bytes, worker_open_fds,
+    worker_sockets, worker_cpu_percent
+)
+
+logger = logging.getLogger(__name__)
+
+class ResourceMonitor:
+    def __init__(self):
+        self.process = psutil.Process()
+        self.loop_lag_ms = 0.0
+        self.max_loop_lag_ms = 0.0  # Since the last resource sample
+        self.stalls = 0  # Lag spikes above the threshold
+        self.last_stall: Optional[dict] = None
+        self.gc_collections = 0
+        self.gc_pause_total_ms = 0.0
+        self.gc_pause_max_ms = 0.0
+        self.resources: dict = {}
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._gc_start: Optional[float] = None
+        self._tasks = []
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+    
+    async def start(self):
+        """Start lag measurement, resource sampling, GC tracking and the watchdog"""
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        gc.callbacks.append(self._on_gc)
+        self.process.cpu_percent()  # First call only primes the counter
+        self._tasks = [
+            asyncio.create_task(self._lag_loop()),
+            asyncio.create_task(self._sample_loop())
+        ]
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+    
+    async def stop(self):
+        """Stop monitoring"""
+        self._stop.set()
+        if self._on_gc in gc.callbacks:
+            gc.callbacks.remove(self._on_gc)
+        for task in self._tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if self._watchdog:
+            self._watchdog.join(timeout=1)
+    
+    async def _lag_loop(self):
+        """Measure how late the loop wakes up from a short sleep"""
+        interval = settings.loop_monitor_interval
+        while True:
+            try:
+                before = time.monotonic()
+                await asyncio.sleep(interval)
+                now = time.monotonic()
+                self._heartbeat = now
+                
+                lag = max(0.0, now - before - interval)
+                event_loop_lag.observe(lag)
+                self.loop_lag_ms = lag * 1000
+                self.max_loop_lag_ms = max(self.max_loop_lag_ms, self.loop_lag_ms)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Event loop lag monitor error: {e}")
+    
+    async def _sample_loop(self):
+        """Periodically sample process resources"""
+        while True:
+            try:
+                # psutil reads /proc; keep it off the loop
+                self.resources = await asyncio.to_thread(self._sample_resources)
+                self.max_loop_lag_ms = self.loop_lag_ms
+                await asyncio.sleep(settings.resource_sample_interval)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Resource sampling error: {e}")
+                await asyncio.sleep(settings.resource_sample_interval)
+    
+    def _sample_resources(self) -> dict:
+        """Collect process resource usage (runs in a worker thread)"""
+        with self.process.oneshot():
+            rss = self.process.memory_info().rss
+            cpu = self.process.cpu_percent()
+            fds = self.process.num_fds() if hasattr(self.process, "num_fds") else None
+            threads = self.process.num_threads()
+        sockets = len(self.process.net_connections(kind="inet"))
+        
+        worker_rss_bytes.set(rss)
+        worker_cpu_percent.set(cpu)
+        worker_sockets.set(sockets)
+        if fds is not None:
+            worker_open_fds.set(fds)
+        
+        return {
+            "rss_bytes": rss,
+            "cpu_percent": cpu,
+            "open_fds": fds,
+            "sockets": sockets,
+            "threads": threads,
+            "sampled_at": datetime.now(timezone.utc).isoformat()
+        }
+    
+    def _watch(self):
+        """Watchdog thread: snapshot the loop thread's stack while the loop is blocked"""
+        threshold = settings.loop_lag_threshold_ms / 1000
+        poll = min(threshold, settings.loop_monitor_interval) / 2
+        reported_heartbeat = None
+        while not self._stop.wait(poll):
+            heartbeat = self._heartbeat
+            blocked_for = time.monotonic() - heartbeat - settings.loop_monitor_interval
+            if blocked_for < threshold or heartbeat == reported_heartbeat:
+                continue
+            # One report per stall
+            reported_heartbeat = heartbeat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "<unavailable>"
+            self.stalls += 1
+            self.last_stall = {
+                "at": datetime.now(timezone.utc).isoformat(),
+                "blocked_ms": round(blocked_for * 1000, 1),
+                "stack": stack
+            }
+            logger.warning(
+                "Event loop blocked for %.0fms (pid %s), loop thread stack:\n%s",
+                blocked_for * 1000, os.getpid(), stack
+            )
+    
+    def _on_gc(self, phase: str, info: dict):
+        if phase == "start":
+            self._gc_start = time.perf_counter()
+        elif self._gc_start is not None:
+            pause = time.perf_counter() - self._gc_start
+            self._gc_start = None
+            gc_pause.labels(generation=str(info.get("generation"))).observe(pause)
+            self.gc_collections += 1
+            self.gc_pause_total_ms += pause * 1000
+            self.gc_pause_max_ms = max(self.gc_pause_max_ms, pause * 1000)
+    
+    def get_status(self) -> dict:
+        """Worker health for /status"""
+        return {
+            "pid": os.getpid(),
+            "loop_lag_ms": round(self.loop_lag_ms, 2),
+            "max_loop_lag_ms": round(self.max_loop_lag_ms, 2),
+            "loop_stalls": self.stalls,
+            "last_stall": self.last_stall,
+            "gc": {
+                "collections": self.gc_collections,
+                "pause_total_ms": round(self.gc_pause_total_ms, 2),
+                "pause_max_ms": round(self.gc_pause_max_ms, 2)
+            },
+            "resources": self.resources
+        }
+
+# Global resource monitor instance
+resource_monitor = ResourceMonitor()
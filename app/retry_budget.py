@@ -0,0 +1,69 @@
+"""
+Retry budget for backend failover
+
+A failed backend request is retried on the next server, which is what keeps
+a single bad node invisible to clients. During a wider outage the same rule
+multiplies the load on the backends that are still up. The budget caps
+failover retries at RETRY_BUDGET_RATIO of the requests of the last WINDOW
+seconds, plus RETRY_BUDGET_MIN_PER_SECOND so that quiet workers can still
+fail over. Once it is spent, requests fail after their first attempt.
+
+Each worker keeps its own budget.
+"""
+
+from collections import deque
+from typing import Deque, List
+import time
+from app.config import settings
+from app.monitoring import backend_retries
+
+WINDOW = 10  # Seconds of traffic the budget is computed over
+
+class RetryBudget:
+    def __init__(self):
+        self._buckets: Deque[List[int]] = deque()  # [second, requests, retries]
+        self.retries = 0
+        self.denied = 0
+    
+    def _bucket(self) -> List[int]:
+        now = int(time.monotonic())
+        if not self._buckets or self._buckets[-1][0] != now:
+            self._buckets.append([now, 0, 0])
+            while self._buckets[0][0] <= now - WINDOW:
+                self._buckets.popleft()
+        return self._buckets[-1]
+    
+    def _allowed(self, requests: int) -> float:
+        return settings.retry_budget_min_per_second * WINDOW + settings.retry_budget_ratio * requests
+    
+    def record_request(self):
+        """Count a request's first attempt"""
+        self._bucket()[1] += 1
+    
+    def try_retry(self) -> bool:
+        """Take a retry from the budget; False if it is spent"""
+        bucket = self._bucket()
+        requests = sum(b[1] for b in self._buckets)
+        retries = sum(b[2] for b in self._buckets)
+        if retries + 1 > self._allowed(requests):
+            self.denied += 1
+            backend_retries.labels(outcome="denied").inc()
+            return False
+        bucket[2] += 1
+        self.retries += 1
+        backend_retries.labels(outcome="retried").inc()
+        return True
+    
+    def get_status(self) -> dict:
+        """Budget use of this worker for /status"""
+        self._bucket()
+        requests = sum(b[1] for b in self._buckets)
+        retries = sum(b[2] for b in self._buckets)
+        return {
+            "window_seconds": WINDOW,
+            "requests": requests,
+            "retries": retries,
+            "allowed": int(self._allowed(requests)),
+            "total_retries": self.retries,
+            "total_denied": self.denied
+        }
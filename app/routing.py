@@ -0,0 +1,83 @@
+"""
+Prefix-affinity routing
+
+Requests that share a long prompt prefix (system prompt, start of a
+conversation) are sent to the same backend so Ollama can reuse its KV cache.
+The normalised prefix is hashed onto a consistent-hash ring of the healthy
+servers; servers joining or leaving only move the keys next to them.
+Consistent hashing with bounded loads caps any server at `load_factor` times
+the average load, spilling over to the next server on the ring.
+"""
+
+from bisect import bisect
+from typing import Iterator, List, Optional
+import hashlib
+import math
+import re
+from app.config import settings
+
+# Points per server on the ring; more points spread keys more evenly
+RING_REPLICAS = 160
+
+_WHITESPACE = re.compile(r"\s+")
+
+class AffinityConfig:
+    def __init__(self, prefix_chars: int, load_factor: float):
+        self.prefix_chars = prefix_chars
+        self.load_factor = load_factor
+
+def affinity_config(model: Optional[str]) -> Optional[AffinityConfig]:
+    """Effective prefix-affinity settings for a model, None if disabled"""
+    config = {
+        "enabled": settings.prefix_affinity,
+        "prefix_chars": settings.prefix_affinity_chars,
+        "load_factor": settings.prefix_affinity_load_factor
+    }
+    config.update(settings.prefix_affinity_models.get(model or "", {}))
+    if not config["enabled"]:
+        return None
+    return AffinityConfig(int(config["prefix_chars"]), max(float(config["load_factor"]), 1.0))
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+def prefix_key(model: str, text: str, prefix_chars: int) -> int:
+    """Ring position for a request: model plus its normalised prompt prefix"""
+    prefix = _WHITESPACE.sub(" ", text[:prefix_chars * 2]).strip()[:prefix_chars]
+    return _hash(f"{model}\n{prefix}")
+
+class HashRing:
+    """Consistent-hash ring over a fixed set of server URLs"""
+    
+    def __init__(self, urls: List[str]):
+        self.urls = tuple(sorted(urls))
+        points = sorted(
+            (_hash(f"{url}#{i}"), url)
+            for url in self.urls
+            for i in range(RING_REPLICAS)
+        )
+        self._hashes = [h for h, _ in points]
+        self._urls = [url for _, url in points]
+    
+    def walk(self, key: int) -> Iterator[str]:
+        """Distinct servers clockwise from the key's position"""
+        if not self._hashes:
+            return
+        seen = set()
+        start = bisect(self._hashes, key)
+        for i in range(len(self._urls)):
+            url = self._urls[(start + i) % len(self._urls)]
+            if url not in seen:
+                seen.add(url)
+                yield url
+                if len(seen) == len(self.urls):
+                    return
+
+def load_capacity(total_load: int, servers: float, load_factor: float, weight: float = 1.0) -> int:
+    """
+    Max in-flight requests per server under bounded loads (counting the new one)
+    
+    With capacity weights, `servers` is the total weight of the servers and
+    `weight` that of the server.
+    """
+    return max(1, math.ceil(load_factor * (total_load + 1) * weight / servers))
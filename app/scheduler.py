@@ -0,0 +1,202 @@
+"""
+Priority lanes for backend requests
+
+Every request runs in a lane: `admin`, `interactive` or `bulk`. The lane
+comes from the API key (its `priority`, else its role) and a request may
+move itself to a lower lane with the X-Priority header.
+
+With PRIORITY_SLOTS_PER_SERVER set (it is off by default), each worker
+admits at most its share of the backends' slots at once: the slots divided
+by WORKERS, which must match the number of worker processes. When
+slots free up they go to waiting requests in lane order. Bulk requests only
+use spare slots: a share of the capacity stays reserved for the other lanes.
+A bulk request that has waited longer than PRIORITY_AGING_SECONDS competes
+as an interactive request, so a steady interactive load cannot starve it.
+"""
+
+from collections import deque
+from contextvars import ContextVar
+from typing import Callable, Deque, Dict, Optional
+import asyncio
+import math
+import time
+from app.config import settings
+from app.monitoring import lane_requests, lane_in_flight, lane_queue_wait
+from app.timeouts import DeadlineExceeded, current_deadline
+
+# Highest priority first
+LANES = ("admin", "interactive", "bulk")
+DEFAULT_LANE = "interactive"
+
+_current_lane: ContextVar[str] = ContextVar("priority_lane", default=DEFAULT_LANE)
+
+QUEUE_RETRY_AFTER = 5  # Seconds clients are told to wait after a queue timeout
+
+class QueueTimeoutError(Exception):
+    """A request waited too long for a backend slot"""
+    
+    def __init__(self, message: str, retry_after: int = QUEUE_RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def set_lane(lane: str):
+    """Run the backend requests of the current request (or task) in `lane`"""
+    _current_lane.set(lane)
+
+def current_lane() -> str:
+    return _current_lane.get()
+
+def resolve_lane(key_priority: Optional[str], role: str, requested: Optional[str] = None) -> str:
+    """
+    Lane of a request: the key's priority (admins default to the admin lane),
+    lowered to the requested lane if one is given. Requests cannot raise
+    their priority.
+    """
+    lane = key_priority or ("admin" if role == "admin" else DEFAULT_LANE)
+    if requested:
+        requested = requested.strip().lower()
+        if requested in LANES and LANES.index(requested) > LANES.index(lane):
+            lane = requested
+    return lane
+
+class _Waiter:
+    def __init__(self, lane: str):
+        self.lane = lane
+        self.enqueued_at = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+class PriorityScheduler:
+    def __init__(self, healthy_servers: Callable[[], int]):
+        self._healthy_servers = healthy_servers
+        self.in_flight: Dict[str, int] = {lane: 0 for lane in LANES}
+        self._queues: Dict[str, Deque[_Waiter]] = {lane: deque() for lane in LANES}
+        self.aged = 0  # Bulk requests admitted as interactive after waiting too long
+        self.timeouts: Dict[str, int] = {lane: 0 for lane in LANES}
+    
+    @property
+    def enabled(self) -> bool:
+        return settings.priority_slots_per_server > 0
+    
+    @property
+    def capacity(self) -> int:
+        """This worker's share of the backend slots"""
+        slots = max(self._healthy_servers(), 1) * settings.priority_slots_per_server
+        return max(math.ceil(slots / max(settings.workers, 1)), 1)
+    
+    @property
+    def bulk_limit(self) -> int:
+        """Slots bulk requests may fill; the rest is reserved (bulk always gets one)"""
+        capacity = self.capacity
+        return max(capacity - math.ceil(capacity * settings.priority_reserved_fraction), 1)
+    
+    def _total(self) -> int:
+        return sum(self.in_flight.values())
+    
+    def _aged(self, waiter: _Waiter, now: float) -> bool:
+        return waiter.lane == "bulk" and now - waiter.enqueued_at >= settings.priority_aging_seconds
+    
+    def _admit(self, lane: str, queued_for: float, aged: bool = False):
+        self.in_flight[lane] += 1
+        lane_in_flight.labels(lane=lane).inc()
+        lane_queue_wait.labels(lane=lane).observe(queued_for)
+        lane_requests.labels(lane=lane, outcome="aged" if aged else "admitted").inc()
+        if aged:
+            self.aged += 1
+    
+    def _next_waiter(self, now: float) -> Optional[_Waiter]:
+        """Head of the highest-priority queue; aged bulk requests queue as interactive"""
+        if self._queues["admin"]:
+            return self._queues["admin"][0]
+        interactive = self._queues["interactive"][0] if self._queues["interactive"] else None
+        bulk = self._queues["bulk"][0] if self._queues["bulk"] else None
+        if bulk and self._aged(bulk, now) and (interactive is None or bulk.enqueued_at < interactive.enqueued_at):
+            return bulk
+        return interactive or bulk
+    
+    def _dispatch(self):
+        """Hand free slots to waiting requests in priority order"""
+        now = time.monotonic()
+        while True:
+            waiter = self._next_waiter(now)
+            if waiter is None:
+                return
+            aged = self._aged(waiter, now)
+            limit = self.bulk_limit if waiter.lane == "bulk" and not aged else self.capacity
+            if self._total() >= limit:
+                return
+            self._queues[waiter.lane].popleft()
+            self._admit(waiter.lane, now - waiter.enqueued_at, aged)
+            waiter.future.set_result(None)
+    
+    async def acquire(self, lane: str):
+        """
+        Wait for a backend slot in `lane`
+        Raises QueueTimeoutError after PRIORITY_QUEUE_TIMEOUT seconds, or
+        DeadlineExceeded if the request's deadline passes first.
+        """
+        if not self.enabled:
+            self._admit(lane, 0.0)
+            return
+        
+        limit = self.bulk_limit if lane == "bulk" else self.capacity
+        ahead = any(self._queues[other] for other in LANES[:LANES.index(lane) + 1])
+        if not ahead and self._total() < limit:
+            self._admit(lane, 0.0)
+            return
+        
+        waiter = _Waiter(lane)
+        self._queues[lane].append(waiter)
+        deadline = waiter.enqueued_at + settings.priority_queue_timeout
+        request_deadline = current_deadline()
+        if request_deadline is not None:
+            deadline = min(deadline, request_deadline)
+        try:
+            while not waiter.future.done():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._queues[lane].remove(waiter)
+                    self.timeouts[lane] += 1
+                    lane_requests.labels(lane=lane, outcome="timeout").inc()
+                    if deadline == request_deadline:
+                        raise DeadlineExceeded("Request deadline exceeded while waiting for a backend slot")
+                    raise QueueTimeoutError(
+                        f"No backend capacity for {lane} requests within {settings.priority_queue_timeout}s"
+                    )
+                # Bulk waiters wake up once they have aged, even if no slot was released since
+                if lane == "bulk" and time.monotonic() - waiter.enqueued_at < settings.priority_aging_seconds:
+                    remaining = min(remaining, waiter.enqueued_at + settings.priority_aging_seconds - time.monotonic())
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter.future), timeout=max(remaining, 0))
+                except asyncio.TimeoutError:
+                    self._dispatch()
+        except asyncio.CancelledError:
+            # Client went away while waiting (or right after being admitted)
+            if waiter.future.done():
+                self.release(lane)
+            else:
+                self._queues[lane].remove(waiter)
+            raise
+    
+    def release(self, lane: str):
+        """Free a slot taken by acquire()"""
+        self.in_flight[lane] -= 1
+        lane_in_flight.labels(lane=lane).dec()
+        if self.enabled:
+            self._dispatch()
+    
+    def get_status(self) -> dict:
+        """Lane occupancy of this worker for /status"""
+        return {
+            "enabled": self.enabled,
+            "capacity": self.capacity if self.enabled else None,
+            "bulk_limit": self.bulk_limit if self.enabled else None,
+            "lanes": {
+                lane: {
+                    "in_flight": self.in_flight[lane],
+                    "waiting": len(self._queues[lane]),
+                    "timeouts": self.timeouts[lane]
+                }
+                for lane in LANES
+            },
+            "aged_bulk_requests": self.aged
+        }
@@ -0,0 +1,63 @@
+"""
+Backend timeouts and request deadlines
+
+Backend calls have three separate timeouts, configurable per model:
+
+- connect: opening the connection, so a dead node fails over in seconds
+- first_byte: until the backend starts responding (the first chunk of a
+  stream; Ollama sends non-streamed responses only when they are complete,
+  so for those it bounds the whole generation)
+- idle: the longest gap between two chunks of a stream
+
+Clients can also give a request a deadline with the X-Request-Timeout header
+(seconds). It covers waiting in the proxy, every failover attempt and the
+whole stream; when it passes the backend connection is closed, which makes
+Ollama stop generating.
+"""
+
+from contextvars import ContextVar
+from typing import Optional
+import time
+from app.config import settings
+
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed"""
+
+class BackendTimeouts:
+    def __init__(self, connect: float, first_byte: float, idle: float):
+        self.connect = connect
+        self.first_byte = first_byte
+        self.idle = idle
+
+def backend_timeouts(model: Optional[str]) -> BackendTimeouts:
+    """Effective timeouts for a model (global settings merged with per-model overrides)"""
+    overrides = settings.backend_timeout_models.get(model or "", {})
+    return BackendTimeouts(
+        connect=float(overrides.get("connect", settings.backend_connect_timeout)),
+        first_byte=float(overrides.get("first_byte", settings.backend_first_byte_timeout)),
+        idle=float(overrides.get("idle", settings.backend_idle_timeout))
+    )
+
+def set_deadline(seconds: float):
+    """Give the current request `seconds` from now to finish"""
+    _deadline.set(time.monotonic() + seconds)
+
+def current_deadline() -> Optional[float]:
+    """Deadline of the current request (time.monotonic() based), if any"""
+    return _deadline.get()
+
+def remaining(deadline: Optional[float]) -> Optional[float]:
+    """Seconds left until `deadline`; raises DeadlineExceeded once it has passed"""
+    if deadline is None:
+        return None
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return left
+
+def bounded(timeout: float, deadline: Optional[float]) -> float:
+    """`timeout`, shortened to what is left of the deadline"""
+    left = remaining(deadline)
+    return timeout if left is None else min(timeout, left)
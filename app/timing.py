@@ -0,0 +1,76 @@
+"""
+Per-request phase timing
+
+The request middleware starts a RequestTiming for every request; code along
+the request path (auth, rate limiting, the load balancer, usage logging) adds
+the time spent in its phase. Phases are reported in the Server-Timing header
+and in the access log line.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+import time
+
+_current_timing: ContextVar[Optional["RequestTiming"]] = ContextVar("request_timing", default=None)
+
+class RequestTiming:
+    """Accumulated time per phase of a single request, in milliseconds"""
+    
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.phases: Dict[str, float] = {}
+    
+    def add(self, phase: str, seconds: float):
+        """Add time to a phase (phases hit several times, e.g. on retries, accumulate)"""
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds * 1000
+    
+    def finish(self):
+        """Mark the end of the request (after the last body chunk)"""
+        if self.end is None:
+            self.end = time.perf_counter()
+    
+    @property
+    def total_ms(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000
+    
+    def server_timing(self) -> str:
+        """Server-Timing header value for the phases recorded so far"""
+        entries = [f"{name};dur={ms:.1f}" for name, ms in self.phases.items()]
+        entries.append(f"total;dur={self.total_ms:.1f}")
+        return ", ".join(entries)
+    
+    def summary(self) -> str:
+        """Compact `phase=ms` listing for log lines"""
+        return " ".join(f"{name}={ms:.1f}ms" for name, ms in self.phases.items())
+    
+    def __str__(self) -> str:
+        # Log line suffix; lets log calls pass the timing and format it lazily
+        return f" {self.summary()}" if self.phases else ""
+
+def start_request_timing() -> RequestTiming:
+    """Start timing the current request"""
+    timing = RequestTiming()
+    _current_timing.set(timing)
+    return timing
+
+def current_timing() -> Optional[RequestTiming]:
+    """Timing of the request being handled, if any"""
+    return _current_timing.get()
+
+def record_phase(phase: str, seconds: float):
+    """Add time to a phase of the current request (no-op outside a request)"""
+    timing = _current_timing.get()
+    if timing is not None:
+        timing.add(phase, seconds)
+
+@contextmanager
+def timed(phase: str):
+    """Time the enclosed block as a phase of the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(phase, time.perf_counter() - start)
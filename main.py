@@ -1,40 +1,67 @@
-from fastapi import FastAPI, Depends, HTTPException, Request, Query
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, Depends, HTTPException, Request, Query, UploadFile, File
+from fastapi.responses import StreamingResponse, JSONResponse, Response, PlainTextResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer
 from contextlib import asynccontextmanager
 from datetime import datetime, timezone, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 import httpx
 import logging
 import json
+import os
 import time
 import asyncio
 
 from app.config import settings
+from app.logging_config import setup_logging, shutdown_logging, sampled
 from app.models import (
-    OllamaGenerateRequest, OllamaChatRequest, 
+    OllamaGenerateRequest, OllamaChatRequest, OllamaEmbedRequest, OllamaEmbeddingsRequest,
     HealthResponse, ErrorResponse, UsageRecord,
-    APIKeyCreate, APIKeyResponse, UsageStats, User
+    APIKeyCreate, APIKeyPriorityUpdate, APIKeyResponse, UsageStats, User, UserRole, ChatSessionCreate,
+    ServerCreate, ServerWeightUpdate, ServerDrainUpdate
 )
 from app.auth import verify_api_key, verify_admin, get_optional_user
 from app.rate_limiter import rate_limiter
-from app.load_balancer import load_balancer
-from app.database import get_db, init_db, APIKey, UsageLog, generate_api_key, hash_api_key
+from app.load_balancer import load_balancer, BackendStatusError
+from app.limiter import OverloadedError
+from app.scheduler import QueueTimeoutError
+from app.health import readiness
+from app.resource_monitor import resource_monitor
+from app.profiler import profiler, ProfilerBusyError
+from app.passthrough import parse_generate, parse_chat, parse_embed
+from app.embed_batcher import embed_batcher, ZERO_EMBED_STATS
+from app.embed_cache import embedding_cache
+from app.context_store import context_store
+from app.chat_sessions import chat_sessions, session_messages, AssistantTranscript
+from app import batch
+from app.batch import batch_runner
+from app.residency import model_residency
+from app.registry import backend_registry, ServerExistsError, UnknownServerError
+from app.placement import placement_controller, PlacementBusyError, PlacementRateLimitedError
+from app import jsonutil
+from app.timing import start_request_timing, timed
+from app.timeouts import DeadlineExceeded, set_deadline
+from app.monitoring import (
+    RequestMetrics, observe_generation, metrics_endpoint, start_metrics_server, mark_worker_exit
+)
+from app.database import (
+    get_db, init_db, APIKey, UsageLog, BatchJob, generate_api_key, hash_api_key,
+    is_sqlite, search_usage_logs
+)
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, and_
+from sqlalchemy import select, update, func, and_
+from sqlalchemy.exc import OperationalError
 
-# Configure logging
-logging.basicConfig(
-    level=getattr(logging, settings.log_level),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configure logging (queued, written by a background thread)
+setup_logging()
 logger = logging.getLogger(__name__)
+access_logger = logging.getLogger("access")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan manager"""
     # Startup
+    setup_logging()
     logger.info("Starting Tokamak AI API Server...")
     
     # Initialize database
@@ -44,6 +71,22 @@ async def lifespan(app: FastAPI):
     # Initialize rate limiter
     await rate_limiter.connect()
     
+    # Keep database state fresh for health/readiness probes
+    await readiness.start()
+    
+    # Watch this worker's event loop and resource usage
+    await resource_monitor.start()
+    
+    # Process queued batch jobs in the background
+    await batch_runner.start()
+    
+    # Expose Prometheus metrics on their own port (0 = served at /metrics instead)
+    if settings.enable_metrics and settings.metrics_port:
+        start_metrics_server(settings.metrics_port)
+    
+    # Servers from the backend registry file (if any), watched for changes
+    await backend_registry.start()
+    
     # Log configured servers
     logger.info(f"Configured Ollama servers: {settings.ollama_servers}")
     logger.info(f"Load balancer has {len(load_balancer.servers)} servers")
@@ -53,8 +96,16 @@ async def lifespan(app: FastAPI):
     # Start health checks
     await load_balancer.start_health_checks()
     
-    # Log initial server status after health check
-    await asyncio.sleep(2)  # Wait for initial health check
+    # Track which models are loaded where, and load popular ones ahead of demand
+    await model_residency.start()
+    await placement_controller.start()
+    
+    # Wait for the initial health check, but never block startup for long
+    if not await load_balancer.wait_for_initial_check(settings.startup_health_timeout):
+        logger.warning(
+            f"Initial health check did not finish within {settings.startup_health_timeout}s, "
+            "continuing startup"
+        )
     status = load_balancer.get_status()
     logger.info(f"Server status after startup: {status['healthy_servers']}/{status['total_servers']} healthy")
     for server_info in status['servers']:
@@ -65,8 +116,17 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     logger.info("Shutting down Tokamak AI API Server...")
+    await batch_runner.stop()
+    await model_residency.stop()
+    await placement_controller.stop()
+    await backend_registry.stop()
     await rate_limiter.close()
+    await readiness.stop()
+    await resource_monitor.stop()
     await load_balancer.stop_health_checks()
+    await load_balancer.close()
+    mark_worker_exit()
+    shutdown_logging()
 
 # Security scheme for Swagger UI
 from fastapi.openapi.utils import get_openapi
@@ -130,6 +190,22 @@ app = FastAPI(
     }
 )
 
+# Proxy endpoints read the raw body, so their request schemas are documented explicitly
+RAW_BODY_MODELS = [OllamaGenerateRequest, OllamaChatRequest, OllamaEmbedRequest, OllamaEmbeddingsRequest]
+
+def request_body_schema(model_class) -> dict:
+    """openapi_extra describing a JSON body the endpoint parses itself"""
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {"$ref": f"#/components/schemas/{model_class.__name__}"}
+                }
+            }
+        }
+    }
+
 # Custom OpenAPI schema with security definitions
 def custom_openapi():
     if app.openapi_schema:
@@ -142,6 +218,12 @@ def custom_openapi():
         routes=app.routes,
     )
     
+    schemas = openapi_schema.setdefault("components", {}).setdefault("schemas", {})
+    for model_class in RAW_BODY_MODELS:
+        schema = model_class.model_json_schema(ref_template="#/components/schemas/{model}")
+        schemas.update(schema.pop("$defs", {}))
+        schemas[model_class.__name__] = schema
+    
     # Add security scheme
     openapi_schema["components"]["securitySchemes"] = {
         "HTTPBearer": {
@@ -156,7 +238,7 @@ def custom_openapi():
     for path, methods in openapi_schema.get("paths", {}).items():
         for method, details in methods.items():
             # Skip public endpoints
-            if path in ["/health", "/auth/verify", "/api/tags"] or method.lower() == "options":
+            if path in ["/health", "/livez", "/readyz", "/auth/verify", "/api/tags"] or method.lower() == "options":
                 continue
             # Add security requirement if endpoint requires auth
             if "security" not in details:
@@ -177,19 +259,73 @@ app.add_middleware(
 )
 
 # Request logging middleware
+slow_logger = logging.getLogger("slow_requests")
+
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    start_time = time.time()
-    response = await call_next(request)
-    duration = (time.time() - start_time) * 1000
+    timing = start_request_timing()
+    request_timeout = request.headers.get("x-request-timeout")
+    if request_timeout is not None:
+        try:
+            seconds = float(request_timeout)
+        except ValueError:
+            seconds = 0
+        if not 0 < seconds <= settings.max_request_timeout:
+            return JSONResponse(
+                status_code=400,
+                content={"detail": f"X-Request-Timeout must be a number of seconds between 0 and {settings.max_request_timeout}"}
+            )
+        set_deadline(seconds)
+    with RequestMetrics("unmatched", request.method) as metrics:
+        response = await call_next(request)
+        # Label by route template to keep metric cardinality bounded
+        route = request.scope.get("route")
+        if route is not None:
+            metrics.endpoint = route.path
+        metrics.status = response.status_code
     
-    logger.info(
-        f"{request.method} {request.url.path} - {response.status_code} - {duration:.2f}ms"
-    )
+    # Phases known before the body is sent (streaming phases follow in the log line)
+    response.headers["Server-Timing"] = timing.server_timing()
+    
+    method, path, status_code = request.method, request.url.path, response.status_code
+    body_iterator = response.body_iterator
+    
+    async def body_with_timing():
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        except Exception:
+            metrics.status = "error"
+            raise
+        finally:
+            metrics.finish()
+            timing.finish()
+            total_ms = timing.total_ms
+            threshold = settings.slow_request_threshold_ms
+            slow = bool(threshold) and total_ms >= threshold
+            logged = sampled(access_logger, logging.INFO)
+            # Only build the fields for lines that are actually written
+            fields = {
+                "method": method,
+                "path": path,
+                "status": status_code,
+                "duration_ms": round(total_ms, 2),
+                "phases_ms": {name: round(ms, 2) for name, ms in timing.phases.items()}
+            } if logged or slow else None
+            if logged:
+                access_logger.info("%s %s - %s - %.2fms%s", method, path, status_code, total_ms, timing, extra={**fields, "_sampled": True})
+            if slow:
+                slow_logger.warning("%s %s - %s - %.2fms%s", method, path, status_code, total_ms, timing, extra=fields)
     
+    response.body_iterator = body_with_timing()
     return response
 
-# Error handler
+# Error handlers
+@app.exception_handler(BackendStatusError)
+async def backend_status_handler(request: Request, exc: BackendStatusError):
+    # The backend rejected the request: pass its status and error body through
+    return Response(content=exc.body, status_code=exc.status_code, media_type=exc.content_type)
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     logger.error(f"Unhandled exception: {exc}", exc_info=True)
@@ -228,16 +364,9 @@ async def verify_auth(
     }
 
 @app.get("/health", response_model=HealthResponse)
-async def health_check(db: AsyncSession = Depends(get_db)):
-    """Health check endpoint"""
-    
-    # Check database
-    db_ok = True
-    try:
-        await db.execute(select(1))
-    except Exception as e:
-        logger.error(f"Database health check failed: {e}")
-        db_ok = False
+async def health_check():
+    """Health check endpoint (uses cached database and backend state)"""
+    db_ok = readiness.database_connected
     
     return HealthResponse(
         status="ok" if db_ok else "degraded",
@@ -247,14 +376,80 @@ async def health_check(db: AsyncSession = Depends(get_db)):
         database_connected=db_ok
     )
 
+@app.get("/livez")
+async def liveness_probe():
+    """Liveness probe: the process is up and serving (never does I/O)"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readiness_probe():
+    """
+    Readiness probe: ready to take traffic
+    
+    Requires a working database and at least one healthy backend. Both are
+    checked in the background; this endpoint only reads the cached state.
+    """
+    healthy_servers = sum(1 for s in load_balancer.servers if s.available)
+    checks = {
+        "database": readiness.database_connected,
+        "backends": load_balancer.initial_check_done.is_set() and healthy_servers > 0
+    }
+    ready = all(checks.values())
+    
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "status": "ready" if ready else "not_ready",
+            "checks": checks,
+            "healthy_servers": healthy_servers,
+            "total_servers": len(load_balancer.servers),
+            "database_checked_at": readiness.last_check.isoformat() if readiness.last_check else None
+        }
+    )
+
 @app.get("/status")
 async def get_status(user: User = Depends(verify_admin)):
     """Get detailed server status (admin only)"""
     return {
         "load_balancer": load_balancer.get_status(),
+        "worker": resource_monitor.get_status(),
+        "embed_cache": embedding_cache.get_status(),
+        "batch": batch_runner.get_status(),
+        "model_residency": model_residency.get_status(),
         "timestamp": datetime.now(timezone.utc).isoformat()
     }
 
+@app.get("/admin/profile")
+async def profile_worker(
+    seconds: float = Query(10, gt=0, le=120, description="How long to sample (max 120s)"),
+    interval_ms: int = Query(10, ge=1, le=1000, description="Sampling interval in milliseconds"),
+    format: str = Query("collapsed", pattern="^(collapsed|speedscope)$", description="`collapsed` or `speedscope`"),
+    admin: User = Depends(verify_admin)
+):
+    """
+    Sample the Python stacks of this worker for a while (admin only)
+    
+    Covers the event loop thread and all other threads. Only the worker that
+    handles this request is profiled; one profile runs at a time per worker.
+    `collapsed` output works with flamegraph.pl and speedscope,
+    `speedscope` returns a speedscope JSON profile.
+    """
+    logger.info(f"Admin {admin.username} started a {seconds}s profile (interval: {interval_ms}ms)")
+    try:
+        result = await profiler.profile(seconds, interval_ms)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    if format == "speedscope":
+        return JSONResponse(content=result.speedscope())
+    return PlainTextResponse(result.collapsed())
+
+if settings.enable_metrics and not settings.metrics_port:
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics(admin: User = Depends(verify_admin)):
+        """Prometheus metrics (only when METRICS_PORT=0; labels include usernames, so admins only)"""
+        return metrics_endpoint()
+
 # ============================================================================
 # API KEY MANAGEMENT ENDPOINTS
 # ============================================================================
@@ -277,6 +472,7 @@ async def create_api_key(
         username=key_request.username,
         role=key_request.role.value,
         rate_limit=key_request.rate_limit,
+        priority=key_request.priority.value if key_request.priority else None,
         description=key_request.description,
         created_at=datetime.now(timezone.utc)
     )
@@ -293,6 +489,7 @@ async def create_api_key(
         role=db_key.role,
         rate_limit=db_key.rate_limit,
         created_at=db_key.created_at,
+        priority=db_key.priority,
         description=db_key.description
     )
 
@@ -312,6 +509,7 @@ async def list_api_keys(
                 "username": k.username,
                 "role": k.role,
                 "rate_limit": k.rate_limit,
+                "priority": k.priority,
                 "is_active": k.is_active,
                 "created_at": k.created_at.isoformat(),
                 "last_used_at": k.last_used_at.isoformat() if k.last_used_at else None,
@@ -321,6 +519,28 @@ async def list_api_keys(
         ]
     }
 
+@app.put("/admin/api-keys/{username}/priority")
+async def set_api_key_priority(
+    username: str,
+    priority_request: APIKeyPriorityUpdate,
+    db: AsyncSession = Depends(get_db),
+    admin: User = Depends(verify_admin)
+):
+    """Set the priority lane of a user's requests; null restores the role default (admin only)"""
+    
+    priority = priority_request.priority.value if priority_request.priority else None
+    result = await db.execute(
+        update(APIKey).where(APIKey.username == username).values(priority=priority)
+    )
+    await db.commit()
+    
+    if result.rowcount == 0:
+        raise HTTPException(status_code=404, detail="API key not found")
+    
+    logger.info(f"Priority of {username} set to {priority or 'role default'} by admin: {admin.username}")
+    
+    return {"username": username, "priority": priority}
+
 @app.delete("/admin/api-keys/{username}")
 async def revoke_api_key(
     username: str,
@@ -348,6 +568,18 @@ async def revoke_api_key(
 # OLLAMA API ENDPOINTS
 # ============================================================================
 
+def backend_error(e: Exception) -> Exception:
+    """HTTP error for a request the backends could not serve (or rejected)"""
+    if isinstance(e, BackendStatusError):
+        # Handled by backend_status_handler
+        return e
+    if isinstance(e, (OverloadedError, QueueTimeoutError)):
+        # Shed by the adaptive concurrency limit or the lane queue: tell the client when to come back
+        return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    if isinstance(e, DeadlineExceeded):
+        return HTTPException(status_code=504, detail=str(e))
+    return HTTPException(status_code=503, detail=f"Backend error: {e}")
+
 async def log_usage(
     db: AsyncSession,
     username: str,
@@ -362,45 +594,88 @@ async def log_usage(
     prompt: Optional[str] = None
 ):
     """Log API usage to database"""
-    try:
-        # Truncate prompt if too long (max 5000 characters)
-        prompt_truncated = prompt[:5000] if prompt and len(prompt) > 5000 else prompt
-        
-        usage_log = UsageLog(
-            username=username,
-            timestamp=datetime.now(timezone.utc),
-            model=model,
-            endpoint=endpoint,
-            prompt=prompt_truncated,
-            prompt_tokens=prompt_tokens,
-            completion_tokens=completion_tokens,
-            total_tokens=prompt_tokens + (completion_tokens or 0),
-            duration_ms=duration_ms,
-            success=success,
-            error=error,
-            server_used=server_used
+    with timed("usage_log"):
+        try:
+            # Truncate prompt if too long (max 5000 characters)
+            prompt_truncated = prompt[:5000] if prompt and len(prompt) > 5000 else prompt
+            
+            usage_log = UsageLog(
+                username=username,
+                timestamp=datetime.now(timezone.utc),
+                model=model,
+                endpoint=endpoint,
+                prompt=prompt_truncated,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + (completion_tokens or 0),
+                duration_ms=duration_ms,
+                success=success,
+                error=error,
+                server_used=server_used
+            )
+            db.add(usage_log)
+            await db.commit()
+        except Exception as e:
+            logger.error(f"Failed to log usage: {e}")
+
+class RelayResponse(StreamingResponse):
+    """
+    NDJSON response relaying a backend stream (see LoadBalancer.relay_stream)
+    
+    relay_stream releases the stream's slots when its body is iterated; if the
+    client leaves before that (Starlette then skips the body and background
+    tasks), they are released here.
+    """
+    
+    def __init__(self, response, server_url: str, **relay_options):
+        super().__init__(
+            load_balancer.relay_stream(response, server_url, **relay_options), media_type="application/x-ndjson"
         )
-        db.add(usage_log)
-        await db.commit()
-    except Exception as e:
-        logger.error(f"Failed to log usage: {e}")
+        self.backend_response = response
+        self.server_url = server_url
+    
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await load_balancer.close_stream(self.backend_response, self.server_url)
 
-@app.post("/api/generate")
+@app.post("/api/generate", openapi_extra=request_body_schema(OllamaGenerateRequest))
 async def generate(
-    request: OllamaGenerateRequest,
+    http_request: Request,
     user: User = Depends(verify_api_key),
     db: AsyncSession = Depends(get_db)
 ):
     """Generate completion from a prompt"""
+    request = parse_generate(await http_request.body())
     
     # Check rate limit
     await rate_limiter.check_rate_limit(user, db)
     
+    # Expand a server-side context handle; it also pins the request to the backend
+    # that produced the context
+    preferred_server = None
+    if isinstance(request.context_handle, str):
+        stored = await context_store.load(request.context_handle, user.username)
+        if stored is None:
+            raise HTTPException(status_code=400, detail="Unknown or expired context handle")
+        if stored.model != request.model:
+            raise HTTPException(status_code=400, detail=f"Context handle belongs to model {stored.model}")
+        request.insert_field("context", stored.context)
+        preferred_server = stored.server_url
+    
     start_time = time.time()
     success = True
     error_msg = None
     server_url = None
     
+    async def store_context(result: dict) -> dict:
+        """Replace the returned context with a handle to it"""
+        context = result.pop("context", None)
+        if context:
+            result["context_handle"] = await context_store.save(user.username, request.model, server_url, context)
+        return result
+    
     try:
         # Proxy request to backend
         if request.stream:
@@ -408,46 +683,56 @@ async def generate(
             response, server_url = await load_balancer.proxy_request(
                 method="POST",
                 path="/api/generate",
-                json_data=request.dict(),
-                stream=True
-            )
-            
-            async def generate_stream():
-                async for chunk in response.aiter_bytes():
-                    yield chunk
-            
-            # Log usage (approximate for streaming)
-            prompt_tokens = len(request.prompt.split())
-            duration_ms = int((time.time() - start_time) * 1000)
-            
-            await log_usage(
-                db=db,
-                username=user.username,
+                content=request.body,
+                stream=True,
                 model=request.model,
-                endpoint="generate",
-                prompt_tokens=prompt_tokens,
-                completion_tokens=None,
-                duration_ms=duration_ms,
-                success=True,
-                error=None,
-                server_used=server_url,
-                prompt=request.prompt
+                preferred_server=preferred_server,
+                prefix=request.prefix_text
             )
             
-            return StreamingResponse(
-                generate_stream(),
-                media_type="application/x-ndjson"
-            )
+            try:
+                def on_stream_complete(final: dict):
+                    observe_generation(request.model, final, user.username)
+                
+                # Log usage (approximate for streaming)
+                prompt_tokens = len(request.prompt.split())
+                duration_ms = int((time.time() - start_time) * 1000)
+                
+                await log_usage(
+                    db=db,
+                    username=user.username,
+                    model=request.model,
+                    endpoint="generate",
+                    prompt_tokens=prompt_tokens,
+                    completion_tokens=None,
+                    duration_ms=duration_ms,
+                    success=True,
+                    error=None,
+                    server_used=server_url,
+                    prompt=request.prompt
+                )
+                
+                return RelayResponse(
+                    response, server_url, model=request.model, on_complete=on_stream_complete,
+                    rewrite_final=store_context if request.context_handle else None
+                )
+            except BaseException:
+                await load_balancer.close_stream(response, server_url)
+                raise
         else:
             # Non-streaming response
             response, server_url = await load_balancer.proxy_request(
                 method="POST",
                 path="/api/generate",
-                json_data=request.dict(),
-                stream=False
+                content=request.body,
+                stream=False,
+                model=request.model,
+                preferred_server=preferred_server,
+                prefix=request.prefix_text
             )
             
-            result = response.json()
+            result = jsonutil.loads(response.content)
+            observe_generation(request.model, result, user.username)
             
             # Log usage
             prompt_tokens = len(request.prompt.split())
@@ -468,8 +753,12 @@ async def generate(
                 prompt=request.prompt
             )
             
-            return result
+            if request.context_handle and "context" in result:
+                return Response(content=jsonutil.dumps(await store_context(result)), media_type="application/json")
             
+            # Return the backend's bytes as-is
+            return Response(content=response.content, media_type="application/json")
+    
     except Exception as e:
         success = False
         error_msg = str(e)
@@ -490,77 +779,110 @@ async def generate(
             prompt=request.prompt
         )
         
-        raise HTTPException(status_code=503, detail=f"Backend error: {error_msg}")
+        raise backend_error(e)
 
-@app.post("/api/chat")
+@app.post("/api/chat", openapi_extra=request_body_schema(OllamaChatRequest))
 async def chat(
-    request: OllamaChatRequest,
+    http_request: Request,
     user: User = Depends(verify_api_key),
     db: AsyncSession = Depends(get_db)
 ):
     """Chat with a model"""
+    request = parse_chat(await http_request.body())
     
     # Check rate limit
     await rate_limiter.check_rate_limit(user, db)
     
+    # With a session only the new messages are sent; the stored history is put
+    # in front of them and the turn goes to the backend that served the last one
+    preferred_server = None
+    if request.session_id:
+        session = await chat_sessions.get(request.session_id, user.username)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Chat session not found or expired")
+        request.prepend_history(session.messages)
+        preferred_server = session.server_url
+    
     start_time = time.time()
     server_url = None
     
+    async def record_turn(reply: dict):
+        """Append the new messages and the reply to the session"""
+        await chat_sessions.append(request.session_id, request.messages + [reply], request.model, server_url)
+    
+    # Usage is logged against the (new) message contents
+    total_content = " ".join(msg.get("content") or "" for msg in request.messages)
+    prompt_text = request.prompt
+    
     try:
         if request.stream:
             # Streaming response
             response, server_url = await load_balancer.proxy_request(
                 method="POST",
                 path="/api/chat",
-                json_data=request.dict(),
-                stream=True
-            )
-            
-            async def generate_stream():
-                async for chunk in response.aiter_bytes():
-                    yield chunk
-            
-            # Log usage
-            total_content = " ".join([msg.content for msg in request.messages])
-            prompt_tokens = len(total_content.split())
-            duration_ms = int((time.time() - start_time) * 1000)
-            # Format messages as prompt string
-            prompt_text = "\n".join([f"{msg.role}: {msg.content}" for msg in request.messages])
-            
-            await log_usage(
-                db=db,
-                username=user.username,
+                content=request.body,
+                stream=True,
                 model=request.model,
-                endpoint="chat",
-                prompt_tokens=prompt_tokens,
-                completion_tokens=None,
-                duration_ms=duration_ms,
-                success=True,
-                error=None,
-                server_used=server_url,
-                prompt=prompt_text
+                preferred_server=preferred_server,
+                prefix=request.prefix_text
             )
             
-            return StreamingResponse(
-                generate_stream(),
-                media_type="application/x-ndjson"
-            )
+            try:
+                def on_stream_complete(final: dict):
+                    observe_generation(request.model, final, user.username)
+                
+                # Log usage
+                prompt_tokens = len(total_content.split())
+                duration_ms = int((time.time() - start_time) * 1000)
+                
+                await log_usage(
+                    db=db,
+                    username=user.username,
+                    model=request.model,
+                    endpoint="chat",
+                    prompt_tokens=prompt_tokens,
+                    completion_tokens=None,
+                    duration_ms=duration_ms,
+                    success=True,
+                    error=None,
+                    server_used=server_url,
+                    prompt=prompt_text
+                )
+                
+                transcript = None
+                save_turn = None
+                if request.session_id:
+                    transcript = AssistantTranscript()
+                    
+                    async def save_turn(final: dict) -> dict:
+                        # Persisted before the final line is sent, so the next turn sees it
+                        await record_turn(transcript.message())
+                        return final
+                
+                return RelayResponse(
+                    response, server_url, model=request.model, on_complete=on_stream_complete,
+                    rewrite_final=save_turn, on_chunk=transcript.feed if transcript else None
+                )
+            except BaseException:
+                await load_balancer.close_stream(response, server_url)
+                raise
         else:
             # Non-streaming response
             response, server_url = await load_balancer.proxy_request(
                 method="POST",
                 path="/api/chat",
-                json_data=request.dict(),
-                stream=False
+                content=request.body,
+                stream=False,
+                model=request.model,
+                preferred_server=preferred_server,
+                prefix=request.prefix_text
             )
             
-            result = response.json()
+            result = jsonutil.loads(response.content)
+            observe_generation(request.model, result, user.username)
             
             # Log usage
-            total_content = " ".join([msg.content for msg in request.messages])
             prompt_tokens = len(total_content.split())
-            # Format messages as prompt string
-            prompt_text = "\n".join([f"{msg.role}: {msg.content}" for msg in request.messages])
             
             if "message" in result and "content" in result["message"]:
                 completion_tokens = len(result["message"]["content"].split())
@@ -569,6 +891,9 @@ async def chat(
             
             duration_ms = int((time.time() - start_time) * 1000)
             
+            if request.session_id and "message" in result:
+                await record_turn(result["message"])
+            
             await log_usage(
                 db=db,
                 username=user.username,
@@ -583,15 +908,14 @@ async def chat(
                 prompt=prompt_text
             )
             
-            return result
-            
+            # Return the backend's bytes as-is
+            return Response(content=response.content, media_type="application/json")
+    
     except Exception as e:
         error_msg = str(e)
         duration_ms = int((time.time() - start_time) * 1000)
         
         # Log failed request
-        total_content = " ".join([msg.content for msg in request.messages])
-        prompt_text = "\n".join([f"{msg.role}: {msg.content}" for msg in request.messages])
         await log_usage(
             db=db,
             username=user.username,
@@ -606,73 +930,399 @@ async def chat(
             prompt=prompt_text
         )
         
-        raise HTTPException(status_code=503, detail=f"Backend error: {error_msg}")
+        raise backend_error(e)
 
-@app.get("/api/tags")
-async def list_models(user: Optional[User] = Depends(get_optional_user)):
-    """List available models from all healthy servers"""
+@app.post("/api/chat/sessions")
+async def create_chat_session(
+    session_request: ChatSessionCreate,
+    user: User = Depends(verify_api_key)
+):
+    """
+    Start a server-side chat session
     
-    # Get all healthy servers (or all servers if none are healthy)
-    healthy_servers = [s for s in load_balancer.servers if s.is_healthy]
+    Send `session_id` with /api/chat and only the new messages of each turn;
+    the proxy keeps the history.
+    """
+    session = await chat_sessions.create(user.username, session_request.model, session_request.messages)
+    return {
+        "session_id": session.id,
+        "model": session.model,
+        "message_count": session.message_count,
+        "created_at": session.created_at
+    }
+
+@app.get("/api/chat/sessions")
+async def list_chat_sessions(user: User = Depends(verify_api_key)):
+    """List your chat sessions, most recently used first"""
+    sessions = await chat_sessions.list_sessions(user.username)
+    return {
+        "sessions": [
+            {
+                "session_id": s.id,
+                "model": s.model,
+                "message_count": s.message_count,
+                "created_at": s.created_at,
+                "updated_at": s.updated_at
+            }
+            for s in sessions
+        ]
+    }
+
+@app.get("/api/chat/sessions/{session_id}")
+async def get_chat_session(session_id: str, user: User = Depends(verify_api_key)):
+    """Get a chat session with its full message history"""
+    session = await chat_sessions.get(session_id, user.username)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Chat session not found or expired")
+    return {
+        "session_id": session.id,
+        "model": session.model,
+        "message_count": session.message_count,
+        "created_at": session.created_at,
+        "updated_at": session.updated_at,
+        "messages": session_messages(session)
+    }
+
+@app.delete("/api/chat/sessions/{session_id}")
+async def delete_chat_session(session_id: str, user: User = Depends(verify_api_key)):
+    """Delete a chat session"""
+    if not await chat_sessions.delete(session_id, user.username):
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    return {"message": f"Chat session {session_id} has been deleted"}
+
+async def embed_with_cache(request) -> Tuple[dict, Optional[str]]:
+    """
+    /api/embed through the shared embedding cache: only inputs not cached yet
+    go to the backend, and their vectors are added to the cache
     
-    if not healthy_servers:
-        # If no healthy servers, try all servers anyway
-        healthy_servers = load_balancer.servers
-        if not healthy_servers:
-            raise HTTPException(status_code=503, detail="No servers configured")
+    The response has the same fields as Ollama's; its stats cover only the
+    inputs sent to the backend in a request of their own (zero if everything
+    was cached, or the one missing input went through the batcher).
+    Returns: (response, server_url_used or None if everything was cached)
+    """
+    embeddings = await embedding_cache.lookup(request.model, request.fields, request.inputs)
+    missing = [i for i, vector in enumerate(embeddings) if vector is None]
+    server_url = None
+    stats = dict(ZERO_EMBED_STATS)
     
-    # Collect models from all servers
-    all_models = []
-    model_map = {}  # Track unique models by name to avoid duplicates
+    if missing:
+        texts = [request.inputs[i] for i in missing]
+        if len(texts) == 1 and embed_batcher.enabled:
+            result, server_url = await embed_batcher.embed(request.model, request.fields, texts[0])
+        else:
+            body = request.body if len(texts) == len(request.inputs) else jsonutil.dumps({**request.fields, "input": texts})
+            response, server_url = await load_balancer.proxy_request(
+                method="POST",
+                path="/api/embed",
+                content=body,
+                model=request.model
+            )
+            result = jsonutil.loads(response.content)
+        vectors = result.get("embeddings") or []
+        if len(vectors) != len(texts):
+            raise Exception(f"Backend returned {len(vectors)} embeddings for {len(texts)} inputs")
+        stats.update((key, value) for key, value in result.items() if key not in ("model", "embeddings"))
+        for i, vector in zip(missing, vectors):
+            embeddings[i] = vector
+        with timed("embed_cache_store"):
+            await asyncio.to_thread(embedding_cache.store, request.model, request.fields, texts, vectors)
     
-    async def fetch_models_from_server(server_url: str) -> tuple[str, list]:
-        """Fetch models from a single server"""
-        try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(f"{server_url}/api/tags")
-                if response.status_code == 200:
-                    data = response.json()
-                    return (server_url, data.get("models", []))
-                return (server_url, [])
-        except Exception as e:
-            logger.warning(f"Failed to get models from {server_url}: {e}")
-            return (server_url, [])
-    
-    # Fetch from all servers in parallel
-    tasks = [fetch_models_from_server(server.url) for server in healthy_servers]
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-    
-    # Process results
-    for result in results:
-        if isinstance(result, Exception):
-            continue
-        if not result:
-            continue
-            
-        server_url, server_models = result
+    return {"model": request.model, "embeddings": embeddings, **stats}, server_url
+
+async def proxy_embedding(request, user: User, db: AsyncSession, path: str, endpoint: str) -> Response:
+    """Proxy an embedding request, batching single inputs to /api/embed"""
+    
+    # Check rate limit
+    await rate_limiter.check_rate_limit(user, db)
+    
+    start_time = time.time()
+    server_url = None
+    prompt_tokens = len(request.prompt.split())
+    
+    try:
+        if path == "/api/embed" and embedding_cache.enabled:
+            result, server_url = await embed_with_cache(request)
+            content = jsonutil.dumps(result)
+        elif path == "/api/embed" and len(request.inputs) == 1 and embed_batcher.enabled:
+            result, server_url = await embed_batcher.embed(request.model, request.fields, request.inputs[0])
+            content = jsonutil.dumps(result)
+        else:
+            response, server_url = await load_balancer.proxy_request(
+                method="POST",
+                path=path,
+                content=request.body,
+                model=request.model
+            )
+            content = response.content
         
-        # Add models with server info
-        for model in server_models:
-            model_name = model.get("name", "")
-            if model_name:
-                if model_name not in model_map:
-                    # First time seeing this model
-                    model_with_server = model.copy()
-                    model_with_server["server"] = server_url
-                    model_map[model_name] = model_with_server
-                    all_models.append(model_with_server)
-                else:
-                    # Model already exists, add server to available servers list
-                    existing = model_map[model_name]
-                    if "servers" not in existing:
-                        existing["servers"] = [existing.get("server", "")]
-                    if server_url not in existing["servers"]:
-                        existing["servers"].append(server_url)
-    
-    if not all_models:
+        duration_ms = int((time.time() - start_time) * 1000)
+        await log_usage(
+            db=db,
+            username=user.username,
+            model=request.model,
+            endpoint=endpoint,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=None,
+            duration_ms=duration_ms,
+            success=True,
+            error=None,
+            server_used=server_url or "cache",
+            prompt=request.prompt
+        )
+        
+        return Response(content=content, media_type="application/json")
+    
+    except Exception as e:
+        error_msg = str(e)
+        duration_ms = int((time.time() - start_time) * 1000)
+        
+        # Log failed request
+        await log_usage(
+            db=db,
+            username=user.username,
+            model=request.model,
+            endpoint=endpoint,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=None,
+            duration_ms=duration_ms,
+            success=False,
+            error=error_msg,
+            server_used=server_url,
+            prompt=request.prompt
+        )
+        
+        raise backend_error(e)
+
+@app.post("/api/embed", openapi_extra=request_body_schema(OllamaEmbedRequest))
+async def embed(
+    http_request: Request,
+    user: User = Depends(verify_api_key),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Generate embeddings for one or more inputs
+    
+    Concurrent single-input requests for the same model are sent to the
+    backend together as one batch.
+    """
+    request = parse_embed(await http_request.body())
+    return await proxy_embedding(request, user, db, "/api/embed", "embed")
+
+@app.post("/api/embeddings", openapi_extra=request_body_schema(OllamaEmbeddingsRequest))
+async def embeddings(
+    http_request: Request,
+    user: User = Depends(verify_api_key),
+    db: AsyncSession = Depends(get_db)
+):
+    """Generate an embedding for a single prompt (legacy Ollama endpoint, not batched)"""
+    request = parse_embed(await http_request.body(), legacy=True)
+    return await proxy_embedding(request, user, db, "/api/embeddings", "embeddings")
+
+async def get_owned_job(job_id: str, user: User) -> BatchJob:
+    """A batch job visible to the user (their own, or any job for admins)"""
+    job = await batch.get_job(job_id)
+    if job is None or (job.username != user.username and user.role != UserRole.ADMIN):
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    return job
+
+@app.post("/batch")
+async def create_batch(file: UploadFile = File(...), user: User = Depends(verify_api_key)):
+    """
+    Submit a JSONL file of /api/generate and /api/chat requests for offline processing
+    
+    Each line: {"custom_id": "...", "url": "/api/chat", "body": {...}}.
+    Jobs run in the background at low priority; poll GET /batch/{id} for progress.
+    """
+    try:
+        job = await batch.create_job(user.username, file.filename, file.file)
+    except batch.BatchValidationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return batch.job_info(job)
+
+@app.get("/batch")
+async def list_batches(
+    all_users: bool = Query(False, description="All users' jobs (admin only)"),
+    limit: int = Query(100, ge=1, le=1000),
+    user: User = Depends(verify_api_key)
+):
+    """List your batch jobs, most recent first"""
+    if all_users and user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    jobs = await batch.list_jobs(None if all_users else user.username, limit)
+    return {"jobs": [batch.job_info(job) for job in jobs]}
+
+@app.get("/batch/{job_id}")
+async def get_batch(job_id: str, user: User = Depends(verify_api_key)):
+    """Get a batch job's progress and token usage so far"""
+    job = await get_owned_job(job_id, user)
+    return {**batch.job_info(job), "usage": await batch.job_usage(job.id)}
+
+@app.get("/batch/{job_id}/output")
+async def get_batch_output(job_id: str, user: User = Depends(verify_api_key)):
+    """
+    Download the results as JSONL, one line per finished request in completion order
+    (available while the job is still running)
+    """
+    job = await get_owned_job(job_id, user)
+    path = batch.output_path(job.id)
+    if not os.path.exists(path):
+        return Response(content=b"", media_type="application/x-ndjson")
+    return FileResponse(path, media_type="application/x-ndjson", filename=f"{job.id}.jsonl")
+
+@app.post("/batch/{job_id}/cancel")
+async def cancel_batch(job_id: str, user: User = Depends(verify_api_key)):
+    """Cancel a batch job; requests already in flight still finish"""
+    job = await get_owned_job(job_id, user)
+    status = await batch.cancel_job(job.id)
+    return {"id": job.id, "status": status}
+
+@app.get("/api/tags")
+async def list_models(request: Request):
+    """
+    List available models from all healthy servers
+    
+    Served from the in-memory catalogue kept up to date by the health checks.
+    Supports conditional requests via `ETag` / `If-None-Match`.
+    """
+    if load_balancer.model_catalog_etag is None:
+        # Nothing fetched yet (e.g. first request right after startup)
+        await load_balancer.refresh_model_catalog()
+    
+    if not load_balancer.model_catalog:
+        if not load_balancer.servers:
+            raise HTTPException(status_code=503, detail="No servers configured")
         raise HTTPException(status_code=503, detail="Failed to retrieve models from any server")
     
-    return {"models": all_models}
+    etag = load_balancer.model_catalog_etag
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if etag in candidates or "*" in candidates:
+            return Response(status_code=304, headers=headers)
+    
+    return Response(
+        content=load_balancer.model_catalog_body,
+        media_type="application/json",
+        headers=headers
+    )
+
+@app.post("/admin/models/refresh")
+async def refresh_models(admin: User = Depends(verify_admin)):
+    """Refresh the cached model catalogue from all servers now (admin only)"""
+    await load_balancer.refresh_model_catalog()
+    logger.info(f"Model catalogue refreshed by admin: {admin.username}")
+    return {
+        "models": len(load_balancer.model_catalog),
+        "etag": load_balancer.model_catalog_etag
+    }
+
+@app.get("/admin/servers")
+async def list_servers(admin: User = Depends(verify_admin)):
+    """Registered backend servers and their state in this worker (admin only)"""
+    return backend_registry.get_status()
+
+@app.post("/admin/servers", status_code=201)
+async def add_server(server_request: ServerCreate, admin: User = Depends(verify_admin)):
+    """
+    Add a backend server without a restart (admin only)
+    
+    It is checked (and its models listed) before this returns and takes
+    requests only once a check reaches it: `healthy` is false if it could not
+    be reached, and the regular health checks bring it in when it comes up.
+    The other workers pick it up within BACKENDS_WATCH_INTERVAL seconds.
+    """
+    try:
+        url = await backend_registry.add(server_request.url, server_request.weight, server_request.drain)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ServerExistsError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    logger.info(f"Server {url} added by admin: {admin.username}")
+    server = load_balancer.get_server(url)
+    if not server.is_healthy:
+        logger.warning(f"Added server {url} did not answer its health check; it takes no requests until it does")
+    return {"url": url, "healthy": server.is_healthy, "models": len(server.models or [])}
+
+@app.put("/admin/servers/weight")
+async def set_server_weight(weight_request: ServerWeightUpdate, admin: User = Depends(verify_admin)):
+    """
+    Fix a server's capacity weight, or return it to the learned weight with null (admin only)
+    
+    Applies to all models.
+    """
+    try:
+        url = await backend_registry.update(weight_request.url, weight=weight_request.weight)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UnknownServerError:
+        raise HTTPException(status_code=404, detail="Server not found")
+    logger.info(f"Weight of {url} set to {weight_request.weight or 'learned'} by admin: {admin.username}")
+    return {"url": url, "weight": load_balancer.capacity.weight(url)}
+
+@app.put("/admin/servers/drain")
+async def drain_server(drain_request: ServerDrainUpdate, admin: User = Depends(verify_admin)):
+    """
+    Stop sending new requests to a server, or put it back in rotation (admin only)
+    
+    Requests in flight finish. `in_flight` counts those of this worker; the
+    server is idle once GET /admin/servers shows 0 in every worker.
+    """
+    try:
+        url = await backend_registry.update(drain_request.url, drain=drain_request.drain)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UnknownServerError:
+        raise HTTPException(status_code=404, detail="Server not found")
+    logger.info(f"Server {url} {'drained' if drain_request.drain else 'undrained'} by admin: {admin.username}")
+    server = load_balancer.get_server(url)
+    return {"url": url, "drain": drain_request.drain, "in_flight": server.current_load if server else 0}
+
+@app.delete("/admin/servers")
+async def remove_server(
+    url: str = Query(..., description="URL of the server to remove"),
+    admin: User = Depends(verify_admin)
+):
+    """Remove a backend server; requests in flight on it finish first (admin only)"""
+    try:
+        url = await backend_registry.remove(url)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UnknownServerError:
+        raise HTTPException(status_code=404, detail="Server not found")
+    logger.info(f"Server {url} removed by admin: {admin.username}")
+    server = load_balancer.get_server(url)
+    return {"url": url, "in_flight": server.current_load if server else 0}
+
+@app.get("/admin/placement")
+async def get_placement(admin: User = Depends(verify_admin)):
+    """
+    Recommended model placement for the recent demand, and the last applied run (admin only)
+    
+    Nothing is changed; this is the dry run of POST /admin/placement/apply.
+    """
+    return {
+        "recommendation": await placement_controller.recommend(),
+        "last_run": placement_controller.last_run()
+    }
+
+@app.post("/admin/placement/apply", status_code=202)
+async def apply_placement(admin: User = Depends(verify_admin)):
+    """
+    Pull and delete models to move towards the recommended placement (admin only)
+    
+    Runs in the background with at most PLACEMENT_MAX_ACTIONS actions; follow
+    it with GET /admin/placement.
+    """
+    try:
+        run = await placement_controller.apply()
+    except PlacementBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except PlacementRateLimitedError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    logger.info(f"Admin {admin.username} applied model placement ({len(run['actions'])} actions)")
+    return run
 
 # ============================================================================
 # USAGE STATISTICS ENDPOINTS
@@ -823,20 +1473,103 @@ async def get_user_usage(
         logger.info(f"Admin {admin.username} queried usage for user {username} (period: {days} days, requests: {total_requests})")
         
         return response
-        
+    
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error getting usage for user {username}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+@app.get("/admin/search/usage")
+async def search_usage(
+    q: str = Query(..., min_length=1, description='FTS5 query, e.g. `"exact phrase"`, `token*`, `a AND NOT b`'),
+    username: Optional[str] = Query(None, description="Only requests from this user"),
+    model: Optional[str] = Query(None, description="Only requests for this model"),
+    since: Optional[datetime] = Query(None, description="Start of time range (ISO 8601, UTC if no offset)"),
+    until: Optional[datetime] = Query(None, description="End of time range (ISO 8601, UTC if no offset)"),
+    page: int = Query(1, ge=1, description="Page number (1-based)"),
+    page_size: int = Query(20, ge=1, le=200, description="Results per page (1-200)"),
+    db: AsyncSession = Depends(get_db),
+    admin: User = Depends(verify_admin)
+):
+    """
+    Full-text search over logged prompts and errors (admin only)
+    
+    Uses the SQLite FTS5 index maintained alongside `usage_logs`, so results are
+    ranked by relevance (bm25) and matched terms are marked with `[...]` in snippets.
+    """
+    if not is_sqlite():
+        raise HTTPException(status_code=501, detail="Usage search requires the SQLite backend")
+    
+    # Timestamps are stored as naive UTC
+    if since and since.tzinfo:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    if until and until.tzinfo:
+        until = until.astimezone(timezone.utc).replace(tzinfo=None)
+    
+    try:
+        total, rows = await search_usage_logs(
+            db,
+            query=q,
+            username=username,
+            model=model,
+            since=since,
+            until=until,
+            limit=page_size,
+            offset=(page - 1) * page_size
+        )
+    except OperationalError as e:
+        # FTS5 reports malformed queries as operational errors
+        raise HTTPException(status_code=400, detail=f"Invalid search query: {e.orig}")
+    
+    logger.info(f"Admin {admin.username} searched usage logs (query: {q!r}, matches: {total})")
+    
+    return {
+        "query": q,
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "results": [
+            {
+                "id": row["id"],
+                "timestamp": row["timestamp"].isoformat() if row["timestamp"] else None,
+                "username": row["username"],
+                "model": row["model"],
+                "endpoint": row["endpoint"],
+                "prompt_snippet": row["prompt_snippet"],
+                "error_snippet": row["error_snippet"],
+                "total_tokens": row["total_tokens"],
+                "duration_ms": row["duration_ms"],
+                "success": bool(row["success"]),
+                "server_used": row["server_used"],
+                "rank": row["rank"]
+            }
+            for row in rows
+        ]
+    }
+
 if __name__ == "__main__":
+    import os
+    import shutil
+    import tempfile
     import uvicorn
-    uvicorn.run(
-        "main:app",
-        host=settings.host,
-        port=settings.port,
-        workers=settings.workers,
-        reload=settings.reload,
-        log_level=settings.log_level.lower()
-    )
+    
+    # Workers are separate processes: share metrics through a directory
+    metrics_dir = None
+    if settings.enable_metrics and settings.workers > 1 and not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        metrics_dir = tempfile.mkdtemp(prefix="tokamak-metrics-")
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+    
+    try:
+        uvicorn.run(
+            "main:app",
+            host=settings.host,
+            port=settings.port,
+            workers=settings.workers,
+            reload=settings.reload,
+            log_level=settings.log_level.lower()
+        )
+    finally:
+        # Only remove the directory this run created
+        if metrics_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
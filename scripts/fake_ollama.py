@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Fake Ollama server for local testing
+
+Emulates the parts of the Ollama API the proxy uses, with models that take
+time to load and a VRAM budget, so routing, warm-up and placement can be
+tried without GPUs:
+
+    python scripts/fake_ollama.py --port 21434 --models llama3:8b,qwen2.5:32b --vram-gb 24
+    OLLAMA_SERVERS=http://localhost:21434,http://localhost:21435 python main.py
+
+- /api/tags, /api/ps, /api/version
+- /api/generate, /api/chat (streaming and not), /api/embed, /api/embeddings
+- /api/pull, /api/delete
+
+A model's size is guessed from its tag (`:32b` is about 19 GB). Loading it
+takes --load-seconds; loaded models are unloaded when their keep_alive ends
+or, least recently used first, when VRAM is needed.
+"""
+
+import argparse
+import asyncio
+import json
+import re
+import time
+from typing import Dict
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+parser = argparse.ArgumentParser(description="Fake Ollama server")
+parser.add_argument("--host", default="127.0.0.1")
+parser.add_argument("--port", type=int, default=11434)
+parser.add_argument("--models", default="llama3:8b,nomic-embed-text", help="Comma-separated installed models")
+parser.add_argument("--vram-gb", type=float, default=24.0, help="VRAM for loaded models")
+parser.add_argument("--load-seconds", type=float, default=2.0, help="Time to load a model")
+parser.add_argument("--token-seconds", type=float, default=0.02, help="Time per generated token")
+parser.add_argument("--pull-seconds", type=float, default=3.0, help="Time to pull a model")
+args = parser.parse_args()
+
+app = FastAPI(title="Fake Ollama")
+GB = 1_000_000_000
+WORDS = ["The", "quick", "brown", "fox", "jumps", "over", "the", "lazy", "dog."]
+
+def tag(model: str) -> str:
+    return model if ":" in model else f"{model}:latest"
+
+def model_size(model: str) -> int:
+    """Guess a quantized model's size from its parameter count"""
+    match = re.search(r":(\d+(?:\.\d+)?)b", model)
+    return int(float(match.group(1)) * 0.6 * GB) if match else int(0.5 * GB)
+
+installed: Dict[str, int] = {tag(m): model_size(tag(m)) for m in args.models.split(",") if m}
+loaded: Dict[str, float] = {}  # model -> keep-alive expiry
+last_used: Dict[str, float] = {}
+loading: Dict[str, asyncio.Task] = {}
+
+def keep_alive_seconds(value) -> float:
+    if value is None:
+        return 300.0
+    if isinstance(value, (int, float)):
+        return float(value) if value >= 0 else float("inf")
+    match = re.fullmatch(r"(-?\d+(?:\.\d+)?)([smh]?)", str(value))
+    if not match:
+        return 300.0
+    seconds = float(match.group(1)) * {"": 1, "s": 1, "m": 60, "h": 3600}[match.group(2)]
+    return seconds if seconds >= 0 else float("inf")
+
+def expire():
+    now = time.monotonic()
+    for model in [m for m, until in loaded.items() if until <= now]:
+        del loaded[model]
+
+async def ensure_loaded(model: str, keep_alive) -> bool:
+    """Load the model (evicting others if needed); False if it is not installed"""
+    model = tag(model)
+    if model not in installed:
+        return False
+    expire()
+    if model not in loaded:
+        if model not in loading:
+            loading[model] = asyncio.create_task(asyncio.sleep(args.load_seconds))
+        try:
+            await loading[model]
+        finally:
+            loading.pop(model, None)
+        while loaded and sum(installed.get(m, 0) for m in loaded) + installed[model] > args.vram_gb * GB:
+            del loaded[min(loaded, key=lambda m: last_used.get(m, 0))]
+    loaded[model] = time.monotonic() + keep_alive_seconds(keep_alive)
+    last_used[model] = time.monotonic()
+    return True
+
+def not_found(model: str) -> JSONResponse:
+    return JSONResponse({"error": f"model '{model}' not found, try pulling it first"}, status_code=404)
+
+def final_stats(start: float, tokens: int) -> dict:
+    return {
+        "done": True,
+        "done_reason": "stop",
+        "total_duration": int((time.monotonic() - start) * 1e9),
+        "prompt_eval_count": 8,
+        "eval_count": tokens,
+        "eval_duration": int(tokens * args.token_seconds * 1e9)
+    }
+
+async def generate_tokens(body: dict):
+    count = int((body.get("options") or {}).get("num_predict") or len(WORDS))
+    for i in range(count):
+        await asyncio.sleep(args.token_seconds)
+        yield WORDS[i % len(WORDS)] + " "
+
+@app.get("/api/version")
+async def version():
+    return {"version": "0.0.0-fake"}
+
+@app.get("/api/tags")
+async def tags():
+    return {"models": [{"name": m, "model": m, "size": size} for m, size in installed.items()]}
+
+@app.get("/api/ps")
+async def ps():
+    expire()
+    return {"models": [
+        {"name": m, "model": m, "size": installed.get(m, 0), "size_vram": installed.get(m, 0)}
+        for m in loaded
+    ]}
+
+async def respond(body: dict, path: str):
+    start = time.monotonic()
+    if not await ensure_loaded(body["model"], body.get("keep_alive")):
+        return not_found(body["model"])
+    chat = path == "/api/chat"
+    if not chat and not body.get("prompt"):
+        return {"model": body["model"], "response": "", "done": True, "done_reason": "load"}
+    
+    def piece(text: str) -> dict:
+        if chat:
+            return {"model": body["model"], "message": {"role": "assistant", "content": text}, "done": False}
+        return {"model": body["model"], "response": text, "done": False}
+    
+    if body.get("stream", True):
+        async def stream():
+            tokens = 0
+            async for text in generate_tokens(body):
+                tokens += 1
+                yield json.dumps(piece(text)) + "\n"
+            final = {**piece(""), **final_stats(start, tokens)}
+            yield json.dumps(final) + "\n"
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+    
+    text = "".join([t async for t in generate_tokens(body)])
+    result = {**piece(text), **final_stats(start, len(text.split()))}
+    if not chat:
+        result["context"] = [1, 2, 3]
+    return result
+
+@app.post("/api/generate")
+async def generate(request: Request):
+    return await respond(await request.json(), "/api/generate")
+
+@app.post("/api/chat")
+async def chat(request: Request):
+    return await respond(await request.json(), "/api/chat")
+
+@app.post("/api/embed")
+async def embed(request: Request):
+    body = await request.json()
+    if not await ensure_loaded(body["model"], body.get("keep_alive")):
+        return not_found(body["model"])
+    inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    return {
+        "model": body["model"],
+        "embeddings": [[float(len(t)), 1.0, 0.5] for t in inputs],
+        "total_duration": 1_000_000 * len(inputs),
+        "load_duration": 0,
+        "prompt_eval_count": sum(len(t.split()) for t in inputs)
+    }
+
+@app.post("/api/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    if not await ensure_loaded(body["model"], body.get("keep_alive")):
+        return not_found(body["model"])
+    return {"embedding": [float(len(body.get("prompt", ""))), 1.0, 0.5]}
+
+@app.post("/api/pull")
+async def pull(request: Request):
+    body = await request.json()
+    model = tag(body.get("model") or body.get("name"))
+    size = model_size(model)
+    
+    async def progress():
+        steps = 5
+        for step in range(1, steps + 1):
+            await asyncio.sleep(args.pull_seconds / steps)
+            yield json.dumps({"status": "pulling", "total": size, "completed": size * step // steps}) + "\n"
+        installed[model] = size
+        yield json.dumps({"status": "success"}) + "\n"
+    
+    if body.get("stream", True):
+        return StreamingResponse(progress(), media_type="application/x-ndjson")
+    async for _ in progress():
+        pass
+    return {"status": "success"}
+
+@app.delete("/api/delete")
+async def delete(request: Request):
+    body = await request.json()
+    model = tag(body.get("model") or body.get("name"))
+    if model not in installed:
+        return not_found(model)
+    del installed[model]
+    loaded.pop(model, None)
+    return JSONResponse({})
+
+if __name__ == "__main__":
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
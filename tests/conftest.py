@@ -0,0 +1,36 @@
+"""
+pytest configuration
+
+test_all_endpoints.py and test_client.py are manual scripts that need a
+running server and database; pytest only runs the unit tests.
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+collect_ignore = ["test_all_endpoints.py", "test_client.py"]
+
+@pytest.fixture
+def session_factory(tmp_path):
+    """Session factory for a fresh SQLite database with every table and the usage search index"""
+    from app import database
+    
+    # No pooling: each test drives the engine from its own asyncio.run loop
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}", poolclass=NullPool)
+    
+    async def init():
+        async with engine.begin() as conn:
+            await conn.run_sync(database.Base.metadata.create_all)
+            await conn.run_sync(database._init_usage_search)
+    
+    asyncio.run(init())
+    yield async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    asyncio.run(engine.dispose())
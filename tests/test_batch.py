@@ -0,0 +1,216 @@
+"""
+Tests for batch jobs: claiming, processing and cancellation
+"""
+
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+import asyncio
+import json
+import os
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import event, select
+from app import batch as batch_module
+from app.batch import (
+    BatchRunner, BatchValidationError, cancel_job, input_path, job_dir, output_path, validate_batch_file
+)
+from app.config import settings
+from app.database import APIKey, BatchJob, UsageLog
+
+class FakeBackend:
+    """Answers /api/generate with a fixed response, optionally holding requests"""
+    
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.release.set()
+        self.sent = []
+        self.cancelled = 0
+    
+    async def proxy_request(self, method, path, content, model, prefix=None):
+        self.sent.append(json.loads(content)["prompt"])
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        body = json.dumps({"model": model, "response": "two words", "done": True}).encode()
+        return SimpleNamespace(status_code=200, content=body), "http://a:11434"
+
+class FakeRateLimiter:
+    def __init__(self):
+        self.limited = False
+    
+    async def check_rate_limit(self, user, db):
+        if self.limited:
+            raise HTTPException(status_code=429, detail="Rate limit exceeded", headers={"Retry-After": "3600"})
+        return True
+
+@pytest.fixture
+def env(monkeypatch, tmp_path, session_factory):
+    monkeypatch.setattr(batch_module, "AsyncSessionLocal", session_factory)
+    monkeypatch.setattr(batch_module, "PROGRESS_INTERVAL", 0.05)
+    monkeypatch.setattr(settings, "batch_dir", str(tmp_path / "batches"))
+    monkeypatch.setattr(settings, "batch_concurrency", 2)
+    monkeypatch.setattr(settings, "batch_max_running_jobs", 1)
+    backend, limiter = FakeBackend(), FakeRateLimiter()
+    monkeypatch.setattr(batch_module, "load_balancer", backend)
+    monkeypatch.setattr(batch_module, "rate_limiter", limiter)
+    
+    async def add_owner():
+        async with session_factory() as db:
+            db.add(APIKey(api_key_hash="hash", username="alice", role="user"))
+            await db.commit()
+    asyncio.run(add_owner())
+    return SimpleNamespace(db=session_factory, backend=backend, limiter=limiter)
+
+async def add_job(env, job_id: str, prompts=(), status="queued", **values) -> BatchJob:
+    if prompts:
+        os.makedirs(job_dir(job_id), exist_ok=True)
+        with open(input_path(job_id), "w") as f:
+            for i, prompt in enumerate(prompts):
+                f.write(json.dumps({"custom_id": f"q{i}", "url": "/api/generate", "body": {"model": "m", "prompt": prompt}}) + "\n")
+    async with env.db() as db:
+        job = BatchJob(id=job_id, username="alice", status=status, total_requests=len(prompts), **values)
+        db.add(job)
+        await db.commit()
+        return job
+
+async def get_job(env, job_id: str) -> BatchJob:
+    async with env.db() as db:
+        return await db.get(BatchJob, job_id)
+
+def read_output(job_id: str) -> list:
+    try:
+        with open(output_path(job_id)) as f:
+            return [json.loads(line) for line in f]
+    except FileNotFoundError:
+        return []
+
+def test_validation_rejects_bad_lines(tmp_path):
+    path = tmp_path / "input.jsonl"
+    path.write_text(
+        '{"custom_id": "a", "url": "/api/generate", "body": {"model": "m"}}\n'
+        '{"custom_id": "a", "url": "/api/generate", "body": {"model": "m"}}\n'
+    )
+    
+    with pytest.raises(BatchValidationError, match="Line 2: duplicate custom_id"):
+        validate_batch_file(str(path))
+
+def test_claims_the_oldest_job_once(env):
+    now = datetime.now(timezone.utc)
+    
+    async def run():
+        await add_job(env, "batch_new", created_at=now)
+        await add_job(env, "batch_old", created_at=now - timedelta(minutes=1))
+        return await asyncio.gather(*(BatchRunner()._claim() for _ in range(4)))
+    
+    claimed = [job.id for job in asyncio.run(run()) if job is not None]
+    
+    # One job may run at a time: only one worker wins, and it gets the oldest
+    assert claimed == ["batch_old"]
+
+def test_claim_counts_jobs_started_meanwhile(env):
+    engine = env.db.kw["bind"].sync_engine
+    started = []
+    
+    def other_worker_starts_a_job(conn, cursor, statement, parameters, context, executemany):
+        # Between this worker picking batch_a and claiming it, another one starts batch_b
+        if statement.startswith("UPDATE batch_jobs") and not started:
+            started.append(True)
+            cursor.execute(
+                "UPDATE batch_jobs SET status = 'running', heartbeat_at = ? WHERE id = 'batch_b'",
+                (datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f"),)
+            )
+    
+    async def run():
+        now = datetime.now(timezone.utc)
+        await add_job(env, "batch_a", created_at=now - timedelta(minutes=1))
+        await add_job(env, "batch_b", created_at=now)
+        event.listen(engine, "before_cursor_execute", other_worker_starts_a_job)
+        try:
+            return await BatchRunner()._claim(), await get_job(env, "batch_a")
+        finally:
+            event.remove(engine, "before_cursor_execute", other_worker_starts_a_job)
+    
+    claimed, job = asyncio.run(run())
+    
+    assert started
+    
+    assert claimed is None
+    assert job.status == "queued"
+
+def test_stale_running_jobs_are_taken_over(env):
+    stale = datetime.now(timezone.utc) - timedelta(seconds=batch_module.HEARTBEAT_TIMEOUT + 1)
+    
+    async def run():
+        await add_job(env, "batch_orphan", status="running", heartbeat_at=stale, owner_pid=1)
+        job = await BatchRunner()._claim()
+        return job, await BatchRunner()._claim()
+    
+    job, second = asyncio.run(run())
+    
+    assert job.id == "batch_orphan"
+    assert job.status == "running"
+    assert second is None
+
+def test_processes_a_job(env):
+    async def run():
+        job = await add_job(env, "batch_1", ["one", "two", "three"], status="running")
+        await BatchRunner()._process(job)
+        async with env.db() as db:
+            logs = (await db.execute(select(UsageLog))).scalars().all()
+        return await get_job(env, "batch_1"), logs
+    
+    job, logs = asyncio.run(run())
+    
+    assert (job.status, job.completed_requests, job.failed_requests) == ("completed", 3, 0)
+    results = read_output("batch_1")
+    assert sorted(result["custom_id"] for result in results) == ["q0", "q1", "q2"]
+    assert results[0]["response"]["response"] == "two words"
+    assert {(log.batch_id, log.endpoint, log.completion_tokens) for log in logs} == {("batch_1", "batch/generate", 2)}
+
+def test_cancel_drops_requests_waiting_on_the_rate_limit(env):
+    env.limiter.limited = True
+    
+    async def run():
+        job = await add_job(env, "batch_1", ["one", "two", "three", "four"], status="running")
+        processing = asyncio.create_task(BatchRunner()._process(job))
+        await asyncio.sleep(0.1)
+        assert await cancel_job("batch_1") == "cancelling"
+        await asyncio.wait_for(processing, timeout=5)
+        return await get_job(env, "batch_1")
+    
+    job = asyncio.run(run())
+    
+    assert (job.status, job.completed_requests, job.failed_requests) == ("cancelled", 0, 0)
+    assert read_output("batch_1") == []
+    assert env.backend.sent == []
+
+def test_cancelling_a_queued_job(env):
+    async def run():
+        await add_job(env, "batch_1", ["one"])
+        return await cancel_job("batch_1"), await get_job(env, "batch_1")
+    
+    status, job = asyncio.run(run())
+    
+    assert status == job.status == "cancelled"
+    assert job.completed_at is not None
+
+def test_shutdown_requeues_the_job_and_awaits_its_requests(env):
+    env.backend.release.clear()
+    
+    async def run():
+        job = await add_job(env, "batch_1", ["one", "two", "three"], status="running")
+        processing = asyncio.create_task(BatchRunner()._process(job))
+        while len(env.backend.sent) < 2:
+            await asyncio.sleep(0.01)
+        processing.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await processing
+        return await get_job(env, "batch_1")
+    
+    job = asyncio.run(run())
+    
+    assert job.status == "queued"
+    assert env.backend.cancelled == 2  # Both requests in flight were cancelled and awaited
+    assert read_output("batch_1") == []
@@ -0,0 +1,69 @@
+"""
+Tests for backend capacity weights
+"""
+
+import pytest
+from app.capacity import CapacityEstimator, MAX_WEIGHT, MIN_SAMPLES, generation_stats
+from app.config import settings
+
+MODEL = "llama3:8b"
+FAST, SLOW, MEDIUM = "http://fast:11434", "http://slow:11434", "http://medium:11434"
+
+@pytest.fixture
+def capacity(monkeypatch):
+    monkeypatch.setattr(settings, "capacity_weighting", True)
+    monkeypatch.setattr(settings, "backend_weights", {})
+    return CapacityEstimator()
+
+def record(capacity: CapacityEstimator, url: str, tokens_per_second: float, samples: int = MIN_SAMPLES):
+    for _ in range(samples):
+        capacity.record(url, MODEL, eval_count=100, eval_duration_ns=int(100 / tokens_per_second * 1e9), concurrency=1)
+
+def test_generation_stats_from_the_final_line():
+    tail = b'"done":true,"total_duration":900,"eval_count":42,"eval_duration":2000000000}\n'
+    assert generation_stats(tail) == (42, 2000000000)
+    assert generation_stats(b'{"response":"partial"}') is None
+
+def test_weights_are_relative_to_the_median(capacity):
+    record(capacity, FAST, 100)
+    record(capacity, MEDIUM, 50)
+    record(capacity, SLOW, 25)
+    assert capacity.weight(FAST, MODEL) == pytest.approx(2.0)
+    assert capacity.weight(MEDIUM, MODEL) == pytest.approx(1.0)
+    assert capacity.weight(SLOW, MODEL) == pytest.approx(0.5)
+    assert capacity.weight(FAST, "other:model") == 1.0
+
+def test_weight_needs_samples_and_peers(capacity):
+    record(capacity, FAST, 100, samples=MIN_SAMPLES - 1)
+    record(capacity, SLOW, 25)
+    assert capacity.weight(FAST, MODEL) == 1.0
+    assert capacity.weight(SLOW, MODEL) == 1.0  # No peer to compare with yet
+
+def test_weights_are_clamped(capacity):
+    record(capacity, FAST, 10000)
+    record(capacity, SLOW, 1)
+    record(capacity, MEDIUM, 50)
+    assert capacity.weight(FAST, MODEL) == MAX_WEIGHT
+
+def test_overrides_replace_learned_weights(capacity, monkeypatch):
+    record(capacity, FAST, 100)
+    record(capacity, SLOW, 25)
+    monkeypatch.setattr(settings, "backend_weights", {SLOW: 3.0})
+    assert capacity.weight(SLOW, MODEL) == 3.0
+    capacity.set_weights({SLOW: 5.0})  # The registry wins over BACKEND_WEIGHTS
+    assert capacity.weight(SLOW, MODEL) == 5.0
+
+def test_disabled_weighting_keeps_overrides_only(capacity, monkeypatch):
+    record(capacity, FAST, 100)
+    record(capacity, SLOW, 25)
+    monkeypatch.setattr(settings, "capacity_weighting", False)
+    capacity.set_weights({SLOW: 2.0})
+    assert capacity.weight(FAST, MODEL) == 1.0
+    assert capacity.weight(SLOW, MODEL) == 2.0
+
+def test_forget_drops_a_removed_backend(capacity):
+    record(capacity, FAST, 100)
+    record(capacity, SLOW, 25)
+    capacity.forget(FAST)
+    assert FAST not in capacity.get_status()["models"][MODEL]
+    assert capacity.weight(SLOW, MODEL) == 1.0
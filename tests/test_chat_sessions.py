@@ -0,0 +1,103 @@
+"""
+Tests for server-side chat sessions
+"""
+
+from datetime import datetime, timedelta, timezone
+import asyncio
+import json
+import pytest
+from sqlalchemy import update
+from app import chat_sessions as chat_sessions_module
+from app.chat_sessions import AssistantTranscript, ChatSessionStore, session_messages
+from app.config import settings
+from app.database import ChatSession
+from app.passthrough import parse_chat
+
+SYSTEM = {"role": "system", "content": "Be brief"}
+
+def user(text: str) -> dict:
+    return {"role": "user", "content": text}
+
+def assistant(text: str) -> dict:
+    return {"role": "assistant", "content": text}
+
+@pytest.fixture
+def store(monkeypatch, session_factory):
+    monkeypatch.setattr(chat_sessions_module, "AsyncSessionLocal", session_factory)
+    return ChatSessionStore()
+
+def test_turns_are_appended_to_the_history(store):
+    async def run():
+        session = await store.create("alice", messages=[SYSTEM])
+        await store.append(session.id, [user("Hi"), assistant("Hello")], "llama3:8b", "http://a:11434")
+        await store.append(session.id, [user("Bye"), assistant("Goodbye")], "llama3:8b", "http://b:11434")
+        return await store.get(session.id, "alice"), await store.get(session.id, "bob")
+    
+    session, other_user = asyncio.run(run())
+    
+    assert session_messages(session) == [SYSTEM, user("Hi"), assistant("Hello"), user("Bye"), assistant("Goodbye")]
+    assert session.message_count == 5
+    assert session.server_url == "http://b:11434"
+    assert other_user is None
+
+def test_history_is_trimmed_keeping_system_messages(monkeypatch, store):
+    monkeypatch.setattr(settings, "chat_session_max_messages", 8)
+    
+    async def run():
+        session = await store.create("alice", messages=[SYSTEM])
+        for turn in range(5):
+            await store.append(session.id, [user(f"q{turn}"), assistant(f"a{turn}")], "llama3:8b", None)
+        return await store.get(session.id, "alice")
+    
+    session = asyncio.run(run())
+    messages = session_messages(session)
+    
+    # The fourth turn went over the cap of 8 and cut the history to 3/4 of it
+    # (system prompt first); the fifth fits again
+    assert messages == [SYSTEM, assistant("a1"), user("q2"), assistant("a2"), user("q3"), assistant("a3"), user("q4"), assistant("a4")]
+    assert session.message_count == 8
+
+def test_expired_sessions_are_hidden(store, session_factory):
+    async def run():
+        session = await store.create("alice")
+        async with session_factory() as db:
+            await db.execute(update(ChatSession).values(
+                updated_at=datetime.now(timezone.utc) - timedelta(seconds=settings.chat_session_ttl + 1)
+            ))
+            await db.commit()
+        return await store.get(session.id, "alice"), await store.list_sessions("alice")
+    
+    assert asyncio.run(run()) == (None, [])
+
+def test_history_is_spliced_before_the_new_messages(monkeypatch, store):
+    monkeypatch.setattr(settings, "proxy_passthrough", True)
+    
+    async def run():
+        session = await store.create("alice", messages=[SYSTEM])
+        await store.append(session.id, [user("Hi"), assistant("Hello")], "llama3:8b", None)
+        return await store.get(session.id, "alice")
+    
+    session = asyncio.run(run())
+    payload = parse_chat(json.dumps({"model": "llama3:8b", "messages": [user("More")], "session_id": session.id}).encode())
+    payload.prepend_history(session.messages)
+    
+    assert json.loads(payload.body) == {
+        "model": "llama3:8b",
+        "stream": False,
+        "messages": [SYSTEM, user("Hi"), assistant("Hello"), user("More")]
+    }
+
+def test_transcript_collects_a_streamed_reply():
+    transcript = AssistantTranscript()
+    stream = (
+        b'{"message": {"role": "assistant", "content": "Hel"}}\n{"message": {"content": "lo"}}\n'
+        b'{"message": {"content": "", "tool_calls": [{"function": {"name": "f"}}]}}\n{"done": true}'
+    )
+    for start in range(0, len(stream), 7):
+        transcript.feed(stream[start:start + 7])
+    
+    assert transcript.message() == {
+        "role": "assistant",
+        "content": "Hello",
+        "tool_calls": [{"function": {"name": "f"}}]
+    }
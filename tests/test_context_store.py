@@ -0,0 +1,77 @@
+"""
+Tests for server-side /api/generate context handles
+"""
+
+from datetime import datetime, timedelta, timezone
+import asyncio
+import pytest
+from sqlalchemy import func, select, update
+from app import context_store as context_store_module
+from app.config import settings
+from app.context_store import ContextStore, HANDLE_PREFIX
+from app.database import ContextHandle
+
+@pytest.fixture
+def store(monkeypatch, session_factory):
+    monkeypatch.setattr(context_store_module, "AsyncSessionLocal", session_factory)
+    return ContextStore()
+
+def test_saved_context_loads_for_its_owner(store):
+    async def run():
+        handle = await store.save("alice", "llama3:8b", "http://a:11434", [1, 2, 3])
+        store._cache.clear()  # Read it back from the database
+        return handle, await store.load(handle, "alice"), await store.load(handle, "bob")
+    
+    handle, stored, other_user = asyncio.run(run())
+    
+    assert handle.startswith(HANDLE_PREFIX)
+    assert stored.context == b"[1,2,3]"
+    assert (stored.model, stored.server_url) == ("llama3:8b", "http://a:11434")
+    assert other_user is None
+
+def test_unknown_and_expired_handles(store, session_factory):
+    async def run():
+        handle = await store.save("alice", "llama3:8b", None, [1])
+        async with session_factory() as db:
+            await db.execute(update(ContextHandle).values(
+                created_at=datetime.now(timezone.utc) - timedelta(seconds=settings.context_handle_ttl + 1)
+            ))
+            await db.commit()
+        store._cache.clear()
+        return await store.load(handle, "alice"), await store.load(HANDLE_PREFIX + "unknown", "alice")
+    
+    assert asyncio.run(run()) == (None, None)
+
+def test_oldest_contexts_are_evicted_beyond_the_limit(monkeypatch, store, session_factory):
+    monkeypatch.setattr(settings, "context_handle_max_entries", 2)
+    monkeypatch.setattr(context_store_module, "EVICT_EVERY", 1)
+    
+    async def run():
+        handles = []
+        for i in range(4):
+            handles.append(await store.save("alice", "llama3:8b", None, [i]))
+            async with session_factory() as db:
+                # Distinct creation times, oldest first
+                await db.execute(update(ContextHandle).where(ContextHandle.handle == handles[-1]).values(
+                    created_at=datetime.now(timezone.utc) - timedelta(seconds=10 - i)
+                ))
+                await db.commit()
+        async with session_factory() as db:
+            kept = set((await db.execute(select(ContextHandle.handle))).scalars())
+            count = (await db.execute(select(func.count()).select_from(ContextHandle))).scalar_one()
+        return handles, kept, count
+    
+    handles, kept, count = asyncio.run(run())
+    
+    assert count == 2
+    assert kept == set(handles[2:])
+
+def test_memory_cache_is_bounded(monkeypatch, store):
+    monkeypatch.setattr(settings, "context_handle_cache_size", 2)
+    
+    async def run():
+        return [await store.save("alice", "llama3:8b", None, [i]) for i in range(3)]
+    
+    handles = asyncio.run(run())
+    
+    assert list(store._cache) == handles[1:]
@@ -0,0 +1,119 @@
+"""
+Tests for /api/embed micro-batching
+"""
+
+from types import SimpleNamespace
+import asyncio
+import json
+import pytest
+from app import embed_batcher as embed_batcher_module
+from app.config import settings
+from app.embed_batcher import EmbeddingBatcher, ZERO_EMBED_STATS
+from app.scheduler import current_lane, set_lane
+
+MODEL = "nomic-embed-text"
+
+class FakeBackend:
+    """Stands in for the load balancer: embeds each input as [len(input)]"""
+    
+    def __init__(self):
+        self.calls = []
+        self.release = asyncio.Event()
+        self.release.set()
+        self.fail = None
+    
+    async def proxy_request(self, method, path, content, model):
+        body = json.loads(content)
+        self.calls.append((body, current_lane()))
+        await self.release.wait()
+        if self.fail:
+            raise self.fail
+        result = {"model": model, "embeddings": [[len(text)] for text in body["input"]], "total_duration": 9}
+        return SimpleNamespace(content=json.dumps(result).encode()), "http://a:11434"
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = FakeBackend()
+    monkeypatch.setattr(embed_batcher_module, "load_balancer", backend)
+    monkeypatch.setattr(settings, "embed_batch_window_ms", 5)
+    monkeypatch.setattr(settings, "embed_batch_max_size", 64)
+    return backend
+
+def test_concurrent_inputs_share_one_backend_call(backend):
+    batcher = EmbeddingBatcher()
+    
+    async def run():
+        return await asyncio.gather(*(batcher.embed(MODEL, {"model": MODEL}, "x" * n) for n in (1, 2, 3)))
+    
+    results = asyncio.run(run())
+    
+    assert [body["input"] for body, _ in backend.calls] == [["x", "xx", "xxx"]]
+    assert [result for result, _ in results] == [
+        {"model": MODEL, "embeddings": [[n]], **ZERO_EMBED_STATS} for n in (1, 2, 3)
+    ]
+    assert {server for _, server in results} == {"http://a:11434"}
+
+def test_options_and_lanes_batch_separately(backend):
+    batcher = EmbeddingBatcher()
+    
+    async def embed(fields: dict, lane: str):
+        set_lane(lane)
+        return await batcher.embed(MODEL, fields, "text")
+    
+    async def run():
+        await asyncio.gather(
+            embed({"model": MODEL}, "interactive"),
+            embed({"model": MODEL}, "interactive"),
+            embed({"model": MODEL, "truncate": False}, "interactive"),
+            embed({"model": MODEL}, "bulk")
+        )
+    
+    asyncio.run(run())
+    
+    batches = {(len(body["input"]), "truncate" in body, lane) for body, lane in backend.calls}
+    assert batches == {(2, False, "interactive"), (1, True, "interactive"), (1, False, "bulk")}
+
+def test_full_batch_is_sent_without_waiting(monkeypatch, backend):
+    monkeypatch.setattr(settings, "embed_batch_window_ms", 60_000)
+    monkeypatch.setattr(settings, "embed_batch_max_size", 2)
+    batcher = EmbeddingBatcher()
+    
+    async def run():
+        return await asyncio.wait_for(
+            asyncio.gather(batcher.embed(MODEL, {"model": MODEL}, "a"), batcher.embed(MODEL, {"model": MODEL}, "b")),
+            timeout=5
+        )
+    
+    asyncio.run(run())
+    
+    assert len(backend.calls) == 1
+
+def test_backend_errors_reach_every_caller(backend):
+    backend.fail = RuntimeError("backend down")
+    batcher = EmbeddingBatcher()
+    
+    async def run():
+        return await asyncio.gather(
+            batcher.embed(MODEL, {"model": MODEL}, "a"),
+            batcher.embed(MODEL, {"model": MODEL}, "b"),
+            return_exceptions=True
+        )
+    
+    results = asyncio.run(run())
+    
+    assert [str(result) for result in results] == ["backend down", "backend down"]
+
+def test_batches_in_flight_are_kept_referenced(backend):
+    batcher = EmbeddingBatcher()
+    backend.release.clear()
+    
+    async def run():
+        caller = asyncio.ensure_future(batcher.embed(MODEL, {"model": MODEL}, "a"))
+        while not backend.calls:
+            await asyncio.sleep(0.001)
+        in_flight = len(batcher._sending)
+        backend.release.set()
+        await caller
+        return in_flight, len(batcher._sending)
+    
+    assert asyncio.run(run()) == (1, 0)
@@ -0,0 +1,94 @@
+"""
+Tests for the memory-mapped embedding cache
+"""
+
+import asyncio
+import pytest
+from app import embed_cache as embed_cache_module
+from app.config import settings
+from app.embed_cache import EmbeddingCache, WAYS
+
+np = pytest.importorskip("numpy")
+
+MODEL = "nomic-embed-text"
+FIELDS = {"model": MODEL}
+
+@pytest.fixture
+def cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "embed_cache_dir", str(tmp_path))
+    monkeypatch.setattr(settings, "embed_cache_max_entries", WAYS)  # A single set
+    return tmp_path
+
+def lookup(cache: EmbeddingCache, texts, fields=FIELDS):
+    return asyncio.run(cache.lookup(MODEL, fields, texts))
+
+def test_stored_vectors_are_found(cache_dir):
+    cache = EmbeddingCache()
+    cache.store(MODEL, FIELDS, ["a", "b"], [[1.0, 2.0], [3.0, 4.0]])
+    
+    assert lookup(cache, ["b", "a", "c"]) == [[3.0, 4.0], [1.0, 2.0], None]
+    # Options that change the vectors are part of the key
+    assert lookup(cache, ["a"], {"model": MODEL, "truncate": False}) == [None]
+    assert cache.get_status()["models"] == {MODEL: 2}
+
+def test_other_workers_map_read_only(cache_dir):
+    writer, reader = EmbeddingCache(), EmbeddingCache()
+    assert lookup(reader, ["a"]) == [None]
+    
+    writer.store(MODEL, FIELDS, ["a"], [[1.0, 2.0]])
+    # The missing files are only looked for again after a while
+    assert lookup(reader, ["a"]) == [None]
+    reader._model(MODEL).retry_open_at = 0
+    assert lookup(reader, ["a"]) == [[1.0, 2.0]]
+    
+    model_cache = reader._model(MODEL)
+    assert (model_cache.index.mode, model_cache.vectors.mode) == ("r", "r")
+    assert model_cache._writable is None
+
+def test_slot_being_rewritten_is_a_miss(cache_dir):
+    cache = EmbeddingCache()
+    cache.store(MODEL, FIELDS, ["a"], [[1.0, 2.0]])
+    model_cache = cache._model(MODEL)
+    index = model_cache._writable[0]
+    slot = int(np.flatnonzero(index["key"][:, 1])[0])
+    
+    index["version"][slot] += 1  # Odd: a writer is in the middle of it
+    assert lookup(cache, ["a"]) == [None]
+    index["version"][slot] += 1
+    assert lookup(cache, ["a"]) == [[1.0, 2.0]]
+
+def test_slot_rewritten_while_copying_is_a_miss(cache_dir):
+    cache = EmbeddingCache()
+    cache.store(MODEL, FIELDS, ["a"], [[1.0, 2.0]])
+    model_cache = cache._model(MODEL)
+    index = model_cache._writable[0]
+    vectors = model_cache.vectors
+    
+    class RacingVectors:
+        """A writer replaces the slot while the reader copies the vector"""
+        def __getitem__(self, slot):
+            index["version"][slot] += 2
+            return vectors[slot]
+    
+    model_cache.vectors = RacingVectors()
+    assert lookup(cache, ["a"]) == [None]
+    model_cache.vectors = vectors
+    assert lookup(cache, ["a"]) == [[1.0, 2.0]]
+
+def test_clock_eviction_spares_recent_hits(cache_dir):
+    cache = EmbeddingCache()
+    old = [f"t{i}" for i in range(WAYS)]
+    cache.store(MODEL, FIELDS, old, [[float(i)] for i in range(WAYS)])
+    cache._model(MODEL)._writable[2][:] = 0  # Nothing used recently
+    lookup(cache, ["t3"])  # Marked as used on this worker's next insert
+    
+    for i in range(4):
+        cache.store(MODEL, FIELDS, [f"n{i}"], [[100.0 + i]])
+    
+    kept = [text for text, vector in zip(old, lookup(cache, old)) if vector is not None]
+    assert kept == ["t3", "t5", "t6", "t7"]
+
+def test_disabled_without_numpy(monkeypatch, cache_dir):
+    monkeypatch.setattr(embed_cache_module, "np", None)
+    
+    assert EmbeddingCache().enabled is False
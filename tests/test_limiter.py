@@ -0,0 +1,80 @@
+"""
+Tests for the adaptive concurrency limiter
+"""
+
+import pytest
+from app.config import settings
+from app.limiter import AdaptiveLimiter, OverloadedError
+
+MODEL = "llama3:8b"
+
+@pytest.fixture
+def limiter(monkeypatch):
+    monkeypatch.setattr(settings, "adaptive_concurrency", True)
+    monkeypatch.setattr(settings, "adaptive_initial_limit", 10)
+    monkeypatch.setattr(settings, "adaptive_min_limit", 2)
+    monkeypatch.setattr(settings, "adaptive_max_limit", 200)
+    monkeypatch.setattr(settings, "adaptive_tolerance", 2.0)
+    monkeypatch.setattr(settings, "priority_reserved_fraction", 0.25)
+    return AdaptiveLimiter()
+
+def run_requests(limiter: AdaptiveLimiter, rtt: float, rounds: int, lane: str = "interactive"):
+    """Rounds of requests that fill the current limit and then finish with `rtt`"""
+    for _ in range(rounds):
+        count = int(limiter._model(MODEL).limit)
+        for _ in range(count):
+            limiter.acquire(MODEL, lane)
+        for _ in range(count):
+            limiter.release(MODEL, rtt=rtt)
+
+def limit(limiter: AdaptiveLimiter) -> float:
+    return limiter.get_status()["models"][MODEL]["limit"]
+
+def test_limit_grows_while_latency_is_steady(limiter):
+    run_requests(limiter, 0.1, 5)
+    assert limit(limiter) > 10
+
+def test_limit_stays_put_when_unused(limiter):
+    for _ in range(50):
+        limiter.acquire(MODEL, "interactive")
+        limiter.release(MODEL, rtt=0.1)
+    assert limit(limiter) == 10
+
+def test_limit_shrinks_when_latency_rises(limiter):
+    run_requests(limiter, 0.1, 5)
+    grown = limit(limiter)
+    run_requests(limiter, 1.0, 5)
+    assert limit(limiter) < grown
+
+def test_limit_never_leaves_its_bounds(limiter):
+    run_requests(limiter, 0.1, 100)
+    assert limit(limiter) == 200
+    run_requests(limiter, 10.0, 100)
+    assert limit(limiter) >= 2
+
+def test_failures_shrink_the_limit(limiter):
+    limiter.acquire(MODEL, "interactive")
+    limiter.release(MODEL, failed=True)
+    assert limit(limiter) == 9
+
+def test_requests_over_the_limit_are_shed(limiter):
+    for _ in range(10):
+        limiter.acquire(MODEL, "interactive")
+    with pytest.raises(OverloadedError) as shed:
+        limiter.acquire(MODEL, "interactive")
+    assert shed.value.retry_after >= 1
+    limiter.acquire(MODEL, "admin")  # Never shed
+    assert limiter.get_status()["models"][MODEL]["shed"] == 1
+
+def test_bulk_is_shed_before_the_reserved_share(limiter):
+    for _ in range(7):
+        limiter.acquire(MODEL, "bulk")
+    with pytest.raises(OverloadedError):
+        limiter.acquire(MODEL, "bulk")  # int(10 * 0.75) = 7
+    limiter.acquire(MODEL, "interactive")
+
+def test_disabled_limiter_only_counts(limiter, monkeypatch):
+    monkeypatch.setattr(settings, "adaptive_concurrency", False)
+    for _ in range(50):
+        limiter.acquire(MODEL, "interactive")
+    assert limiter.get_status()["models"][MODEL]["in_flight"] == 50
@@ -0,0 +1,70 @@
+"""
+Tests for the cached /api/tags catalogue and its conditional requests
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+import main
+from app.load_balancer import LoadBalancer, ServerStatus
+
+def server(url: str, *models: str) -> ServerStatus:
+    status = ServerStatus(url)
+    status.models = [{"name": name, "size": 1} for name in models]
+    return status
+
+@pytest.fixture
+def balancer(monkeypatch):
+    balancer = LoadBalancer()
+    balancer.servers = [server("http://a:11434", "llama3:8b"), server("http://b:11434", "llama3:8b", "qwen3:8b")]
+    balancer._rebuild_model_catalog()
+    monkeypatch.setattr(main, "load_balancer", balancer)
+    return balancer
+
+@pytest.fixture
+def client():
+    # No lifespan: the tests provide the load balancer state themselves
+    return TestClient(main.app)
+
+def test_serves_merged_catalogue_with_etag(balancer, client):
+    response = client.get("/api/tags")
+    
+    assert response.status_code == 200
+    assert response.headers["etag"] == balancer.model_catalog_etag
+    assert response.headers["cache-control"] == "no-cache"
+    models = {model["name"]: model for model in response.json()["models"]}
+    assert models["llama3:8b"]["servers"] == ["http://a:11434", "http://b:11434"]
+    assert models["qwen3:8b"]["server"] == "http://b:11434"
+
+@pytest.mark.parametrize("header", ["{etag}", "W/{etag}", '"other", {etag}', "*"])
+def test_not_modified_when_etag_matches(balancer, client, header):
+    response = client.get("/api/tags", headers={"If-None-Match": header.format(etag=balancer.model_catalog_etag)})
+    
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == balancer.model_catalog_etag
+
+def test_etag_changes_only_with_the_catalogue(balancer, client):
+    etag = balancer.model_catalog_etag
+    balancer._rebuild_model_catalog()
+    assert balancer.model_catalog_etag == etag
+    
+    balancer.servers[0].models.append({"name": "mistral:7b", "size": 1})
+    balancer._rebuild_model_catalog()
+    assert balancer.model_catalog_etag != etag
+    
+    response = client.get("/api/tags", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert "mistral:7b" in {model["name"] for model in response.json()["models"]}
+
+def test_unavailable_servers_are_left_out(balancer, client):
+    balancer.servers[1].is_healthy = False
+    balancer._rebuild_model_catalog()
+    
+    assert [model["name"] for model in client.get("/api/tags").json()["models"]] == ["llama3:8b"]
+
+def test_no_servers(monkeypatch, client):
+    balancer = LoadBalancer()
+    balancer.servers = []
+    monkeypatch.setattr(main, "load_balancer", balancer)
+    
+    assert client.get("/api/tags").status_code == 503
@@ -0,0 +1,104 @@
+"""
+Tests for latency outlier ejection
+"""
+
+from types import SimpleNamespace
+import asyncio
+import httpx
+import pytest
+from app import outliers as outliers_module
+from app.config import settings
+from app.load_balancer import LoadBalancer, ServerStatus
+from app.outliers import MIN_SAMPLES, OutlierDetector
+
+MODEL = "llama3:8b"
+A, B, C = "http://a:11434", "http://b:11434", "http://c:11434"
+
+@pytest.fixture
+def clock(monkeypatch):
+    monkeypatch.setattr(settings, "outlier_ejection", True)
+    monkeypatch.setattr(settings, "outlier_latency_factor", 3.0)
+    monkeypatch.setattr(settings, "outlier_ejection_seconds", 30)
+    monkeypatch.setattr(settings, "outlier_max_ejection_percent", 50)
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(outliers_module, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+def feed(detector: OutlierDetector, latencies: dict, samples: int = MIN_SAMPLES):
+    for _ in range(samples):
+        for server_url, latency in latencies.items():
+            detector.record(server_url, MODEL, latency)
+
+def test_slow_backend_is_ejected_for_its_model(clock):
+    detector = OutlierDetector()
+    feed(detector, {A: 0.2, B: 0.25, C: 2.0}, samples=MIN_SAMPLES - 1)
+    assert detector.ejected(MODEL) == []  # Not enough samples yet
+    
+    feed(detector, {A: 0.2, B: 0.25, C: 2.0}, samples=1)
+    
+    assert detector.ejected(MODEL) == [C]
+    assert detector.ejected("qwen3:8b") == []
+    event = detector.events[-1]
+    assert (event["event"], event["server"], event["duration_s"]) == ("ejected", C, 30)
+
+def test_small_absolute_gaps_are_not_outliers(clock):
+    detector = OutlierDetector()
+    # Five times slower, but by only 40ms
+    feed(detector, {A: 0.01, B: 0.01, C: 0.05})
+    
+    assert detector.ejected(MODEL) == []
+
+def test_at_most_the_configured_share_is_ejected(clock):
+    detector = OutlierDetector()
+    feed(detector, {A: 0.2, B: 2.0, C: 2.0, "http://d:11434": 0.2})
+    
+    # Half of four backends: both slow ones may go, but not a third
+    assert sorted(detector.ejected(MODEL)) == [B, C]
+    
+    detector = OutlierDetector()
+    feed(detector, {A: 0.2, B: 2.0, C: 2.0})
+    assert len(detector.ejected(MODEL)) == 1  # floor(3 * 50%)
+
+def test_ejection_ends_and_backs_off_when_repeated(clock):
+    detector = OutlierDetector()
+    feed(detector, {A: 0.2, B: 0.25, C: 2.0})
+    
+    clock.now += 30
+    assert detector.ejected(MODEL) == []
+    assert detector.events[-1]["event"] == "returned"
+    # Back with fresh samples; still slow, so out again and for longer
+    feed(detector, {A: 0.2, B: 0.25, C: 2.0})
+    assert detector.ejected(MODEL) == [C]
+    assert detector.events[-1]["duration_s"] == 60
+    
+    clock.now += 60 + 30 * outliers_module.MAX_BACKOFF * 2
+    detector.ejected(MODEL)
+    feed(detector, {A: 0.2, B: 0.25, C: 2.0})
+    assert detector.events[-1]["duration_s"] == 30  # Long enough ago to start over
+
+def test_disabled(monkeypatch, clock):
+    monkeypatch.setattr(settings, "outlier_ejection", False)
+    detector = OutlierDetector()
+    feed(detector, {A: 0.2, B: 0.25, C: 2.0})
+    
+    assert detector.ejected(MODEL) == []
+
+def test_balancer_skips_ejected_servers_unless_none_are_left(clock):
+    balancer = LoadBalancer()
+    balancer.servers = [ServerStatus(A), ServerStatus(B)]
+    balancer._client = httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: httpx.Response(200, json={"host": request.url.host}))
+    )
+    feed(balancer.outliers, {B: 0.2, A: 2.0})
+    assert balancer.outliers.ejected(MODEL) == [A]
+    
+    async def send(model: str, preferred_server: str) -> str:
+        response, _ = await balancer.proxy_request(
+            "POST", "/api/show", json_data={}, model=model, preferred_server=preferred_server
+        )
+        return response.json()["host"]
+    
+    assert asyncio.run(send(MODEL, A)) == "b"
+    assert asyncio.run(send("qwen3:8b", A)) == "a"  # Ejected for the other model only
+    balancer.get_server(B).is_healthy = False
+    assert asyncio.run(send(MODEL, B)) == "a"  # A slow answer beats none
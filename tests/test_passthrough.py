@@ -0,0 +1,110 @@
+"""
+Tests for raw-body passthrough of proxied requests
+"""
+
+import json
+import pytest
+from fastapi import HTTPException
+from fastapi.exceptions import RequestValidationError
+from app.config import settings
+from app.passthrough import insert_field, parse_chat, parse_embed, parse_generate
+
+@pytest.fixture(autouse=True)
+def passthrough(monkeypatch):
+    monkeypatch.setattr(settings, "proxy_passthrough", True)
+
+def test_body_is_forwarded_as_received():
+    body = b'{"model": "llama3:8b",  "prompt": "hi", "stream": true, "options": {"seed": 1}, "x-new-field": [1, 2]}'
+    payload = parse_generate(body)
+    
+    assert payload.body is body
+    assert payload.model == "llama3:8b"
+    assert payload.stream is True
+    assert payload.prompt == "hi"
+
+def test_missing_stream_is_made_explicit():
+    payload = parse_generate(b'{"model": "llama3:8b", "prompt": "hi"}')
+    
+    assert payload.stream is False
+    assert payload.body == b'{"stream":false,"model": "llama3:8b", "prompt": "hi"}'
+    assert json.loads(payload.body) == {"stream": False, "model": "llama3:8b", "prompt": "hi"}
+
+def test_chat_fields():
+    messages = [{"role": "system", "content": "Be brief"}, {"role": "user", "content": "Hello"}]
+    payload = parse_chat(json.dumps({"model": "llama3:8b", "messages": messages, "stream": False}).encode())
+    
+    assert payload.messages == messages
+    assert payload.prompt == "system: Be brief\nuser: Hello"
+    assert payload.prefix_text == payload.prompt
+
+def test_prefix_is_the_conversation_opening():
+    messages = [
+        {"role": "system", "content": "Be brief"},
+        {"role": "user", "content": "Hello"},
+        {"role": "assistant", "content": "Hi"},
+        {"role": "user", "content": "Next"}
+    ]
+    payload = parse_chat(json.dumps({"model": "llama3:8b", "messages": messages}).encode())
+    
+    assert payload.prefix_text == "system: Be brief\nuser: Hello"
+    generate = parse_generate(b'{"model": "m", "prompt": "question", "system": "You are a bot"}')
+    assert generate.prefix_text == "You are a bot"
+
+@pytest.mark.parametrize("body, error", [
+    (b'{"model": "m"', "Invalid JSON body"),
+    (b'["model"]', "must be a JSON object"),
+    (b'{"prompt": "hi"}', "'model' is required"),
+    (b'{"model": "m", "stream": "yes"}', "'stream' must be a boolean"),
+    (b'{"model": "m", "prompt": 1}', "'prompt' must be a string")
+])
+def test_invalid_generate_bodies(body, error):
+    with pytest.raises(HTTPException) as raised:
+        parse_generate(body)
+    
+    assert raised.value.status_code == 422
+    assert error in raised.value.detail
+
+def test_invalid_chat_messages():
+    with pytest.raises(HTTPException):
+        parse_chat(b'{"model": "m", "messages": ["hello"]}')
+
+def test_embed_inputs():
+    assert parse_embed(b'{"model": "m", "input": "one"}').inputs == ["one"]
+    assert parse_embed(b'{"model": "m", "input": ["one", "two"]}').inputs == ["one", "two"]
+    assert parse_embed(b'{"model": "m", "prompt": "one"}', legacy=True).inputs == ["one"]
+    with pytest.raises(HTTPException):
+        parse_embed(b'{"model": "m", "input": [1]}')
+
+def test_validation_without_passthrough(monkeypatch):
+    monkeypatch.setattr(settings, "proxy_passthrough", False)
+    payload = parse_generate(b'{"model": "llama3:8b", "prompt": "hi"}')
+    
+    assert json.loads(payload.body)["model"] == "llama3:8b"
+    assert payload.stream is False
+    with pytest.raises(RequestValidationError):
+        parse_generate(b'{"prompt": "hi"}')
+
+def test_insert_field_splices_in_front():
+    assert insert_field(b' {"model": "m"}', "context", b"[1,2]") == b' {"context":[1,2],"model": "m"}'
+
+def test_proxy_fields_are_not_forwarded():
+    payload = parse_generate(b'{"model": "m", "prompt": "hi", "stream": false, "context_handle": true}')
+    assert payload.context_handle is True
+    assert json.loads(payload.body) == {"model": "m", "prompt": "hi", "stream": False}
+    
+    chat = parse_chat(b'{"model": "m", "messages": [], "session_id": "chat_1"}')
+    assert chat.session_id == "chat_1"
+    assert json.loads(chat.body) == {"stream": False, "model": "m", "messages": []}
+
+def test_inserted_field_replaces_the_request_value():
+    payload = parse_generate(b'{"model": "m", "prompt": "hi", "context": null, "context_handle": "ctx_1"}')
+    payload.insert_field("context", b"[1,2,3]")
+    
+    assert payload.body.count(b'"context"') == 1
+    assert json.loads(payload.body) == {"context": [1, 2, 3], "model": "m", "prompt": "hi", "stream": False}
+
+def test_context_and_handle_are_exclusive():
+    with pytest.raises(HTTPException):
+        parse_generate(b'{"model": "m", "prompt": "hi", "context": [1], "context_handle": "ctx_1"}')
+    with pytest.raises(HTTPException):
+        parse_generate(b'{"model": "m", "prompt": "hi", "context_handle": 1}')
@@ -0,0 +1,76 @@
+"""
+Tests for the demand-driven placement plan
+"""
+
+import pytest
+from app.config import settings
+from app.load_balancer import ServerStatus
+from app.placement import GB, plan_placement
+
+def server(url: str, models: dict, resident=()) -> ServerStatus:
+    status = ServerStatus(url)
+    status.models = [{"name": name, "size": size_gb * GB} for name, size_gb in models.items()]
+    status.resident = set(resident)
+    return status
+
+def actions(plan: dict) -> set:
+    return {(a["action"], a["server"], a["model"]) for a in plan["actions"]}
+
+@pytest.fixture(autouse=True)
+def placement_settings(monkeypatch):
+    monkeypatch.setattr(settings, "placement_node_capacity_gb", 80)
+    monkeypatch.setattr(settings, "placement_node_capacities", {})
+    monkeypatch.setattr(settings, "placement_min_replicas", 1)
+    monkeypatch.setattr(settings, "placement_model_min_replicas", {})
+
+def test_hot_model_gets_replicas_in_proportion_to_demand():
+    servers = [
+        server("http://a", {"llama3:8b": 5, "qwen2:7b": 5}),
+        server("http://b", {"qwen2:7b": 5}),
+        server("http://c", {"qwen2:7b": 5}),
+        server("http://d", {"qwen2:7b": 5})
+    ]
+    demand = {"llama3:8b": {"requests": 30, "busy_ms": 3000}, "qwen2:7b": {"requests": 10, "busy_ms": 1000}}
+    plan = plan_placement(servers, demand)
+    assert plan["models"]["llama3:8b"]["target_replicas"] == 3  # ceil(4 * 0.75)
+    assert plan["models"]["qwen2:7b"]["target_replicas"] == 1  # ceil(4 * 0.25)
+    pulls = {(url, model) for action, url, model in actions(plan) if action == "pull"}
+    assert len(pulls) == 2 and all(model == "llama3:8b" for _, model in pulls)
+    deletes = [a for a in plan["actions"] if a["action"] == "delete"]
+    assert len(deletes) == 3 and all(a["model"] == "qwen2:7b" for a in deletes)
+
+def test_model_without_demand_is_consolidated_but_not_from_where_it_is_loaded():
+    servers = [
+        server("http://a", {"llama3:8b": 5}),
+        server("http://b", {"llama3:8b": 5}, resident=["llama3:8b"]),
+        server("http://c", {"llama3:8b": 5})
+    ]
+    plan = plan_placement(servers, {})
+    assert plan["models"]["llama3:8b"]["target_replicas"] == 1
+    assert actions(plan) == {("delete", "http://a", "llama3:8b"), ("delete", "http://c", "llama3:8b")}
+
+def test_model_minimum_is_a_floor(monkeypatch):
+    monkeypatch.setattr(settings, "placement_model_min_replicas", {"nomic-embed-text:latest": 2})
+    servers = [
+        server("http://a", {"nomic-embed-text": 1, "llama3:8b": 5}),
+        server("http://b", {"llama3:8b": 5})
+    ]
+    plan = plan_placement(servers, {"llama3:8b": {"requests": 100, "busy_ms": 100000}})
+    assert plan["models"]["nomic-embed-text:latest"]["target_replicas"] == 2
+    assert ("pull", "http://b", "nomic-embed-text:latest") in actions(plan)
+
+def test_pulls_respect_node_capacity(monkeypatch):
+    monkeypatch.setattr(settings, "placement_node_capacities", {"http://b": 10})
+    servers = [
+        server("http://a", {"llama3:70b": 40}),
+        server("http://b", {}),
+        server("http://c", {})
+    ]
+    plan = plan_placement(servers, {"llama3:70b": {"requests": 10, "busy_ms": 5000}})
+    assert actions(plan) == {("pull", "http://c", "llama3:70b")}
+    assert plan["servers"]["http://b"]["planned_models"] == []
+
+def test_balanced_placement_needs_no_actions():
+    servers = [server("http://a", {"llama3:8b": 5}), server("http://b", {"qwen2:7b": 5})]
+    demand = {"llama3:8b": {"requests": 1, "busy_ms": 100}, "qwen2:7b": {"requests": 1, "busy_ms": 100}}
+    assert plan_placement(servers, demand)["actions"] == []
@@ -0,0 +1,139 @@
+"""
+Tests for the runtime backend registry
+"""
+
+import asyncio
+import json
+import os
+import pytest
+from app import registry as registry_module
+from app.config import settings
+from app.load_balancer import LoadBalancer
+from app.registry import BackendRegistry, ServerExistsError, UnknownServerError
+
+A, B, C = "http://a:11434", "http://b:11434", "http://c:11434"
+
+class CheckedBalancer(LoadBalancer):
+    """Load balancer whose health sweep marks every server healthy without contacting it"""
+    
+    def __init__(self):
+        super().__init__()
+        self.sweeps = 0
+    
+    async def refresh_model_catalog(self):
+        self.sweeps += 1
+        for server in self.servers:
+            server.is_healthy = True
+
+@pytest.fixture
+def balancer(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "backends_file", str(tmp_path / "backends.json"))
+    monkeypatch.setattr(settings, "ollama_servers", [A, B])
+    balancer = CheckedBalancer()
+    monkeypatch.setattr(registry_module, "load_balancer", balancer)
+    return balancer
+
+def urls(balancer: LoadBalancer) -> list:
+    return [server.url for server in balancer.servers]
+
+def read_file() -> dict:
+    with open(settings.backends_file) as f:
+        return json.load(f)
+
+def test_starts_from_ollama_servers_without_a_file(balancer):
+    registry = BackendRegistry()
+    asyncio.run(registry.reload(check_new=False))
+    
+    assert urls(balancer) == [A, B]
+    assert all(server.is_healthy for server in balancer.servers)
+    assert registry.get_status()["source"] == "OLLAMA_SERVERS"
+    assert not os.path.exists(settings.backends_file)
+
+def test_added_servers_wait_for_a_health_check(balancer):
+    registry = BackendRegistry()
+    
+    async def run():
+        await registry.reload(check_new=False)
+        return await registry.add(C + "/", weight=2)
+    
+    assert asyncio.run(run()) == C
+    
+    assert urls(balancer) == [A, B, C]
+    assert balancer.sweeps == 1 and balancer.get_server(C).is_healthy
+    assert balancer.capacity.weight(C) == 2
+    # The file now holds the servers taken from OLLAMA_SERVERS too
+    assert read_file() == {A: {}, B: {}, C: {"weight": 2}}
+    assert registry.get_status()["source"] == "file"
+    
+    with pytest.raises(ServerExistsError):
+        asyncio.run(registry.add(C))
+
+def test_new_servers_take_no_requests_until_checked(balancer):
+    balancer.servers = []
+    balancer.sync_servers({A: {}}, checked=False)
+    balancer.sync_servers({A: {}, B: {}}, checked=True)
+    
+    assert [server.is_healthy for server in balancer.servers] == [True, False]
+    assert balancer.get_next_server().url == A
+
+def test_drained_servers_get_no_new_requests(balancer):
+    registry = BackendRegistry()
+    
+    async def run():
+        await registry.reload(check_new=False)
+        await registry.update(A, drain=True)
+    
+    asyncio.run(run())
+    
+    assert balancer.get_server(A).draining
+    assert {balancer.get_next_server().url for _ in range(4)} == {B}
+    assert read_file()[A] == {"drain": True}
+    
+    asyncio.run(registry.update(A, drain=False))
+    assert {balancer.get_next_server().url for _ in range(4)} == {A, B}
+    with pytest.raises(UnknownServerError):
+        asyncio.run(registry.update(C, drain=True))
+
+def test_removed_server_stays_until_its_requests_finish(balancer):
+    registry = BackendRegistry()
+    asyncio.run(registry.reload(check_new=False))
+    server = balancer.get_server(A)
+    balancer._acquire(server)
+    
+    asyncio.run(registry.remove(A))
+    
+    assert urls(balancer) == [A, B]
+    assert server.removing and server.draining
+    assert balancer.get_next_server().url == B
+    
+    balancer._release(server)
+    assert urls(balancer) == [B]
+    assert read_file() == {B: {}}
+
+def test_hand_edits_are_picked_up_and_invalid_files_ignored(balancer):
+    registry = BackendRegistry()
+    asyncio.run(registry.reload(check_new=False))
+    
+    with open(settings.backends_file, "w") as f:
+        json.dump({B: {"drain": True}, C: {}}, f)
+    asyncio.run(registry.reload())
+    
+    assert urls(balancer) == [B, C]
+    assert balancer.get_server(B).draining
+    
+    with open(settings.backends_file, "w") as f:
+        json.dump({C: {"weight": -1}}, f)
+    asyncio.run(registry.reload())
+    
+    assert urls(balancer) == [B, C]  # Unchanged
+
+@pytest.mark.parametrize("data", [
+    ["http://a:11434"],
+    {"ftp://a:11434": {}},
+    {A: {"weight": 0}},
+    {A: {"weight": True}},
+    {A: {"drain": "yes"}}
+])
+def test_invalid_registry_contents(data):
+    with pytest.raises(ValueError):
+        registry_module._parse(data)
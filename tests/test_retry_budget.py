@@ -0,0 +1,46 @@
+"""
+Tests for the failover retry budget
+"""
+
+from types import SimpleNamespace
+import pytest
+from app import retry_budget as retry_budget_module
+from app.config import settings
+from app.retry_budget import RetryBudget, WINDOW
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(retry_budget_module, "time", SimpleNamespace(monotonic=lambda: now.value))
+    return now
+
+@pytest.fixture
+def budget(monkeypatch, clock):
+    monkeypatch.setattr(settings, "retry_budget_ratio", 0.5)
+    monkeypatch.setattr(settings, "retry_budget_min_per_second", 0.0)
+    return RetryBudget()
+
+def test_retries_are_limited_to_the_ratio(budget):
+    for _ in range(4):
+        budget.record_request()
+    assert budget.try_retry()
+    assert budget.try_retry()
+    assert not budget.try_retry()
+    status = budget.get_status()
+    assert (status["requests"], status["retries"], status["total_denied"]) == (4, 2, 1)
+
+def test_budget_recovers_once_the_window_passes(budget, clock):
+    for _ in range(2):
+        budget.record_request()
+    assert budget.try_retry()
+    assert not budget.try_retry()
+    clock.value += WINDOW
+    for _ in range(2):
+        budget.record_request()
+    assert budget.try_retry()
+
+def test_minimum_allows_retries_without_traffic(budget, monkeypatch):
+    monkeypatch.setattr(settings, "retry_budget_min_per_second", 0.2)  # 2 per window
+    assert budget.try_retry()
+    assert budget.try_retry()
+    assert not budget.try_retry()
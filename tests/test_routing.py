@@ -0,0 +1,96 @@
+"""
+Tests for prefix-affinity routing: consistent-hash ring and bounded loads
+"""
+
+import pytest
+from app.config import settings
+from app.load_balancer import LoadBalancer
+from app.routing import HashRing, load_capacity, prefix_key
+
+SERVERS = [f"http://node{i}:11434" for i in range(4)]
+KEYS = [prefix_key("llama3:8b", f"system prompt {i}", 512) for i in range(2000)]
+
+def owners(ring: HashRing) -> dict:
+    return {key: next(ring.walk(key)) for key in KEYS}
+
+def test_walk_visits_every_server_once():
+    ring = HashRing(SERVERS)
+    assert sorted(ring.walk(KEYS[0])) == sorted(SERVERS)
+
+def test_ring_does_not_depend_on_server_order():
+    assert owners(HashRing(SERVERS)) == owners(HashRing(list(reversed(SERVERS))))
+
+def test_adding_a_server_only_moves_keys_to_it():
+    before = owners(HashRing(SERVERS))
+    after = owners(HashRing(SERVERS + ["http://node4:11434"]))
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert all(after[key] == "http://node4:11434" for key in moved)
+    # About a fifth of the keys belong to the new server
+    assert 0.1 < len(moved) / len(KEYS) < 0.3
+
+def test_removing_a_server_only_moves_its_keys():
+    before = owners(HashRing(SERVERS))
+    after = owners(HashRing(SERVERS[1:]))
+    for key in KEYS:
+        if before[key] != SERVERS[0]:
+            assert after[key] == before[key]
+
+def test_prefix_key_ignores_whitespace_and_text_past_the_prefix():
+    assert prefix_key("m", "You are  a\nhelpful assistant", 20) == prefix_key("m", "You are a helpful assistant", 20)
+    assert prefix_key("m", "A" * 30 + "x", 30) == prefix_key("m", "A" * 30 + "y", 30)
+    assert prefix_key("m", "same", 30) != prefix_key("other", "same", 30)
+
+def test_load_capacity():
+    assert load_capacity(0, 4, 1.25) == 1
+    assert load_capacity(9, 3, 1.25) == 5  # ceil(1.25 * 10 / 3)
+    # A server with twice the weight may take twice the share
+    assert load_capacity(9, 4.0, 1.25, weight=2.0) == 7  # ceil(1.25 * 10 * 2 / 4)
+
+@pytest.mark.parametrize("total_load", [0, 1, 7, 50, 333])
+def test_load_capacity_leaves_room_for_the_request(total_load):
+    # The capacities of all servers together always fit the new request
+    assert load_capacity(total_load, 3, 1.0) * 3 >= total_load + 1
+
+@pytest.fixture
+def balancer(monkeypatch):
+    monkeypatch.setattr(settings, "residency_tracking", False)
+    monkeypatch.setattr(settings, "capacity_weighting", False)
+    monkeypatch.setattr(settings, "backend_weights", {})
+    lb = LoadBalancer()
+    lb.sync_servers({url: {} for url in SERVERS})
+    for server in lb.servers:
+        server.models = [{"name": "llama3:8b"}]
+    return lb
+
+def test_affinity_is_stable_while_under_capacity(balancer):
+    key = KEYS[0]
+    owner = balancer.get_affinity_server(key, 1.25, model="llama3:8b")
+    assert owner.url == next(HashRing(SERVERS).walk(key))
+    for server in balancer.servers:
+        server.current_load = 1  # Capacity: ceil(1.25 * 5 / 4) = 2
+    assert balancer.get_affinity_server(key, 1.25, model="llama3:8b") is owner
+    assert balancer.affinity_hits == 2
+
+def test_affinity_spills_to_the_next_server_when_saturated(balancer):
+    key = KEYS[0]
+    first, second = list(HashRing(SERVERS).walk(key))[:2]
+    balancer.get_server(first).current_load = 5  # Capacity: ceil(1.25 * 6 / 4) = 2
+    assert balancer.get_affinity_server(key, 1.25, model="llama3:8b").url == second
+    assert balancer.affinity_spills == 1
+
+def test_affinity_only_uses_servers_with_the_model(balancer):
+    for server in balancer.servers[1:]:
+        server.models = [{"name": "qwen2:7b"}]
+    for key in KEYS[:50]:
+        assert balancer.get_affinity_server(key, 1.25, model="llama3:8b").url == SERVERS[0]
+
+def test_affinity_capacity_scales_with_weight(balancer, monkeypatch):
+    key = KEYS[0]
+    owner = next(HashRing(SERVERS).walk(key))
+    for server in balancer.servers:
+        server.current_load = 5 if server.url == owner else 2
+    # Equal weights: the owner may hold ceil(1.25 * 12 / 4) = 4 requests
+    assert balancer.get_affinity_server(key, 1.25, model="llama3:8b").url != owner
+    # Weight 4 of 7 in total: ceil(1.25 * 12 * 4 / 7) = 9
+    monkeypatch.setattr(settings, "backend_weights", {owner: 4.0})
+    assert balancer.get_affinity_server(key, 1.25, model="llama3:8b").url == owner
@@ -0,0 +1,78 @@
+"""
+Tests for the priority lanes: admission order, bulk reservation and aging
+"""
+
+import asyncio
+import pytest
+from app.config import settings
+from app.scheduler import PriorityScheduler, QueueTimeoutError, resolve_lane
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    # One slot in total, none reserved from bulk
+    monkeypatch.setattr(settings, "priority_slots_per_server", 1)
+    monkeypatch.setattr(settings, "workers", 1)
+    monkeypatch.setattr(settings, "priority_reserved_fraction", 0.0)
+    monkeypatch.setattr(settings, "priority_queue_timeout", 5)
+    return PriorityScheduler(lambda: 1)
+
+async def admission_order(scheduler: PriorityScheduler, bulk_head_start: float) -> list:
+    """Queue a bulk request, then an interactive one, behind a busy slot"""
+    order = []
+    
+    async def request(lane: str):
+        await scheduler.acquire(lane)
+        order.append(lane)
+        scheduler.release(lane)
+    
+    await scheduler.acquire("interactive")
+    bulk = asyncio.create_task(request("bulk"))
+    await asyncio.sleep(bulk_head_start)
+    interactive = asyncio.create_task(request("interactive"))
+    await asyncio.sleep(0)
+    scheduler.release("interactive")
+    await asyncio.gather(bulk, interactive)
+    return order
+
+def test_interactive_goes_before_waiting_bulk(scheduler, monkeypatch):
+    monkeypatch.setattr(settings, "priority_aging_seconds", 60)
+    assert asyncio.run(admission_order(scheduler, 0.05)) == ["interactive", "bulk"]
+    assert scheduler.aged == 0
+
+def test_aged_bulk_competes_as_interactive(scheduler, monkeypatch):
+    monkeypatch.setattr(settings, "priority_aging_seconds", 0.05)
+    assert asyncio.run(admission_order(scheduler, 0.1)) == ["bulk", "interactive"]
+    assert scheduler.aged == 1
+
+def test_bulk_cannot_use_reserved_slots(monkeypatch):
+    monkeypatch.setattr(settings, "priority_slots_per_server", 4)
+    monkeypatch.setattr(settings, "workers", 1)
+    monkeypatch.setattr(settings, "priority_reserved_fraction", 0.25)
+    monkeypatch.setattr(settings, "priority_queue_timeout", 0.05)
+    scheduler = PriorityScheduler(lambda: 1)
+    assert scheduler.capacity == 4 and scheduler.bulk_limit == 3
+    
+    async def fill():
+        for _ in range(3):
+            await scheduler.acquire("bulk")
+        with pytest.raises(QueueTimeoutError):
+            await scheduler.acquire("bulk")
+        await scheduler.acquire("interactive")  # The reserved slot
+    
+    asyncio.run(fill())
+    assert scheduler.in_flight == {"admin": 0, "interactive": 1, "bulk": 3}
+    assert scheduler.timeouts["bulk"] == 1
+
+def test_capacity_is_shared_by_workers(monkeypatch):
+    monkeypatch.setattr(settings, "priority_slots_per_server", 4)
+    monkeypatch.setattr(settings, "workers", 3)
+    assert PriorityScheduler(lambda: 2).capacity == 3  # ceil(2 * 4 / 3)
+
+def test_resolve_lane():
+    assert resolve_lane(None, "admin") == "admin"
+    assert resolve_lane(None, "user") == "interactive"
+    assert resolve_lane("bulk", "user") == "bulk"
+    # Requests can lower their priority but not raise it
+    assert resolve_lane(None, "user", "bulk") == "bulk"
+    assert resolve_lane("bulk", "user", "admin") == "bulk"
+    assert resolve_lane(None, "user", "unknown") == "interactive"
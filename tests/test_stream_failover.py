@@ -0,0 +1,66 @@
+"""
+Tests for failing streams over until their first chunk arrives
+"""
+
+import asyncio
+import httpx
+import pytest
+from app.config import settings
+from app.load_balancer import LoadBalancer, ServerStatus
+
+BAD, GOOD = "http://bad:11434", "http://good:11434"
+
+async def chunks(*parts: bytes, stall: float = 0):
+    if stall:
+        await asyncio.sleep(stall)
+    for part in parts:
+        yield part
+
+def balancer_with(bad_body) -> LoadBalancer:
+    """Two servers: `bad` answers with `bad_body()`, `good` streams two lines"""
+    balancer = LoadBalancer()
+    balancer.servers = [ServerStatus(BAD), ServerStatus(GOOD)]
+    balancer.sent_to = []
+    
+    async def handle(request: httpx.Request) -> httpx.Response:
+        balancer.sent_to.append(request.url.host)
+        if request.url.host == "bad":
+            return httpx.Response(200, content=bad_body())
+        return httpx.Response(200, content=chunks(b'{"response": "a"}\n', b'{"done": true}\n'))
+    
+    balancer._client = httpx.AsyncClient(transport=httpx.MockTransport(handle))
+    return balancer
+
+async def stream(balancer: LoadBalancer):
+    response, server_url = await balancer.proxy_request(
+        "POST", "/api/generate", json_data={}, stream=True, preferred_server=BAD
+    )
+    return server_url, b"".join([chunk async for chunk in balancer.relay_stream(response, server_url)])
+
+@pytest.fixture(autouse=True)
+def short_first_byte(monkeypatch):
+    monkeypatch.setattr(settings, "backend_first_byte_timeout", 0.1)
+
+@pytest.mark.parametrize("bad_body", [
+    lambda: chunks(b'{"error": "model requires more system memory"}\n'),
+    lambda: chunks(),
+    lambda: chunks(b'{"response": "late"}\n', stall=5)
+], ids=["error line", "empty", "no first chunk in time"])
+def test_fails_over_before_the_first_chunk(bad_body):
+    balancer = balancer_with(bad_body)
+    
+    server_url, body = asyncio.run(stream(balancer))
+    
+    assert balancer.sent_to == ["bad", "good"]
+    assert (server_url, body) == (GOOD, b'{"response": "a"}\n{"done": true}\n')
+    assert balancer.get_server(BAD).fail_count == 1
+    assert [server.current_load for server in balancer.servers] == [0, 0]
+
+def test_committed_after_the_first_chunk():
+    balancer = balancer_with(lambda: chunks(b'{"response": "a"}\n', b'{"error": "out of memory"}\n'))
+    
+    server_url, body = asyncio.run(stream(balancer))
+    
+    # The error arrives after bytes went out, so it is relayed as is
+    assert balancer.sent_to == ["bad"]
+    assert (server_url, body) == (BAD, b'{"response": "a"}\n{"error": "out of memory"}\n')
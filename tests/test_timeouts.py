@@ -0,0 +1,115 @@
+"""
+Tests for backend timeouts and request deadlines
+"""
+
+from types import SimpleNamespace
+import asyncio
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+import main
+from app import timeouts as timeouts_module
+from app.config import settings
+from app.load_balancer import LoadBalancer, ServerStatus
+from app.timeouts import DeadlineExceeded, backend_timeouts, bounded, current_deadline, remaining, set_deadline
+
+SLOW, FAST = "http://slow:11434", "http://fast:11434"
+
+async def slow_body():
+    yield b'{"response": "a"}\n'
+    await asyncio.sleep(5)
+    yield b'{"response": "b"}\n'
+
+@pytest.fixture
+def balancer(monkeypatch):
+    monkeypatch.setattr(settings, "backend_first_byte_timeout", 0.1)
+    monkeypatch.setattr(settings, "backend_idle_timeout", 0.1)
+    balancer = LoadBalancer()
+    balancer.servers = [ServerStatus(SLOW), ServerStatus(FAST)]
+    balancer.sent_to = []
+    
+    async def handle(request: httpx.Request) -> httpx.Response:
+        """The slow server takes long to answer; streams go quiet after their first line"""
+        balancer.sent_to.append(request.url.host)
+        if request.url.host == "slow":
+            await asyncio.sleep(5)
+        if request.url.path == "/api/generate":
+            return httpx.Response(200, content=slow_body())
+        return httpx.Response(200, json={"response": request.url.host})
+    
+    balancer._client = httpx.AsyncClient(transport=httpx.MockTransport(handle))
+    return balancer
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=100.0)
+    monkeypatch.setattr(timeouts_module, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+def test_per_model_overrides(monkeypatch):
+    monkeypatch.setattr(settings, "backend_connect_timeout", 5)
+    monkeypatch.setattr(settings, "backend_first_byte_timeout", 300)
+    monkeypatch.setattr(settings, "backend_idle_timeout", 60)
+    monkeypatch.setattr(settings, "backend_timeout_models", {"llama3:70b": {"first_byte": 900}})
+    
+    slow_model, other = backend_timeouts("llama3:70b"), backend_timeouts("llama3:8b")
+    
+    assert (slow_model.connect, slow_model.first_byte, slow_model.idle) == (5, 900, 60)
+    assert (other.connect, other.first_byte, other.idle) == (5, 300, 60)
+
+def test_timeouts_are_cut_to_the_deadline(clock):
+    assert remaining(None) is None
+    assert bounded(30, None) == 30
+    assert remaining(110.0) == 10
+    assert bounded(30, 110.0) == 10
+    assert bounded(5, 110.0) == 5
+    
+    clock.now = 110.0
+    with pytest.raises(DeadlineExceeded):
+        bounded(30, 110.0)
+
+def test_deadline_is_per_request(clock):
+    async def request(seconds):
+        set_deadline(seconds)
+        return current_deadline()
+    
+    async def run():
+        return await asyncio.gather(request(10), request(20)), current_deadline()
+    
+    assert asyncio.run(run()) == ([110.0, 120.0], None)
+
+def test_slow_first_byte_fails_over(balancer):
+    async def run():
+        response, server_url = await balancer.proxy_request("POST", "/api/show", json_data={}, preferred_server=SLOW)
+        return response.json(), server_url
+    
+    assert asyncio.run(run()) == ({"response": "fast"}, FAST)
+    assert balancer.sent_to == ["slow", "fast"]
+    assert balancer.get_server(SLOW).fail_count == 1
+
+def test_passed_deadline_is_not_failed_over(balancer):
+    async def run():
+        set_deadline(0.05)
+        await balancer.proxy_request("POST", "/api/show", json_data={}, preferred_server=SLOW)
+    
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(run())
+    assert balancer.sent_to == ["slow"]
+    assert balancer.get_server(SLOW).fail_count == 0
+
+def test_idle_stream_ends_with_an_error_line(balancer):
+    async def run():
+        response, server_url = await balancer.proxy_request("POST", "/api/generate", json_data={}, stream=True, preferred_server=FAST)
+        return b"".join([chunk async for chunk in balancer.relay_stream(response, server_url)])
+    
+    body = asyncio.run(run())
+    
+    assert body == b'{"response": "a"}\n{"error":"Backend sent nothing for 0.1s"}\n'
+    assert balancer.get_server(FAST).current_load == 0
+
+@pytest.mark.parametrize("value", ["0", "-1", "soon", str(settings.max_request_timeout + 1)])
+def test_invalid_request_timeout_is_rejected(value):
+    response = TestClient(main.app).get("/livez", headers={"X-Request-Timeout": value})
+    
+    assert response.status_code == 400
+    assert "X-Request-Timeout" in response.json()["detail"]
@@ -0,0 +1,89 @@
+"""
+Tests for per-request phase timing and the Server-Timing header
+"""
+
+from types import SimpleNamespace
+import asyncio
+import logging
+import re
+import pytest
+from fastapi.testclient import TestClient
+import main
+from app import timing as timing_module
+from app.config import settings
+from app.timing import RequestTiming, current_timing, record_phase, start_request_timing, timed
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(value=100.0)
+    monkeypatch.setattr(timing_module, "time", SimpleNamespace(perf_counter=lambda: now.value))
+    return now
+
+def test_phases_accumulate(clock):
+    timing = RequestTiming()
+    timing.add("backend_connect", 0.010)
+    timing.add("queue_wait", 0.002)
+    timing.add("backend_connect", 0.005)  # Retried on another server
+    clock.value += 0.5
+    timing.finish()
+    clock.value += 1  # Ignored once finished
+    
+    assert timing.phases == pytest.approx({"backend_connect": 15.0, "queue_wait": 2.0})
+    assert timing.total_ms == pytest.approx(500.0)
+    assert timing.server_timing() == "backend_connect;dur=15.0, queue_wait;dur=2.0, total;dur=500.0"
+    assert str(timing) == " backend_connect=15.0ms queue_wait=2.0ms"
+
+def test_without_phases_only_total_is_reported(clock):
+    timing = RequestTiming()
+    clock.value += 0.25
+    
+    assert timing.server_timing() == "total;dur=250.0"
+    assert str(timing) == ""
+
+def test_phases_go_to_the_current_request(clock):
+    async def request(phase: str) -> RequestTiming:
+        timing = start_request_timing()
+        with timed(phase):
+            clock.value += 0.1
+            await asyncio.sleep(0)
+        return timing
+    
+    async def run():
+        return await asyncio.gather(request("auth"), request("rate_limit"))
+    
+    auth, rate_limit = asyncio.run(run())
+    
+    assert set(auth.phases) == {"auth"}
+    assert set(rate_limit.phases) == {"rate_limit"}
+
+def test_record_phase_outside_a_request_is_ignored():
+    async def run():
+        record_phase("auth", 1.0)
+        return current_timing()
+    
+    assert asyncio.run(run()) is None
+
+def test_server_timing_header_and_access_line(monkeypatch, caplog):
+    monkeypatch.setattr(settings, "slow_request_threshold_ms", 0)
+    client = TestClient(main.app)
+    
+    with caplog.at_level(logging.INFO, logger="access"):
+        response = client.get("/livez")
+    
+    assert re.fullmatch(r"total;dur=\d+\.\d", response.headers["server-timing"])
+    [record] = [r for r in caplog.records if r.name == "access"]
+    assert record.getMessage().startswith("GET /livez - 200 - ")
+    assert record.path == "/livez"
+    assert record.phases_ms == {}
+
+def test_slow_requests_are_logged_separately(monkeypatch, caplog):
+    monkeypatch.setattr(settings, "slow_request_threshold_ms", 1)
+    monkeypatch.setattr(RequestTiming, "total_ms", property(lambda self: 5000.0))
+    client = TestClient(main.app)
+    
+    with caplog.at_level(logging.INFO):
+        client.get("/livez")
+    
+    [record] = [r for r in caplog.records if r.name == "slow_requests"]
+    assert record.levelno == logging.WARNING
+    assert record.duration_ms == 5000.0
@@ -0,0 +1,91 @@
+"""
+Tests for full-text search over usage logs
+"""
+
+from datetime import datetime, timedelta, timezone
+import asyncio
+from sqlalchemy import delete, update
+from app.database import UsageLog, search_usage_logs
+
+NOW = datetime(2026, 1, 15, 12, 0, tzinfo=timezone.utc)
+
+def add_logs(session_factory, *logs):
+    async def insert():
+        async with session_factory() as db:
+            for log in logs:
+                db.add(UsageLog(
+                    username=log.get("username", "alice"),
+                    model=log.get("model", "llama3:8b"),
+                    endpoint="generate",
+                    prompt=log.get("prompt"),
+                    error=log.get("error"),
+                    timestamp=log.get("timestamp", NOW)
+                ))
+            await db.commit()
+    asyncio.run(insert())
+
+def search(session_factory, query, **filters):
+    async def run():
+        async with session_factory() as db:
+            return await search_usage_logs(db, query, **filters)
+    return asyncio.run(run())
+
+def test_matches_prompts_and_errors(session_factory):
+    add_logs(
+        session_factory,
+        {"prompt": "Explain the tokamak divertor"},
+        {"prompt": "Write a poem", "error": "divertor model not found"},
+        {"prompt": "Unrelated question"}
+    )
+    total, rows = search(session_factory, "divertor")
+    
+    assert total == 2
+    assert {row["prompt_snippet"] for row in rows} == {"Explain the tokamak [divertor]", "Write a poem"}
+    assert any(row["error_snippet"] == "[divertor] model not found" for row in rows)
+
+def test_ranks_better_matches_first(session_factory):
+    add_logs(
+        session_factory,
+        {"prompt": "plasma " + "filler " * 40},
+        {"prompt": "plasma plasma plasma"}
+    )
+    total, rows = search(session_factory, "plasma")
+    
+    assert total == 2
+    assert rows[0]["prompt_snippet"] == "[plasma] [plasma] [plasma]"
+    assert rows[0]["rank"] <= rows[1]["rank"]
+
+def test_filters_and_pagination(session_factory):
+    add_logs(
+        session_factory,
+        {"prompt": "magnet coil", "username": "alice", "timestamp": NOW - timedelta(days=2)},
+        {"prompt": "magnet coil", "username": "alice", "model": "qwen3:8b"},
+        {"prompt": "magnet coil", "username": "bob"}
+    )
+    
+    assert search(session_factory, "magnet", username="alice")[0] == 2
+    assert search(session_factory, "magnet", model="qwen3:8b")[0] == 1
+    assert search(session_factory, "magnet", since=NOW - timedelta(days=1))[0] == 2
+    assert search(session_factory, "magnet", until=NOW - timedelta(days=1))[0] == 1
+    
+    total, rows = search(session_factory, "magnet", limit=2, offset=2)
+    assert total == 3
+    assert len(rows) == 1
+
+def test_index_follows_updates_and_deletes(session_factory):
+    add_logs(session_factory, {"prompt": "old wording"})
+    
+    async def edit():
+        async with session_factory() as db:
+            await db.execute(update(UsageLog).values(prompt="new wording"))
+            await db.commit()
+    asyncio.run(edit())
+    assert search(session_factory, "old")[0] == 0
+    assert search(session_factory, "new")[0] == 1
+    
+    async def remove():
+        async with session_factory() as db:
+            await db.execute(delete(UsageLog))
+            await db.commit()
+    asyncio.run(remove())
+    assert search(session_factory, "new") == (0, [])